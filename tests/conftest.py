@@ -0,0 +1,112 @@
+import http.server
+import importlib.util
+import os
+import re
+import socket
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app():
+    """yt-dlp-ultimate.py как модуль. С --cli в argv он импортируется без customtkinter"""
+    if 'yt_dlp_ultimate' in sys.modules:
+        return sys.modules['yt_dlp_ultimate']
+    argv = sys.argv
+    sys.argv = [argv[0], '--cli']
+    try:
+        spec = importlib.util.spec_from_file_location('yt_dlp_ultimate', os.path.join(ROOT, 'yt-dlp-ultimate.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['yt_dlp_ultimate'] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+    return module
+
+
+@pytest.fixture(scope='session')
+def app():
+    return load_app()
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Раздаёт папку с поддержкой Range (без неё ffmpeg не перейдёт к отрезку) и считает байты Range-ответов"""
+
+    root = None
+    counter = None
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, directory=self.root, **kw)
+
+    def log_message(self, *a):
+        pass
+
+    def setup(self):
+        super().setup()
+        # Маленький буфер отправки: после закрытия соединения ffmpeg в счётчик попадает не больше него
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 64 * 1024)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        m = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range') or '')
+        if not m or not os.path.isfile(path):
+            self.range_left = None
+            return super().send_head()
+        file_size = os.path.getsize(path)
+        first = int(m.group(1) or 0)
+        last = min(int(m.group(2)) if m.group(2) else file_size - 1, file_size - 1)
+        f = open(path, 'rb')
+        f.seek(first)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {first}-{last}/{file_size}')
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.range_left = last - first + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        left = self.range_left
+        while left is None or left > 0:
+            data = source.read(64 * 1024 if left is None else min(64 * 1024, left))
+            if not data:
+                break
+            try:
+                outputfile.write(data)
+            except OSError:
+                break  # ffmpeg закрывает соединение, дочитав нужное
+            if left is not None:
+                self.counter['range_bytes'] += len(data)
+                left -= len(data)
+
+
+@pytest.fixture
+def range_server():
+    """start(root) -> (базовый URL, счётчик {'range_bytes'}); серверы останавливаются после теста"""
+    servers = []
+
+    def start(root):
+        counter = {'range_bytes': 0}
+        handler = type('Handler', (RangeHandler,), {'root': root, 'counter': counter})
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}', counter
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(scope='session')
+def tools(app):
+    """(ffmpeg, ffprobe) как их находит программа; без них тест пропускается"""
+    ffmpeg, ffprobe = app.find_tool(ROOT, 'ffmpeg'), app.find_tool(ROOT, 'ffprobe')
+    if not (os.path.isfile(ffmpeg) and os.path.isfile(ffprobe)):
+        pytest.skip('ffmpeg/ffprobe не найден')
+    return ffmpeg, ffprobe
@@ -0,0 +1,59 @@
+"""Аудио: исходный поток без перекодирования по умолчанию, MP3 - только по запросу"""
+import pytest
+
+
+@pytest.mark.parametrize('codec, do_convert, bitrate, expected', [
+    ('aac', False, 'auto', ('.m4a', ['-c:a', 'copy'])),
+    ('opus', False, 'auto', ('.opus', ['-c:a', 'copy'])),
+    ('vorbis', False, 'auto', ('.ogg', ['-c:a', 'copy'])),
+    ('mp3', True, 'auto', ('.mp3', ['-c:a', 'copy'])),
+    ('pcm_s16le', False, 'auto', ('.mka', ['-c:a', 'copy'])),
+    (None, False, 'auto', ('.mka', ['-c:a', 'copy'])),
+    ('aac', True, 'auto', ('.mp3', ['-c:a', 'libmp3lame', '-b:a', '192k'])),
+    ('mp3', True, '320', ('.mp3', ['-c:a', 'libmp3lame', '-b:a', '320k'])),
+    (None, True, '128', ('.mp3', ['-c:a', 'libmp3lame', '-b:a', '128k'])),
+])
+def test_plan_audio_codec(app, codec, do_convert, bitrate, expected):
+    assert app.plan_audio_codec(codec, do_convert, bitrate) == expected
+
+
+@pytest.mark.parametrize('task, video_settings, expected', [
+    ({}, 'auto', False),
+    ({'conv': False, 'bitrate': 'auto'}, 'auto', False),
+    ({'conv': True, 'bitrate': 'auto'}, 'auto', True),
+    ({'conv': False, 'bitrate': '320'}, 'auto', True),
+    ({'conv': True, 'bitrate': '320'}, 'passthrough', False),
+])
+def test_wants_mp3_only_on_request(app, task, video_settings, expected):
+    profile = app.get_encoding_profile(video_settings, task.get('bitrate', 'auto'))
+    assert app.wants_mp3(task, profile) is expected
+
+
+@pytest.mark.parametrize('encoder, ext', [(['-c:a', 'aac'], '.m4a'), (['-c:a', 'libopus'], '.webm')])
+@pytest.mark.parametrize('mode', ['passthrough', 'mp3'])
+def test_full_audio_output(app, tools, tmp_path, encoder, ext, mode):
+    """Перепаковка сохраняет кодек и длительность и пишет теги; MP3 - только если конвертация запрошена"""
+    ffmpeg, ffprobe = tools
+    src = str(tmp_path / f'source{ext}')
+    try:
+        app.run_ffmpeg([ffmpeg, '-y', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=3', '-ac', '2', *encoder, src])
+    except Exception:
+        pytest.skip(f'ffmpeg не умеет {encoder[1]}')
+    source_codec = app.probe_streams(ffprobe, src)['audio']['codec_name']
+    task = {'conv': mode == 'mp3', 'bitrate': 'auto'}
+    profile = app.get_encoding_profile('auto', 'auto')
+    out_ext, codec_args = app.plan_audio_cut(ffprobe, src, app.wants_mp3(task, profile), 'auto', profile['audio_bitrate'])
+    info = {'title': 'Track', 'uploader': 'Artist', 'upload_date': '20240101', 'webpage_url': 'https://example.com/v'}
+    dst = str(tmp_path / f'out{out_ext}')
+    app.convert_audio(ffmpeg, src, dst, codec_args + app.get_audio_output_args(info, out_ext))
+
+    streams = app.probe_streams(ffprobe, dst)
+    if mode == 'passthrough':
+        assert out_ext == app.AUDIO_COPY_EXT[source_codec]
+        assert streams['audio']['codec_name'] == source_codec
+    else:
+        assert (out_ext, streams['audio']['codec_name']) == ('.mp3', 'mp3')
+    assert app.probe_media(ffprobe, dst)['duration'] == pytest.approx(3, abs=0.2)
+    tags = app.subprocess.run([ffprobe, '-v', 'error', '-show_entries', 'format_tags=title,artist:stream_tags=title,artist',
+                               '-of', 'default=nw=1', dst], capture_output=True, text=True).stdout.lower()
+    assert 'title=track' in tags and 'artist=artist' in tags
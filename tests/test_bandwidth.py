@@ -0,0 +1,62 @@
+"""Доля полосы идущих скачиваний: приоритеты, очистка очереди во время скачивания и -readrate для отрезков"""
+import pytest
+
+
+@pytest.fixture
+def pipeline(app, tmp_path):
+    pipeline = app.DownloadPipeline(str(tmp_path), {}, app.PipelineReporter())
+    yield pipeline
+    pipeline.shutdown()
+
+
+def add(app, pipeline, url):
+    return pipeline.add_task(url, None, None, app.QUALITY_MAP['q_best'], False, 'best', False)
+
+
+def test_priority_of_any_batch_member_changes_batch_weight(app, pipeline):
+    leader, member = add(app, pipeline, 'https://a.com/v'), add(app, pipeline, 'https://a.com/v')
+    pipeline.register_download(leader['key'], [leader, member])
+    pipeline.set_priority(member, 'high')
+    assert pipeline.bandwidth.tasks[leader['key']]['weight'] == app.TASK_PRIORITIES['high']
+    pipeline.unregister_download(leader['key'], [leader, member])
+    assert pipeline.bandwidth.tasks == {} and pipeline.active_downloads == {}
+
+
+def test_old_batch_finishing_after_clear_keeps_new_task_registered(app, pipeline):
+    old = add(app, pipeline, 'https://a.com/old')
+    pipeline.register_download(old['key'], [old])
+    pipeline.clear()
+    new = add(app, pipeline, 'https://a.com/new')
+    assert new['id'] == old['id']  # id после clear() начинаются заново
+    pipeline.register_download(new['key'], [new])
+
+    pipeline.unregister_download(old['key'], [old])
+    assert new['key'] in pipeline.bandwidth.tasks
+    pipeline.set_priority(new, 'high')
+    assert pipeline.bandwidth.tasks[new['key']]['weight'] == app.TASK_PRIORITIES['high']
+
+
+def test_share_follows_weights(app):
+    limiter = app.BandwidthLimiter(rate=3000)
+    limiter.register('a', app.TASK_PRIORITIES['normal'])
+    limiter.register('b', app.TASK_PRIORITIES['low'])
+    assert limiter.share('a') == 2000 and limiter.share('b') == 1000
+    assert limiter.share('missing') == 0
+    limiter.rate = 0
+    assert limiter.share('a') == 0
+
+
+@pytest.mark.parametrize('share, fmt_info, duration, expected', [
+    (0, {'tbr': 1000}, None, None),
+    (62500, {'tbr': 1000}, None, 0.5),  # 500 кбит/с из 1000
+    (62500, {'requested_formats': [{'tbr': 800}, {'tbr': 200}]}, None, 0.5),
+    (62500, {'filesize': 12_500_000}, 100, 0.5),
+    (62500, {}, 100, None),
+])
+def test_section_readrate(app, share, fmt_info, duration, expected):
+    readrate = app.get_section_readrate(share, fmt_info, duration)
+    assert readrate == (pytest.approx(expected) if expected else None)
+
+
+def test_section_readrate_has_floor(app):
+    assert app.get_section_readrate(1, {'tbr': 100_000}) == app.BANDWIDTH_MIN_READRATE
@@ -0,0 +1,33 @@
+import pytest
+
+
+@pytest.mark.parametrize('line, expected', [
+    # URL
+    ('https://a', (None, None, 'best', 'auto')),
+    # URL START END
+    ('https://a 10 20', (10, 20, 'best', 'auto')),
+    ('https://a 1:00 1:30', (60, 90, 'best', 'auto')),
+    # URL [START END] QUALITY
+    ('https://a 720', (None, None, '720', 'auto')),
+    ('https://a - audio', (None, None, 'audio', 'auto')),
+    ('https://a 10 20 1080p', (10, 20, '1080', 'auto')),
+    # URL [START END] QUALITY BITRATE
+    ('https://a 1080 192', (None, None, '1080', '192')),
+    ('https://a 720 128k', (None, None, '720', '128')),
+    ('https://a 10 20 1080 192', (10, 20, '1080', '192')),
+    ('https://a 0:10 0:20 audio 320', (10, 20, 'audio', '320')),
+])
+def test_parse_batch_line(app, line, expected):
+    task = app.parse_batch_line(line)
+    assert (task['s'], task['e'], task['quality'], task['bitrate']) == expected
+
+
+@pytest.mark.parametrize('line', [
+    'https://a 20 10',
+    'https://a 4k',
+    'https://a 720 audio',
+    'https://a 10 20 720 128 extra',
+])
+def test_parse_batch_line_errors(app, line):
+    with pytest.raises(ValueError):
+        app.parse_batch_line(line)
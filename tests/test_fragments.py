@@ -0,0 +1,135 @@
+"""FragmentConcurrency: подстройка числа потоков на фрагменты и общий бюджет соединений"""
+import http.server
+import os
+import threading
+import time
+
+import pytest
+import yt_dlp
+
+
+@pytest.fixture
+def clock(app, monkeypatch):
+    """Управляемое время для on_error (снижение не чаще раза в секунду)"""
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    return now
+
+
+def test_level_ramps_up_while_throughput_grows(app):
+    fc = app.FragmentConcurrency(budget=64)
+    levels = []
+    for rate in (100, 200, 400, 800):
+        n = fc.acquire('cdn', True)
+        levels.append(n)
+        fc.release('cdn', n, True, nbytes=rate, seconds=1)
+    assert levels == [app.FRAGMENT_START_LEVEL + i for i in range(4)]
+
+
+def test_level_steps_back_when_more_threads_are_slower(app):
+    fc = app.FragmentConcurrency(budget=64)
+    n = fc.acquire('cdn', True)
+    fc.release('cdn', n, True, nbytes=1000, seconds=1)
+    n = fc.acquire('cdn', True)
+    assert n == app.FRAGMENT_START_LEVEL + 1
+    fc.release('cdn', n, True, nbytes=500, seconds=1)
+    assert fc.acquire('cdn', True) == app.FRAGMENT_START_LEVEL
+
+
+def test_errors_halve_level_once_per_second(app, clock):
+    fc = app.FragmentConcurrency(budget=64)
+    fc.hosts['cdn'] = {'level': 8, 'rates': {}, 'errors': 0, 'cut_at': 0}
+    fc.on_error('cdn')
+    fc.on_error('cdn')  # тот же всплеск 429
+    assert fc.stats()['levels']['cdn'] == 4
+    clock[0] += 1
+    fc.on_error('cdn')
+    assert fc.stats()['levels']['cdn'] == 2
+    assert fc.stats()['errors'] == 3
+
+
+def test_budget_is_shared_but_every_task_gets_a_connection(app):
+    fc = app.FragmentConcurrency(budget=5)
+    fc.hosts['cdn'] = {'level': 4, 'rates': {}, 'errors': 0, 'cut_at': 0}
+    taken = [fc.acquire('cdn', True) for _ in range(3)]
+    assert taken == [4, 1, 1]
+    assert fc.acquire('other', False) == 1
+    for n in taken:
+        fc.release('cdn', n, True)
+    assert fc.stats()['in_use'] == 1
+
+
+def test_failed_or_trimmed_download_does_not_move_level(app):
+    fc = app.FragmentConcurrency(budget=64)
+    n = fc.acquire('cdn', True)
+    fc.release('cdn', n, True, nbytes=1000, seconds=1, failed=True)
+    fc.release('cdn', 1, True, nbytes=1000, seconds=1)  # бюджет урезал задачу до одного потока
+    assert fc.stats()['levels']['cdn'] == app.FRAGMENT_START_LEVEL
+
+
+def test_backoff_grows_and_is_capped(app):
+    pauses = [app.get_fragment_backoff(n) for n in range(12)]
+    assert pauses == sorted(pauses)
+    assert pauses[-1] <= app.FRAGMENT_BACKOFF_MAX
+
+
+def test_hls_download_backs_off_on_429(app, tmp_path):
+    """HLS с локального сервера, который отвечает 429 на лишние одновременные запросы:
+    скачивание завершается целиком, а уровень потоков снижается"""
+    fragments, payload = 12, os.urandom(16 * 1024)
+    for i in range(fragments):
+        (tmp_path / f'seg{i}.ts').write_bytes(payload)
+    (tmp_path / 'index.m3u8').write_text(
+        "#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:0\n"
+        + "".join(f"#EXTINF:2.0,\nseg{i}.ts\n" for i in range(fragments)) + "#EXT-X-ENDLIST\n")
+    active, lock = [0], threading.Lock()
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, directory=str(tmp_path), **kw)
+
+        def log_message(self, *a):
+            pass
+
+        def do_GET(self):
+            with lock:
+                over = active[0] >= 2
+                if not over:
+                    active[0] += 1
+            if over:
+                self.send_error(429)
+                return
+            try:
+                time.sleep(0.05)
+                super().do_GET()
+            finally:
+                with lock:
+                    active[0] -= 1
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/index.m3u8"
+    fc = app.FragmentConcurrency(budget=16)
+    fc.hosts['cdn'] = {'level': 8, 'rates': {}, 'errors': 0, 'cut_at': 0}
+    threads = fc.acquire('cdn', True)
+
+    def on_retry(n):
+        fc.on_error('cdn')
+        return app.get_fragment_backoff(n) / 100
+
+    opts = {'quiet': True, 'no_warnings': True, 'noprogress': True, 'outtmpl': str(tmp_path / 'out.%(ext)s'),
+            'format': 'hls', 'fixup': 'never', 'fragment_retries': 50, 'skip_unavailable_fragments': False,
+            'concurrent_fragment_downloads': threads, 'retry_sleep_functions': {'fragment': on_retry}}
+    info = {'id': 'test', 'title': 'test', 'extractor': 'generic', 'extractor_key': 'Generic', 'webpage_url': url,
+            'formats': [{'format_id': 'hls', 'url': url, 'protocol': 'm3u8_native', 'ext': 'ts'}]}
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            ydl.process_ie_result(info, download=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+    fc.release('cdn', threads, True, failed=True)
+    assert (tmp_path / 'out.ts').stat().st_size == fragments * len(payload)
+    assert fc.stats()['errors'] > 0
+    assert fc.stats()['levels']['cdn'] < 8
+    assert fc.stats()['in_use'] == 0
@@ -0,0 +1,31 @@
+"""Локализация: встроенные строки без файлов languages и выбор video_settings по подписи"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+
+def test_defaults_without_language_files(app, tmp_path):
+    locale = app.load_locale(str(tmp_path))
+    for lang in ('ru', 'en'):
+        assert locale[lang]['video_settings_passthrough'] == app.LOCALE_DEFAULTS[lang]['video_settings_passthrough']
+
+
+def test_language_files_override_defaults(app, tmp_path):
+    lang_dir = tmp_path / 'languages' / 'en'
+    lang_dir.mkdir(parents=True)
+    (lang_dir / 'en.json').write_text(json.dumps({'video_settings_passthrough': 'Copy', 'video_settings_auto': 'Auto'}))
+    locale = app.load_locale(str(tmp_path))
+    assert locale['en'] == {'video_settings_passthrough': 'Copy', 'video_settings_auto': 'Auto'}
+    assert locale['ru'] == app.LOCALE_DEFAULTS['ru']
+
+
+@pytest.mark.parametrize('lang', ['ru', 'en'])
+def test_video_settings_labels_map_to_internal_keys(app, tmp_path, lang):
+    locale = app.load_locale(str(tmp_path))
+    gui = SimpleNamespace(t=lambda key: locale[lang].get(key, key))
+    for choice in app.VIDEO_SETTINGS_CHOICES:
+        assert choice in app.ENCODING_PROFILES
+        label = gui.t(f'video_settings_{choice}')
+        assert app.ModernYouTubeCutter.get_video_settings_value(gui, label) == choice
+    assert app.ModernYouTubeCutter.get_video_settings_value(gui, 'unknown') == 'auto'
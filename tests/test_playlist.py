@@ -0,0 +1,68 @@
+"""Плейлисты: постраничный обход записей и развёртывание вложенных вкладок канала"""
+import pytest
+import yt_dlp
+
+
+class FakeYdl(yt_dlp.YoutubeDL):
+    """Вместо сети отдаёт заранее подготовленные плейлисты по URL"""
+
+    def __init__(self, playlists):
+        super().__init__({'quiet': True, 'no_warnings': True})
+        self.playlists = playlists
+        self.extracted = []
+
+    def extract_info(self, url, *args, **kwargs):
+        self.extracted.append(url)
+        return self.playlists[url]
+
+
+def video(n, ie_key='Youtube'):
+    return {'_type': 'url', 'ie_key': ie_key, 'id': f'v{n}', 'url': f'https://www.youtube.com/watch?v=v{n}', 'title': f'v{n}'}
+
+
+def test_paged_entries_are_fetched_page_by_page(app):
+    fetched = []
+
+    def page(n):
+        fetched.append(n)
+        return [video(n * 2 + i) for i in range(2)] if n < 3 else []
+
+    playlist = {'_type': 'playlist', 'entries': yt_dlp.utils.OnDemandPagedList(page, 2)}
+    entries = app.iter_playlist_entries(FakeYdl({}), playlist)
+    assert next(entries)['id'] == 'v0'
+    assert fetched == [0]
+    assert [e['id'] for e in entries] == [f'v{i}' for i in range(1, 6)]
+    assert fetched == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize('entries', [[video(0), video(1)], iter([video(0), video(1)])])
+def test_list_and_generator_entries(app, entries):
+    playlist = {'_type': 'playlist', 'entries': entries}
+    assert [e['id'] for e in app.iter_playlist_entries(FakeYdl({}), playlist)] == ['v0', 'v1']
+    assert list(app.iter_playlist_entries(FakeYdl({}), {'_type': 'playlist'})) == []
+
+
+@pytest.mark.parametrize('entry, expected', [
+    (video(0), False),
+    ({'_type': 'url', 'ie_key': 'YoutubeTab', 'url': 'https://www.youtube.com/@c/videos'}, True),
+    ({'_type': 'url_transparent', 'ie_key': 'YoutubeTab', 'url': 'https://www.youtube.com/@c/videos'}, False),
+    ({'_type': 'url', 'url': 'https://www.youtube.com/@c/videos'}, False),
+])
+def test_is_nested_playlist(app, entry, expected):
+    assert app.is_nested_playlist(entry, {'_type': 'playlist', 'extractor_key': 'YoutubeTab'}) is expected
+
+
+def test_channel_tabs_are_expanded(app, tmp_path):
+    tab = {'_type': 'url', 'ie_key': 'YoutubeTab', 'url': 'https://www.youtube.com/@c/videos'}
+    channel = {'_type': 'playlist', 'extractor_key': 'YoutubeTab', 'title': 'c',
+               'entries': iter([tab, {'_type': 'playlist', 'entries': [video(9)]}])}
+    ydl = FakeYdl({tab['url']: {'_type': 'playlist', 'extractor_key': 'YoutubeTab', 'entries': [video(0), video(1), video(0)]}})
+    pipeline = app.DownloadPipeline(str(tmp_path), {}, app.PipelineReporter())
+    try:
+        parent = pipeline.add_task('https://www.youtube.com/@c', None, None, app.QUALITY_MAP['q_best'], False, 'best', False)
+        assert pipeline.expand_playlist(parent, ydl, channel) == 3
+        children = [t for t in pipeline.queue if t.get('parent') == parent['key']]
+        assert [t['url'] for t in children] == [video(n)['url'] for n in (0, 1, 9)]
+        assert ydl.extracted == [tab['url']]
+    finally:
+        pipeline.shutdown()
@@ -0,0 +1,88 @@
+"""ProbePool: отмена ждущих и идущих probe, общий probe для одинаковых URL"""
+import threading
+import time
+
+import pytest
+
+
+def make_task(url):
+    return {'url': url, 'info_event': threading.Event()}
+
+
+def slow_probe(started, steps=200):
+    """probe из нескольких запросов, между которыми проверяется should_abort"""
+    def probe(task, should_abort):
+        started.set()
+        for _ in range(steps):
+            if should_abort():
+                raise Exception("ABORTED_BY_USER")
+            time.sleep(0.01)
+        return task['url']
+    return probe
+
+
+def test_cancel_all_frees_slot_of_running_probe(app):
+    started, done = threading.Event(), []
+    pool = app.ProbePool(slow_probe(started), lambda task, title, error: done.append((task['url'], title, error)), workers=1)
+    first = make_task('https://a.com/1')
+    pool.submit(first)
+    assert started.wait(2)
+    pool.cancel_all()
+    assert first['info_event'].wait(1)
+
+    # Слот освободился: следующий probe начинается, не дожидаясь конца прерванного (2 с)
+    started.clear()
+    t0 = time.perf_counter()
+    second = make_task('https://a.com/2')
+    pool.submit(second)
+    assert started.wait(1)
+    assert time.perf_counter() - t0 < 1
+    assert second['info_event'].wait(5)
+    assert done == [('https://a.com/2', 'https://a.com/2', None)]
+
+
+def test_probe_continues_while_any_task_of_url_wants_it(app):
+    started, done = threading.Event(), []
+    pool = app.ProbePool(slow_probe(started, steps=20), lambda task, title, error: done.append((task, title, error)), workers=1)
+    first, second = make_task('https://a.com/1'), make_task('https://a.com/1')
+    pool.submit(first)
+    assert started.wait(2)
+    pool.submit(second)  # присоединяется к идущему probe
+    pool.cancel(first)
+    assert second['info_event'].wait(5)
+    assert done == [(second, 'https://a.com/1', None)]
+
+
+def test_cancel_removes_queued_probe(app):
+    gate, calls = threading.Event(), []
+
+    def probe(task, should_abort):
+        calls.append(task['url'])
+        gate.wait(2)
+        return task['url']
+
+    pool = app.ProbePool(probe, lambda *a: None, workers=1)
+    running, queued = make_task('https://a.com/1'), make_task('https://a.com/2')
+    pool.submit(running)
+    pool.submit(queued)
+    pool.cancel(queued)
+    assert queued['info_event'].is_set()
+    gate.set()
+    assert running['info_event'].wait(2)
+    time.sleep(0.05)
+    assert calls == ['https://a.com/1']
+
+
+@pytest.fixture
+def pipeline(app, tmp_path):
+    pipeline = app.DownloadPipeline(str(tmp_path), {}, app.PipelineReporter())
+    yield pipeline
+    pipeline.shutdown()
+
+
+def test_probe_info_stops_before_full_extraction(app, pipeline, monkeypatch):
+    monkeypatch.setattr(app, 'fetch_light_meta', lambda *a: None)
+    task = pipeline.add_task('https://example.com/v', None, None, app.QUALITY_MAP['q_best'], False, 'best', False)
+    with pytest.raises(Exception, match='ABORTED_BY_USER'):
+        pipeline.probe_info(task, lambda: True)
+    assert pipeline.probe_stats['full'] == 0
@@ -0,0 +1,148 @@
+"""Стадии конвейера: DownloadScheduler, StagePool и перекрытие обработки со следующим скачиванием"""
+import threading
+import time
+
+import pytest
+
+
+def wait_for(cond, timeout=5):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_stage_pool_runs_at_most_workers_jobs(app):
+    pool = app.StagePool('test', 2)
+    running, peak, lock = [0], [0], threading.Lock()
+    done = []
+
+    def job(i):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+            done.append(i)
+
+    for i in range(6):
+        pool.submit(job, i)
+    pool.wait_idle()
+    assert sorted(done) == list(range(6))
+    assert peak[0] == 2
+    assert pool.is_idle()
+
+
+def test_stage_pool_survives_crashing_job(app):
+    pool = app.StagePool('test', 1)
+    done = []
+    pool.submit(lambda: 1 / 0)
+    pool.submit(done.append, 'after')
+    pool.wait_idle()
+    assert done == ['after']
+
+
+def test_stage_pool_shutdown_drops_waiting_jobs(app):
+    pool = app.StagePool('test', 1)
+    gate = threading.Event()
+    done = []
+    pool.submit(gate.wait)
+    for i in range(3):
+        pool.submit(done.append, i)
+    assert wait_for(lambda: pool.active_count() == 1)
+    pool.shutdown()
+    gate.set()
+    pool.wait_idle()
+    assert done == []
+    assert wait_for(lambda: pool.threads == 0)
+
+
+def test_ffmpeg_threads_fit_core_count(app):
+    for workers in (1, 2, 3, 4, 64):
+        threads = app.get_ffmpeg_threads(workers)
+        assert threads >= 1
+        assert threads * workers <= max(app.os.cpu_count() or 1, workers)
+
+
+def test_scheduler_respects_parallel_and_host_limits(app):
+    scheduler = app.DownloadScheduler(max_parallel=3, max_per_host=1)
+    tasks = [{'id': i, 'url': f'https://{host}/v{i}'} for i, host in enumerate(['a.com', 'a.com', 'b.com', 'c.com', 'd.com'])]
+    running, peak, lock = {}, {'total': 0, 'a.com': 0}, threading.Lock()
+    finished = []
+
+    def run_task(batch):
+        host = batch[0]['url'].split('/')[2]
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peak['total'] = max(peak['total'], sum(running.values()))
+            peak['a.com'] = max(peak['a.com'], running.get('a.com', 0))
+        time.sleep(0.05)
+        with lock:
+            running[host] -= 1
+            finished.append(batch[0]['id'])
+
+    scheduler.run(lambda: [t for t in tasks if t['id'] not in finished], run_task, lambda: False)
+    assert sorted(finished) == list(range(5))
+    assert peak['total'] <= 3
+    assert peak['a.com'] == 1
+
+
+def test_scheduler_groups_tasks_into_batches(app):
+    scheduler = app.DownloadScheduler(max_parallel=2, max_per_host=2)
+    tasks = [{'id': i, 'url': 'https://a.com/v', 's': i * 10, 'e': i * 10 + 5} for i in range(3)]
+    batches = []
+    scheduler.run(lambda: [t for t in tasks if not any(t in b for b in batches)],
+                  lambda batch: batches.append(batch), lambda: False, group_key=lambda t: t['url'])
+    assert [[t['id'] for t in b] for b in batches] == [[0, 1, 2]]
+
+
+def test_postprocessing_overlaps_next_download(app, tools, range_server, tmp_path, monkeypatch):
+    """При max_parallel=1 вторая задача качается, пока первая ещё в пуле обработки"""
+    ffmpeg, ffprobe = tools
+    src_dir = tmp_path / 'src'
+    src_dir.mkdir()
+    for name in ('one', 'two'):
+        app.run_ffmpeg([ffmpeg, '-y', '-f', 'lavfi', '-i', 'sine=duration=2', '-c:a', 'aac', str(src_dir / f'{name}.m4a')])
+    base_url, _ = range_server(str(src_dir))
+
+    events, lock = [], threading.Lock()
+    convert_audio = app.convert_audio
+
+    def slow_convert(*args, **kwargs):
+        with lock:
+            events.append(('post_start', time.perf_counter()))
+        time.sleep(1.5)
+        convert_audio(*args, **kwargs)
+        with lock:
+            events.append(('post_end', time.perf_counter()))
+
+    monkeypatch.setattr(app, 'convert_audio', slow_convert)
+
+    class Reporter(app.PipelineReporter):
+        def task_update(self, task, **state):
+            if state.get('stage') == 'downloading':
+                with lock:
+                    events.append((f"download_{task['id']}", time.perf_counter()))
+
+    out_dir, state_dir = tmp_path / 'out', tmp_path / 'state'
+    out_dir.mkdir()
+    state_dir.mkdir()
+    settings = {'max_parallel': 1, 'source_cache_mb': 0, 'skip_downloaded': False}
+    pipeline = app.DownloadPipeline(str(state_dir), settings, Reporter())
+    pipeline.ffmpeg_exe, pipeline.ffprobe_exe = ffmpeg, ffprobe
+    pipeline.ffmpeg_dir = app.os.path.dirname(ffmpeg)
+    tasks = [pipeline.add_task(f'{base_url}/{name}.m4a', None, None, app.QUALITY_MAP['q_audio'], True, 'audio', False)
+             for name in ('one', 'two')]
+    try:
+        pipeline.run(str(out_dir))
+    finally:
+        pipeline.shutdown()
+    assert all(t.get('done') for t in tasks), [t.get('error') for t in tasks]
+
+    first_post_end = min(t for name, t in events if name == 'post_end')
+    second_download = min((t for name, t in events if name == f"download_{tasks[1]['id']}"), default=None)
+    assert second_download is not None
+    assert second_download < first_post_end
@@ -0,0 +1,59 @@
+"""YdlPool: переиспользование экземпляров YoutubeDL и откат на новый экземпляр на каждую задачу"""
+import os
+
+import pytest
+
+OPTS = {'quiet': True, 'no_warnings': True, 'noprogress': True}
+
+
+@pytest.fixture
+def files(range_server, tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    for name, size in (('a.bin', 50000), ('b.bin', 70000)):
+        (src / name).write_bytes(os.urandom(size))
+    base_url, _ = range_server(str(src))
+    return base_url, tmp_path
+
+
+def download(pool, base_url, out_dir, name, fmt=None):
+    calls = []
+    opts = dict(OPTS, outtmpl=str(out_dir / f'{name}.bin'), progress_hooks=[calls.append])
+    if fmt:
+        opts['format'] = fmt
+    with pool.acquire(opts) as ydl:
+        ydl.download([f'{base_url}/{name}.bin'])
+    return calls
+
+
+def test_instances_are_reused_with_per_task_options(app, files):
+    base_url, out_dir = files
+    pool = app.YdlPool()
+    first = download(pool, base_url, out_dir, 'a', fmt='best')
+    second = download(pool, base_url, out_dir, 'b')
+    pool.close_all()
+    assert (out_dir / 'a.bin').stat().st_size == 50000
+    assert (out_dir / 'b.bin').stat().st_size == 70000
+    # Хуки прогресса получает только своя задача
+    assert first and second
+    assert {d['filename'] for d in first} == {str(out_dir / 'a.bin')}
+    assert {d['filename'] for d in second} == {str(out_dir / 'b.bin')}
+    stats = pool.stats()
+    assert (stats['created'], stats['reused'], stats['reuse']) == (1, 1, True)
+
+
+def test_missing_internal_attribute_falls_back_to_fresh_instances(app, files, monkeypatch):
+    base_url, out_dir = files
+    monkeypatch.setattr(app, 'YDL_POOL_INSTANCE_ATTRS', ('format_selector', 'no_such_attribute'))
+    pool = app.YdlPool()
+    download(pool, base_url, out_dir, 'a')
+    download(pool, base_url, out_dir, 'b')
+    assert (out_dir / 'a.bin').exists() and (out_dir / 'b.bin').exists()
+    stats = pool.stats()
+    assert stats['reuse'] is False and stats['reused'] == 0 and stats['idle'] == 0
+
+
+def test_old_version_is_not_reused(app, monkeypatch):
+    monkeypatch.setattr(app.yt_dlp.version, '__version__', '2023.10.13')
+    assert not app.ydl_reuse_supported()
+    assert app.YdlPool().stats()['reuse'] is False
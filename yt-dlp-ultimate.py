@@ -1,5 +1,3 @@
-import customtkinter as ctk
-from tkinter import messagebox, filedialog
 import yt_dlp
 import threading
 import os
@@ -10,8 +8,33 @@ import subprocess
 import time
 import shutil
 import json
+import re
+import collections
+import contextlib
+import tempfile
+import urllib.parse
+import urllib.request
+import argparse
+import uuid
+import hashlib
+import bisect
+import itertools
+
+# Консольный режим (--cli) работает без Tk и customtkinter
+HEADLESS = any(a == '--cli' or a.startswith('--cli=') for a in sys.argv[1:])
+if HEADLESS:
+    ctk = None
+else:
+    import customtkinter as ctk
+    from tkinter import messagebox, filedialog
 
 # --- КОНФИГУРАЦИЯ ---
+# Строки, которых может не быть в languages/*.json; значения из файлов важнее
+LOCALE_DEFAULTS = {
+    'ru': {'video_settings_passthrough': "Без перекодирования"},
+    'en': {'video_settings_passthrough': "No re-encoding"},
+}
+
 def load_locale(base_path):
     """Загружает локализацию из JSON файлов в папке languages"""
     locale = {}
@@ -22,13 +45,13 @@ def load_locale(base_path):
         try:
             if os.path.exists(lang_file):
                 with open(lang_file, 'r', encoding='utf-8') as f:
-                    locale[lang_code] = json.load(f)
+                    locale[lang_code] = {**LOCALE_DEFAULTS.get(lang_code, {}), **json.load(f)}
             else:
-                # Fallback на пустой словарь если файл не найден
-                locale[lang_code] = {}
+                # Fallback на встроенные строки если файл не найден
+                locale[lang_code] = dict(LOCALE_DEFAULTS.get(lang_code, {}))
         except Exception as e:
             logging.error(f"Error loading locale {lang_code}: {e}")
-            locale[lang_code] = {}
+            locale[lang_code] = dict(LOCALE_DEFAULTS.get(lang_code, {}))
     
     return locale
 
@@ -41,7 +64,17 @@ def load_settings(base_path):
         'disable_proxy': False,
         'js_runtime': 'auto',
         'cookies_browser': 'Disabled',
-        'download_path': None
+        'download_path': None,
+        'max_parallel': 3,
+        'max_per_host': 2,
+        'section_download': True,
+        'skip_downloaded': True,
+        'source_cache_mb': 2048,
+        'source_cache_full': False,
+        'fragment_concurrency': 'auto',
+        'connection_budget': 16,
+        'bandwidth_limit_kb': 0,
+        'stream_to_ffmpeg': False
     }
     
     try:
@@ -97,141 +130,3583 @@ FALLBACK_FORMATS = {
     ]
 }
 
-ctk.set_appearance_mode("Dark")
-ctk.set_default_color_theme("blue")
+def get_q_key(fmt, is_audio):
+    """Ключ качества (q_best, q_1080, ...) по строке формата из QUALITY_MAP"""
+    if is_audio:
+        return 'q_audio'
+    for key, fmt_val in QUALITY_MAP.items():
+        if fmt_val == fmt:
+            return key
+    return 'q_best'
 
-class ModernYouTubeCutter(ctk.CTk):
-    def __init__(self):
-        super().__init__()
-        self.base_path = self.get_base_path()
-        
-        # Загружаем настройки из settings.json
-        settings = load_settings(self.base_path)
-        self.lang = settings.get('language', 'en')
-        self.logging_enabled = settings.get('logging_enabled', True)
-        self.disable_proxy = settings.get('disable_proxy', False)
-        self.js_runtime = settings.get('js_runtime', 'auto')
-        self.audio_bitrate = 'auto' 
-        self.video_settings = 'auto'
-        self.setup_logging()
+def get_format_ladder(q_key, fmt=None):
+    """Лестница селекторов: основной формат качества, затем FALLBACK_FORMATS"""
+    if q_key == 'q_audio':
+        ladder = ['bestaudio/best']
+    else:
+        ladder = [fmt or QUALITY_MAP.get(q_key, QUALITY_MAP['q_best'])]
+    ladder += [f for f in FALLBACK_FORMATS.get(q_key, ['bestvideo+bestaudio/best', 'best']) if f not in ladder]
+    return ladder
 
-        # Загружаем локализацию из JSON файлов
-        self.LOCALE = load_locale(self.base_path)
-        
-        # Устанавливаем иконку
-        icon_path = os.path.join(self.base_path, 'icon.ico')
-        if os.path.exists(icon_path):
+_format_planner = None
+
+def resolve_format_ladder(info, ladder):
+    """Подбирает формат локально по info['formats'], без обращений к сети.
+
+    Возвращает (селектор, выбранный формат) для первой ступени лестницы, которая
+    что-то нашла, или None. Для склеиваемых форматов выбранный dict содержит requested_formats.
+    """
+    global _format_planner
+    if _format_planner is None:
+        # Только для build_format_selector: экземпляр ничего не скачивает
+        _format_planner = yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True})
+    formats = info.get('formats') or ([info] if info.get('url') else [])
+    if not formats:
+        return None
+    ctx = {
+        'formats': formats,
+        'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+        'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                               or all(f.get('acodec') == 'none' for f in formats)),
+    }
+    for spec in ladder:
+        try:
+            selector = _format_planner.build_format_selector(spec)
+            chosen = list(selector(dict(ctx)))
+        except Exception as e:
+            logging.warning(f"Bad format selector '{spec}': {e}")
+            continue
+        if chosen:
+            return spec, chosen[0]
+    return None
+
+def describe_format(fmt, duration=None):
+    """Короткое описание выбранного формата для карточки: разрешение · кодек · размер"""
+    parts = fmt.get('requested_formats') or [fmt]
+    video = next((f for f in parts if f.get('vcodec') not in (None, 'none')), None)
+    audio = next((f for f in parts if f.get('acodec') not in (None, 'none')), None)
+    bits = []
+    if video:
+        bits.append(f"{video['height']}p" if video.get('height') else (video.get('resolution') or 'video'))
+        bits.append((video.get('vcodec') or '?').split('.')[0])
+    if audio and audio is not video:
+        bits.append((audio.get('acodec') or '?').split('.')[0])
+    elif audio and not video:
+        bits.append('audio')
+    size = 0
+    for f in parts:
+        f_size = f.get('filesize') or f.get('filesize_approx')
+        if not f_size and f.get('tbr') and duration:
+            f_size = f['tbr'] * 1000 / 8 * duration
+        size += f_size or 0
+    if size:
+        bits.append(f"~{size / (1024 * 1024):.0f}MB")
+    return ' · '.join(bits) or fmt.get('format_id', '?')
+
+# Подписанные ссылки на потоки живут ограниченное время (у YouTube ~6 часов, см. параметр expire)
+INFO_URL_TTL = 3 * 3600        # если срок жизни ссылок неизвестен
+INFO_REFRESH_MARGIN = 5 * 60   # обновляем info заранее, чтобы ссылки не истекли во время скачивания
+
+def get_info_expiry(info):
+    """Возвращает unix-время, когда истекут ссылки на потоки в info"""
+    expiry = (info.get('epoch') or time.time()) + INFO_URL_TTL
+    for f in info.get('formats') or []:
+        for url in (f.get('url'), f.get('manifest_url')):
+            m = re.search(r'[?&/]expire[=/](\d+)', url or '')
+            if m:
+                expiry = min(expiry, int(m.group(1)))
+    return expiry
+
+# Поля, которые yt-dlp дописывает в info при обработке: при повторном process_ie_result их быть не должно
+INFO_RUNTIME_KEYS = {'requested_downloads', 'requested_formats', 'requested_subtitles', 'requested_entries',
+                     'entries', 'filepath', '_filename', 'filename', 'infojson_filename', 'playlist_autonumber'}
+
+def copy_info(info):
+    """Копия info для повторного process_ie_result. В отличие от sanitize_info не-JSON значения
+    (функция fragments у http_dash_segments_generator) остаются как есть, а не превращаются в repr"""
+    if isinstance(info, dict):
+        return {k: copy_info(v) for k, v in info.items()
+                if v is not None and not k.startswith('__') and k not in INFO_RUNTIME_KEYS}
+    if isinstance(info, (list, tuple, yt_dlp.utils.LazyList)):
+        return [copy_info(v) for v in info]
+    return info
+
+def has_generated_fragments(info):
+    """В info есть форматы, фрагменты которых генерирует функция: в JSON их не сохранить"""
+    return any(callable(f.get('fragments')) for f in info.get('formats') or [])
+
+def is_expired_url_error(error):
+    """Ошибка похожа на истёкшую/отозванную подпись ссылки на поток"""
+    error_str = str(error).lower()
+    return 'http error 403' in error_str or 'http error 410' in error_str or 'expired' in error_str
+
+# Запас вокруг фрагмента, чтобы отрезок гарантированно начинался с ключевого кадра до start
+SECTION_PADDING = 10
+# Допуск проверки точности скачанного отрезка (секунды)
+SECTION_TOLERANCE = 0.5
+
+def get_section_range(s, e, duration=None, padding=SECTION_PADDING):
+    """Отрезок (start, end) для download_ranges: [s, e] с запасом на ключевые кадры"""
+    start = max(0, s - padding)
+    end = e + padding
+    if duration:
+        end = min(end, duration)
+    return start, end
+
+def get_startupinfo():
+    """STARTUPINFO, скрывающий консольное окно дочернего процесса в Windows"""
+    if os.name != 'nt':
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+def probe_media(ffprobe_exe, path, timeout=60):
+    """Длительность и время начала файла через ffprobe. Возвращает dict или None"""
+    try:
+        result = subprocess.run(
+            [ffprobe_exe, '-v', 'error', '-show_entries', 'format=duration,start_time', '-of', 'json', path],
+            capture_output=True, text=True, timeout=timeout, startupinfo=get_startupinfo(),
+            encoding='utf-8', errors='replace')
+        fmt = json.loads(result.stdout or '{}').get('format', {})
+        return {'duration': float(fmt.get('duration') or 0), 'start_time': float(fmt.get('start_time') or 0)}
+    except Exception as e:
+        logging.warning(f"ffprobe failed for {path}: {e}")
+        return None
+
+def probe_packet_range(ffprobe_exe, path, timeout=120):
+    """Время первого ключевого кадра и конца последнего пакета (метки как записаны в файле).
+    Смотрит видеопоток, в файле без видео - аудио. Кадры не декодируются. Возвращает (начало, конец) или None"""
+    for stream in ('v:0', 'a:0'):
+        try:
+            result = subprocess.run(
+                [ffprobe_exe, '-v', 'error', '-select_streams', stream,
+                 '-show_entries', 'packet=pts_time,duration_time,flags', '-of', 'csv=p=0', path],
+                capture_output=True, text=True, timeout=timeout, startupinfo=get_startupinfo(),
+                encoding='utf-8', errors='replace')
+        except Exception as e:
+            logging.warning(f"ffprobe failed for {path}: {e}")
+            return None
+        first_key = last_end = None
+        for line in result.stdout.splitlines():
+            # Поля идут в порядке ffprobe: pts_time, duration_time, flags
+            fields = line.strip().split(',')
             try:
-                self.iconbitmap(icon_path)
-            except Exception as e:
-                logging.warning(f"Could not set icon: {e}")
+                pts = float(fields[0])
+            except (ValueError, IndexError):
+                continue
+            try:
+                duration = float(fields[1])
+            except (ValueError, IndexError):
+                duration = 0.0
+            if first_key is None and 'K' in (fields[2] if len(fields) > 2 else ''):
+                first_key = pts
+            last_end = max(last_end if last_end is not None else pts, pts + duration)
+        if first_key is not None:
+            return first_key, last_end
+    return None
 
-        self.title("YT-DLP Ultimate v1.7")
-        self.geometry("950x800")
-        self.minsize(600, 500)
-        
-        self.grid_columnconfigure(0, weight=1)
-        self.grid_rowconfigure(0, weight=1)
+def check_section_accuracy(ffprobe_exe, path, start, end, tolerance=SECTION_TOLERANCE):
+    """Проверяет, что скачанный отрезок покрывает [start, end] - время исходного видео
+    (download_source сохраняет в отрезке метки исходника, см. -output_ts_offset).
 
-        self.ffmpeg_dir = self.base_path 
-        self.ffmpeg_exe = os.path.join(self.base_path, 'ffmpeg.exe')
-        self.ffprobe_exe = os.path.join(self.base_path, 'ffprobe.exe')
-        self.deno_exe = os.path.join(self.base_path, 'deno.exe')
-        
-        env_path = os.environ.get('PATH', '')
-        if self.base_path not in env_path:
-            os.environ['PATH'] = self.base_path + os.pathsep + env_path
+    Возвращает смещение для обрезки: время видео, которому соответствует 0 файла для
+    ffmpeg -ss (start_time файла). None - отрезок не покрывает [start, end].
+    Копия потока начинается с ключевого кадра до start, а у webm/mkv без edit list этот
+    кадр и есть начало файла, поэтому считать началом отрезка запрошенное время нельзя.
+    """
+    probe = probe_media(ffprobe_exe, path)
+    packets = probe_packet_range(ffprobe_exe, path)
+    if not probe or not packets:
+        return None
+    first_key, covered_end = packets
+    if first_key <= start + tolerance and covered_end >= end - tolerance:
+        return probe['start_time']
+    return None
 
-        # Загружаем путь загрузок из настроек или используем дефолтный
-        default_dl = os.path.join(self.base_path, 'downloads')
-        download_path = settings.get('download_path')
-        if download_path and os.path.exists(download_path):
-            default_dl = download_path
-        elif not os.path.exists(default_dl):
-            os.makedirs(default_dl)
-        self.download_path_var = ctk.StringVar(value=default_dl)
+# --- ДВИЖОК ОБРЕЗКИ ---
+# Кодирование краёв фрагмента (частичные GOP) и полного перекодирования по умолчанию
+CUT_X264_ARGS = ['-c:v', 'libx264', '-preset', 'ultrafast']
+# Кодеки, для которых умеем перекодировать края так, чтобы они склеились с копией середины: кодек -> кодер
+SMART_CUT_CODECS = {'h264': 'libx264'}
+# Контейнер для копирования аудио без перекодирования
+AUDIO_COPY_EXT = {'mp3': '.mp3', 'aac': '.m4a', 'opus': '.opus', 'vorbis': '.ogg', 'flac': '.flac'}
+# Края короче этого не перекодируем отдельно (меньше одного кадра)
+SMART_CUT_MIN_EDGE = 0.04
 
-        self.download_queue = [] 
-        self.task_widgets = {} 
-        self.last_ui_update = 0
-        self.abort_flag = False 
-        self.is_running = False
-        self.js_runtime_paths = {}
-        
-        # Сохраняем загруженные настройки для использования в UI
-        self.loaded_settings = settings
+def get_thread_args(threads):
+    """-threads для ffmpeg: None - ffmpeg сам берёт все ядра"""
+    return ['-threads', str(threads)] if threads else []
 
-        self.create_ui()
-        self.check_tools()
-    
-    def save_settings_to_file(self):
-        """Сохраняет текущие настройки в settings.json"""
-        settings = {
-            'language': self.lang,
-            'logging_enabled': self.logging_enabled,
-            'disable_proxy': self.disable_proxy,
-            'js_runtime': self.js_runtime,
-            'cookies_browser': self.cookies_val.get() if hasattr(self, 'cookies_val') else 'Disabled',
-            'download_path': self.download_path_var.get()
-        }
-        save_settings(self.base_path, settings)
+# CPU-секунды дочерних процессов, запущенных потоком внутри track_cpu
+_cpu_usage = threading.local()
 
-    def setup_logging(self):
-        for h in logging.root.handlers[:]: logging.root.removeHandler(h)
-        if self.logging_enabled:
-            logging.basicConfig(filename='app_log.txt', level=logging.INFO, 
-                                format='%(asctime)s - %(message)s', encoding='utf-8')
-
-    def get_base_path(self):
-        if getattr(sys, 'frozen', False): return os.path.dirname(sys.executable)
-        return os.path.dirname(os.path.abspath(__file__))
-    
-    def get_unique_filename(self, base_path, base_name, extension):
-        """Генерирует уникальное имя файла, добавляя суффикс если файл уже существует"""
-        full_path = os.path.join(base_path, f"{base_name}{extension}")
-        
-        if not os.path.exists(full_path):
-            return full_path
-        
-        # Если файл существует, добавляем суффикс _1, _2, и т.д.
-        counter = 1
+@contextlib.contextmanager
+def track_cpu():
+    """Считает CPU-секунды (user + system) ffmpeg/ffprobe, запущенных этим потоком внутри блока.
+    Отдаёт список из одного числа: значение готово после выхода из блока"""
+    counter = [0.0]
+    outer = getattr(_cpu_usage, 'counter', None)
+    _cpu_usage.counter = counter
+    try:
+        yield counter
+    finally:
+        _cpu_usage.counter = outer
+        if outer is not None:
+            outer[0] += counter[0]
+
+def get_windows_cpu_seconds(proc):
+    """CPU-секунды завершившегося процесса через GetProcessTimes (Windows)"""
+    import ctypes
+    from ctypes import wintypes
+    times = [wintypes.FILETIME() for _ in range(4)]  # создание, завершение, ядро, пользователь
+    if not ctypes.windll.kernel32.GetProcessTimes(wintypes.HANDLE(int(proc._handle)), *map(ctypes.byref, times)):
+        return 0.0
+    return sum(((ft.dwHighDateTime << 32) | ft.dwLowDateTime) / 1e7 for ft in times[2:])
+
+def wait_process(proc):
+    """Ждёт завершения процесса и добавляет его CPU-время в track_cpu. Возвращает код возврата.
+
+    os.wait4 на POSIX отдаёт rusage именно этого процесса (RUSAGE_CHILDREN смешал бы
+    параллельные задачи), в Windows время берётся из GetProcessTimes.
+    """
+    cpu = 0.0
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        cpu = usage.ru_utime + usage.ru_stime
+    else:
+        proc.wait()
+        try: cpu = get_windows_cpu_seconds(proc)
+        except Exception as e: logging.debug(f"GetProcessTimes failed: {e}")
+    counter = getattr(_cpu_usage, 'counter', None)
+    if counter is not None:
+        counter[0] += cpu
+    return proc.returncode
+
+def run_ffmpeg(cmd):
+    """Запускает ffmpeg/ffprobe без окна консоли, при ошибке бросает исключение с хвостом stderr"""
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                            startupinfo=get_startupinfo(), encoding='utf-8', errors='replace')
+    # Процесс ждём сами (wait_process), поэтому stderr читаем в фоне, а не через communicate
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+    reader.start()
+    stdout = proc.stdout.read()
+    reader.join()
+    if wait_process(proc) != 0:
+        raise Exception(f"FFmpeg error ({proc.returncode}): {''.join(stderr).strip()[-500:]}")
+    return stdout
+
+def probe_streams(ffprobe_exe, path):
+    """Первые видео и аудио потоки файла: {'video': {...} или None, 'audio': {...} или None}"""
+    out = run_ffmpeg([ffprobe_exe, '-v', 'error', '-show_entries',
+                      'stream=index,codec_type,codec_name,pix_fmt,width,height', '-of', 'json', path])
+    streams = json.loads(out or '{}').get('streams', [])
+    return {
+        'video': next((st for st in streams if st.get('codec_type') == 'video'), None),
+        'audio': next((st for st in streams if st.get('codec_type') == 'audio'), None),
+    }
+
+def probe_keyframes(ffprobe_exe, path, start, end, margin=15):
+    """Времена ключевых кадров видео в окрестности [start, end] (читает только этот интервал)"""
+    out = run_ffmpeg([
+        ffprobe_exe, '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+        '-read_intervals', f"{max(0, start - margin)}%{end + margin}",
+        '-show_entries', 'frame=best_effort_timestamp_time', '-of', 'csv=p=0', path])
+    keyframes = []
+    for line in out.splitlines():
+        try: keyframes.append(float(line.strip().strip(',')))
+        except ValueError: pass
+    return sorted(set(keyframes))
+
+def cut_video_reencode(ffmpeg_exe, src, start, end, dst, a_bitrate, threads=None, video_args=CUT_X264_ARGS):
+    """Точная обрезка с полным перекодированием. -ss перед -i: ffmpeg не декодирует файл с начала"""
+    run_ffmpeg([ffmpeg_exe, '-y', *get_thread_args(threads), '-ss', str(start), '-i', src, '-t', str(end - start),
+                *video_args, *get_thread_args(threads), '-c:a', 'aac', '-b:a', a_bitrate, dst])
+
+def cut_copy(ffmpeg_exe, src, start, end, dst):
+    """Обрезка без перекодирования: начало встаёт на ключевой кадр перед start, CPU почти не нужен"""
+    run_ffmpeg([ffmpeg_exe, '-y', '-ss', str(start), '-i', src, '-t', str(end - start),
+                '-c', 'copy', '-avoid_negative_ts', 'make_zero', dst])
+
+def cut_video_smart(ffmpeg_exe, ffprobe_exe, src, start, end, dst, a_bitrate, work_dir, threads=None,
+                    edge_opts=CUT_X264_ARGS[2:]):
+    """Smart cut: копирует GOP-ы между ключевыми кадрами, перекодирует только края фрагмента.
+
+    [start, k1) и [k2, end) перекодируются, [k1, k2) копируется как есть, затем всё склеивается.
+    Части пишутся в MPEG-TS: SPS/PPS идут в потоке, поэтому перекодированные края
+    склеиваются с копией без проблем с extradata. Возвращает False, если smart cut
+    неприменим (кодек, мало ключевых кадров) - тогда нужно звать cut_video_reencode.
+    threads - сколько потоков ffmpeg может занять на декодирование и кодирование краёв,
+    edge_opts - настройки кодера краёв (пресет, CRF из профиля кодирования).
+    """
+    streams = probe_streams(ffprobe_exe, src)
+    video, audio = streams['video'], streams['audio']
+    if not video or video.get('codec_name') not in SMART_CUT_CODECS:
+        return False
+    encoder_args = ['-c:v', SMART_CUT_CODECS[video['codec_name']], *edge_opts]
+    # ffprobe отдаёт метки как в файле, а -ss ffmpeg считает от start_time файла
+    origin = (probe_media(ffprobe_exe, src) or {}).get('start_time', 0)
+    keyframes = [k - origin for k in probe_keyframes(ffprobe_exe, src, start + origin, end + origin)]
+    k1 = next((k for k in keyframes if k >= start), None)
+    k2 = next((k for k in reversed(keyframes) if k <= end), None)
+    if k1 is None or k2 is None or k2 <= k1:
+        return False
+
+    pix_fmt = ['-pix_fmt', video['pix_fmt']] if video.get('pix_fmt') else []
+    parts = []
+    def encode_edge(a, b, name):
+        path = os.path.join(work_dir, name)
+        run_ffmpeg([ffmpeg_exe, '-y', *get_thread_args(threads), '-ss', str(a), '-i', src, '-t', str(b - a), '-an',
+                    *encoder_args, *get_thread_args(threads), *pix_fmt, '-f', 'mpegts', path])
+        parts.append(path)
+
+    if k1 - start > SMART_CUT_MIN_EDGE:
+        encode_edge(start, k1, 'head.ts')
+    middle = os.path.join(work_dir, 'middle.ts')
+    # Поиск с копированием встаёт на ключевой кадр <= позиции: +1 мс страхует от округления k1 вниз
+    run_ffmpeg([ffmpeg_exe, '-y', '-ss', str(k1 + 0.001), '-i', src, '-t', str(k2 - k1), '-an',
+                '-c:v', 'copy', '-bsf:v', 'h264_mp4toannexb', '-f', 'mpegts', middle])
+    parts.append(middle)
+    if end - k2 > SMART_CUT_MIN_EDGE:
+        encode_edge(k2, end, 'tail.ts')
+
+    list_file = os.path.join(work_dir, 'parts.txt')
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for part in parts:
+            f.write("file '" + part.replace("'", "'\\''") + "'\n")
+
+    cmd = [ffmpeg_exe, '-y', '-f', 'concat', '-safe', '0', '-i', list_file]
+    if audio:
+        # Звук режем отдельно и целиком: кадры AAC короткие, перекодирование дешёвое
+        cmd += ['-ss', str(start), '-i', src, '-t', str(end - start),
+                '-map', '0:v:0', '-map', '1:a:0', '-c:a', 'aac', '-b:a', a_bitrate]
+    cmd += ['-c:v', 'copy', '-movflags', '+faststart', dst]
+    run_ffmpeg(cmd)
+    return True
+
+def get_audio_bitrate(bitrate):
+    """Битрейт для ffmpeg по значению из интерфейса ('auto', '128', '192', '320')"""
+    return {'128': '128k', 'fast': '128k', '320': '320k'}.get(bitrate, '192k')
+
+def plan_audio_codec(codec, do_convert, bitrate, a_bitrate=None):
+    """Решает, как резать аудио с кодеком codec (имя как у ffprobe, None - неизвестен):
+    (расширение, аргументы кодека).
+
+    Копия без перекодирования, если конвертация выключена или источник уже MP3
+    и битрейт не задан явно. Неизвестный кодек копируется в .mka (Matroska примет любой).
+    Иначе MP3 через libmp3lame с битрейтом a_bitrate (по умолчанию - по значению bitrate).
+    """
+    if codec in AUDIO_COPY_EXT and (not do_convert or (codec == 'mp3' and bitrate == 'auto')):
+        return AUDIO_COPY_EXT[codec], ['-c:a', 'copy']
+    if not do_convert:
+        return '.mka', ['-c:a', 'copy']
+    return '.mp3', ['-c:a', 'libmp3lame', '-b:a', a_bitrate or get_audio_bitrate(bitrate)]
+
+def plan_audio_cut(ffprobe_exe, src, do_convert, bitrate, a_bitrate=None):
+    """plan_audio_codec по первому аудиопотоку файла"""
+    audio = probe_streams(ffprobe_exe, src)['audio'] or {}
+    return plan_audio_codec(audio.get('codec_name'), do_convert, bitrate, a_bitrate)
+
+# --- ПРОФИЛИ КОДИРОВАНИЯ ---
+# Варианты video_settings в выпадающих списках; подписи - ключи локали video_settings_<вариант>
+VIDEO_SETTINGS_CHOICES = ('auto', 'fast', 'quality', 'passthrough')
+# video_settings задачи -> как перекодировать при обрезке. Края smart cut - секунды видео,
+# поэтому даже 'auto' кодирует их медленным пресетом; полное перекодирование (запасной путь
+# и несколько фрагментов за проход) - быстрее. passthrough не перекодирует вообще:
+# начало фрагмента встаёт на ключевой кадр, аудио копируется как есть
+ENCODING_PROFILES = {
+    'passthrough': {'copy': True, 'edge': None, 'full': None, 'audio_bitrate': '192k'},
+    'fast': {'copy': False, 'edge': ('ultrafast', 23), 'full': ('ultrafast', 23), 'audio_bitrate': '128k'},
+    'auto': {'copy': False, 'edge': ('medium', 18), 'full': ('veryfast', 20), 'audio_bitrate': '192k'},
+    'quality': {'copy': False, 'edge': ('slow', 16), 'full': ('slow', 18), 'audio_bitrate': '320k'},
+}
+
+def get_encoding_profile(video_settings, bitrate='auto', threads=None):
+    """Параметры кодирования задачи: copy, edge_opts/full_args для x264, audio_bitrate, threads.
+    Явно выбранный битрейт важнее битрейта профиля"""
+    name = video_settings if video_settings in ENCODING_PROFILES else 'auto'
+    spec = ENCODING_PROFILES[name]
+    x264 = lambda preset_crf: ['-preset', preset_crf[0], '-crf', str(preset_crf[1])] if preset_crf else []
+    return {
+        'name': name,
+        'copy': spec['copy'],
+        'edge_opts': x264(spec['edge']),
+        'full_args': ['-c:v', 'libx264', *x264(spec['full'])],
+        'audio_bitrate': get_audio_bitrate(bitrate) if bitrate != 'auto' else spec['audio_bitrate'],
+        'threads': threads,
+    }
+
+def cut_audio(ffmpeg_exe, src, start, end, dst, codec_args, threads=None):
+    """Обрезка аудио с поиском по входу (без декодирования с начала файла)"""
+    run_ffmpeg([ffmpeg_exe, '-y', *get_thread_args(threads), '-ss', str(start), '-i', src, '-t', str(end - start),
+                '-vn', *codec_args, *get_thread_args(threads), dst])
+
+def cut_many(ffmpeg_exe, src, cuts, threads=None):
+    """Несколько фрагментов из одного файла за один запуск ffmpeg.
+
+    cuts - список (начало, конец, файл, аргументы кодека). -ss/-to стоят после -i
+    у каждого выхода, поэтому вход читается и декодируется один раз на все фрагменты.
+    threads делится между выходами: все кодеры работают одновременно.
+    """
+    cmd = [ffmpeg_exe, '-y', *get_thread_args(threads), '-i', src]
+    per_output = max(1, threads // len(cuts)) if threads and cuts else None
+    for start, end, dst, codec_args in cuts:
+        cmd += ['-ss', str(start), '-to', str(end), *codec_args, *get_thread_args(per_output), dst]
+    run_ffmpeg(cmd)
+
+def convert_audio(ffmpeg_exe, src, dst, codec_args, threads=None):
+    """Перекодирует (webm/m4a -> mp3) или перепаковывает (-c:a copy) звук файла целиком.
+    Теги исходника сохраняются, codec_args может дописать свои (get_audio_output_args)"""
+    run_ffmpeg([ffmpeg_exe, '-y', *get_thread_args(threads), '-i', src, '-vn', '-map_metadata', '0', *codec_args,
+                *get_thread_args(threads), dst])
+
+def get_audio_output_args(info, ext):
+    """Теги из info (название, исполнитель, альбом, год, ссылка) и настройки контейнера для полного аудио"""
+    tags = {
+        'title': info.get('track') or info.get('title'),
+        'artist': info.get('artist') or info.get('creator') or info.get('uploader'),
+        'album': info.get('album'),
+        'date': (info.get('release_date') or info.get('upload_date') or '')[:4],
+        'comment': info.get('webpage_url'),
+    }
+    args = [arg for key, value in tags.items() if value for arg in ('-metadata', f'{key}={value}')]
+    if ext == '.m4a':
+        args += ['-movflags', '+faststart']  # индекс в начале: плееры читают файл сразу
+    return args
+
+def wants_mp3(task, profile):
+    """Аудио конвертируется в MP3 только по запросу: галочка конвертации или явный битрейт.
+    Иначе исходный поток (AAC, Opus) перепаковывается без потерь в свой контейнер (.m4a, .opus)"""
+    return (task.get('conv', False) or task.get('bitrate', 'auto') != 'auto') and not profile['copy']
+
+# --- ПОТОКОВАЯ ОБРАБОТКА (скачивание сразу в stdin ffmpeg) ---
+STREAM_PROTOCOLS = ('http', 'https')
+STREAM_CHUNK = 64 * 1024
+# acodec из info yt-dlp (префикс) -> имя кодека как у ffprobe
+ACODEC_NAMES = (('mp4a', 'aac'), ('aac', 'aac'), ('opus', 'opus'), ('vorbis', 'vorbis'), ('mp3', 'mp3'), ('flac', 'flac'))
+
+def get_audio_codec_name(acodec):
+    acodec = (acodec or '').lower()
+    return next((name for prefix, name in ACODEC_NAMES if acodec.startswith(prefix)), None)
+
+def is_streamable_format(fmt):
+    """Один прогрессивный файл по http(s): ffmpeg может читать его из pipe по мере скачивания.
+    HLS/DASH и склейка видео+аудио так не читаются - для них остаётся временный файл"""
+    return not fmt.get('requested_formats') and fmt.get('protocol') in STREAM_PROTOCOLS and bool(fmt.get('url'))
+
+def iter_http_chunks(ydl, fmt, chunk=STREAM_CHUNK):
+    """Байты формата через сетевой стек YoutubeDL (прокси, cookies, заголовки формата).
+
+    Если формат задаёт http_chunk_size (YouTube режет скорость длинных запросов),
+    качаем диапазонами, как это делает сам yt-dlp.
+    """
+    range_size = (fmt.get('downloader_options') or {}).get('http_chunk_size')
+    pos = 0
+    while True:
+        headers = dict(fmt.get('http_headers') or {})
+        if range_size:
+            headers['Range'] = f'bytes={pos}-{pos + range_size - 1}'
+        got = 0
+        with contextlib.closing(ydl.urlopen(yt_dlp.networking.Request(fmt['url'], headers=headers))) as resp:
+            partial = resp.status == 206
+            while True:
+                data = resp.read(chunk)
+                if not data:
+                    break
+                got += len(data)
+                yield data
+        pos += got
+        # Сервер без поддержки Range отдал всё целиком - больше запрашивать нечего
+        if not range_size or not partial or got < range_size:
+            return
+
+def open_ffmpeg_stream(ffmpeg_exe, outputs, threads=None):
+    """Запускает ffmpeg, читающий вход из stdin. outputs - список (начало или None, конец, файл, аргументы кодека).
+
+    Возвращает (процесс, хвост stderr). stderr читается в фоне, иначе ffmpeg встанет на заполненном pipe.
+    Когда все выходы с -to дописаны, ffmpeg завершается сам и запись в stdin падает - скачивание можно прекращать.
+    """
+    cmd = [ffmpeg_exe, '-y', '-v', 'error', *get_thread_args(threads), '-i', 'pipe:0']
+    for start, end, dst, codec_args in outputs:
+        if start is not None:
+            cmd += ['-ss', str(start), '-to', str(end)]
+        cmd += ['-vn', *codec_args, *get_thread_args(threads), dst]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            startupinfo=get_startupinfo())
+    tail = collections.deque(maxlen=20)
+    def drain():
+        for line in proc.stderr:
+            tail.append(line.decode('utf-8', errors='replace').rstrip())
+    threading.Thread(target=drain, daemon=True).start()
+    return proc, tail
+
+# Сколько фрагментов одного источника максимум режется за одно скачивание
+MAX_BATCH_SIZE = 20
+
+def get_batch_key(task):
+    """Ключ группировки фрагментов: одинаковые URL и качество качаются один раз. None - без группы"""
+    if task.get('s') is None:
+        return None
+    return (task['url'], task.get('q_key'), task.get('fmt'), task.get('is_audio'))
+
+BATCH_MAX_GAP = 60  # сек между отрезками фрагментов, при котором их ещё выгодно качать одним отрезком
+
+def select_batch(task, same_group, max_gap=BATCH_MAX_GAP, padding=SECTION_PADDING):
+    """Фрагменты из same_group (тот же ключ get_batch_key), которые качаются одним отрезком с task:
+    их отрезки с запасом перекрываются или отстоят не больше чем на max_gap.
+
+    Далёкие фрагменты одного видео уходят в отдельные батчи: иначе [min s, max e]
+    двух клипов в начале и в конце длинного видео - это почти всё видео.
+    """
+    batch, rest = [task], sorted(same_group, key=lambda t: t['s'])
+    start, end = task['s'] - padding, task['e'] + padding
+    grown = True
+    while grown and len(batch) < MAX_BATCH_SIZE:
+        grown = False
+        for t in rest:
+            if t['s'] - padding <= end + max_gap and t['e'] + padding >= start - max_gap:
+                batch.append(t)
+                rest.remove(t)
+                start, end = min(start, t['s'] - padding), max(end, t['e'] + padding)
+                grown = True
+                break
+    return batch
+
+# Группы доменов для лимита параллельных загрузок на один сервис
+HOST_GROUPS = {
+    'youtube': ('youtube.com', 'youtu.be', 'youtube-nocookie.com', 'googlevideo.com'),
+    'twitch': ('twitch.tv', 'ttvnw.net'),
+    'vimeo': ('vimeo.com', 'vimeocdn.com'),
+    'dailymotion': ('dailymotion.com', 'dai.ly'),
+    'tiktok': ('tiktok.com',),
+    'instagram': ('instagram.com',),
+    'facebook': ('facebook.com', 'fb.watch'),
+    'twitter': ('twitter.com', 'x.com'),
+    'reddit': ('reddit.com', 'redd.it'),
+    'bilibili': ('bilibili.com', 'b23.tv'),
+}
+
+def get_host_key(url):
+    """Возвращает ключ сервиса для URL (youtube, twitch, ...) или домен второго уровня"""
+    try:
+        host = urllib.parse.urlparse(url if '://' in url else f'https://{url}').hostname or ''
+    except ValueError:
+        host = ''
+    host = host.lower()
+    for key, domains in HOST_GROUPS.items():
+        if any(host == d or host.endswith('.' + d) for d in domains):
+            return key
+    parts = host.split('.')
+    return '.'.join(parts[-2:]) if len(parts) >= 2 else (host or 'unknown')
+
+class DownloadScheduler:
+    """Запускает задачи очереди параллельно: общий лимит и лимит на один хост"""
+
+    def __init__(self, max_parallel=3, max_per_host=2):
+        self.max_parallel = max_parallel
+        self.max_per_host = max_per_host
+        self.cond = threading.Condition()
+        self.active = {}  # tid -> ключ хоста
+
+    def active_count(self):
+        with self.cond:
+            return len(self.active)
+
+    def is_idle(self):
+        return self.active_count() == 0
+
+    def _pick(self, candidates):
+        if len(self.active) >= max(1, self.max_parallel):
+            return None, None
+        for task in candidates:
+            host = get_host_key(task['url'])
+            load = sum(1 for h in self.active.values() if h == host)
+            if load < max(1, self.max_per_host):
+                return task, host
+        return None, None
+
+    def run(self, get_pending, run_task, should_abort, group_key=None, keep_waiting=None, group_select=None):
+        """Блокирует до завершения всех задач.
+
+        get_pending() вызывается на каждом шаге, поэтому задачи, добавленные
+        во время работы, тоже подхватываются. Каждая задача запускается один раз за прогон.
+        run_task получает список задач: выбранную и ещё не начатые задачи с тем же
+        group_key(task) (до MAX_BATCH_SIZE), чтобы они выполнялись одним заданием.
+        group_select(task, same_group) - если задан, решает, какие из них войдут в батч.
+        Пока keep_waiting() истинно, пустая очередь не завершает прогон.
+        """
+        started = set()
+        with self.cond:
+            while not should_abort():
+                candidates = [t for t in get_pending() if t['id'] not in started]
+                if not candidates and not self.active and not (keep_waiting and keep_waiting()):
+                    break
+                task, host = self._pick(candidates)
+                if task is None:
+                    self.cond.wait(0.5)
+                    continue
+                batch = [task]
+                key = group_key(task) if group_key else None
+                if key is not None:
+                    same = [t for t in candidates if t is not task and group_key(t) == key]
+                    batch = group_select(task, same) if group_select else batch + same[:MAX_BATCH_SIZE - 1]
+                started.update(t['id'] for t in batch)
+                self.active[task['id']] = host
+                threading.Thread(target=self._run_one, args=(batch, run_task), daemon=True).start()
+            # Ждём активные задачи (при остановке они сами выходят через abort в хуке)
+            while self.active:
+                self.cond.wait(0.5)
+
+    def _run_one(self, batch, run_task):
+        try:
+            run_task(batch)
+        except Exception as e:
+            logging.error(f"Scheduler: task {batch[0].get('id')} crashed: {e}")
+        finally:
+            with self.cond:
+                self.active.pop(batch[0]['id'], None)
+                self.cond.notify_all()
+
+# --- ПОТОКИ НА ФРАГМЕНТЫ (HLS/DASH) ---
+FRAGMENTED_PROTOCOLS = ('m3u8_native', 'http_dash_segments', 'http_dash_segments_generator', 'ism')
+FRAGMENT_CONCURRENCY_VALUES = (1, 2, 4, 8, 16)  # фиксированные значения в настройках, кроме 'auto'
+FRAGMENT_CONNECTION_BUDGETS = (4, 8, 16, 32)
+FRAGMENT_CONCURRENCY_MAX = 16
+FRAGMENT_START_LEVEL = 2
+FRAGMENT_GAIN = 1.1        # во сколько раз должна вырасти скорость, чтобы добавить ещё поток
+FRAGMENT_BACKOFF_MAX = 30  # максимум паузы перед повтором фрагмента, сек
+
+def is_fragmented_format(fmt):
+    """Качается ли формат фрагментами (только тогда yt-dlp использует concurrent_fragment_downloads)"""
+    return any(f.get('protocol') in FRAGMENTED_PROTOCOLS for f in (fmt.get('requested_formats') or [fmt]))
+
+def get_fragment_backoff(attempt):
+    """Пауза перед повтором фрагмента: экспоненциальная, чтобы 429 не превращался в шторм запросов"""
+    return min(FRAGMENT_BACKOFF_MAX, 0.5 * 2 ** attempt)
+
+class FragmentConcurrency:
+    """Число потоков на фрагменты для задачи: AIMD по хостам CDN и общий бюджет соединений.
+
+    yt-dlp фиксирует число потоков в начале скачивания, поэтому уровень подстраивается между
+    скачиваниями: пока скорость растёт - на поток больше, при ошибках фрагментов (429, обрывы) -
+    вдвое меньше. Бюджет общий для всех идущих задач и урезает только дополнительные потоки.
+    """
+
+    def __init__(self, budget=16):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.hosts = {}  # хост -> {'level', 'rates': {потоков: байт/с}, 'errors', 'cut_at'}
+        self.in_use = 0
+
+    def _state(self, host):
+        return self.hosts.setdefault(host, {'level': FRAGMENT_START_LEVEL, 'rates': {}, 'errors': 0, 'cut_at': 0})
+
+    def acquire(self, host, fragmented, fixed=None):
+        """Сколько соединений дать задаче. Хотя бы одно всегда: задачи ограничивает планировщик"""
+        with self.lock:
+            want = (fixed or self._state(host)['level']) if fragmented else 1
+            n = max(1, min(want, self.budget - self.in_use))
+            self.in_use += n
+            return n
+
+    def on_error(self, host):
+        """Повтор фрагмента: уровень хоста вдвое ниже (не чаще раза в секунду - один всплеск 429 = одно снижение)"""
+        with self.lock:
+            st = self._state(host)
+            st['errors'] += 1
+            now = time.time()
+            if now - st['cut_at'] >= 1:
+                st['level'] = max(1, st['level'] // 2)
+                st['cut_at'] = now
+                # Замеры на уровнях выше нового больше не показательны
+                st['rates'] = {lvl: r for lvl, r in st['rates'].items() if lvl <= st['level']}
+
+    def release(self, host, n, fragmented, nbytes=0, seconds=0, failed=False):
+        """Возвращает соединения в бюджет и учитывает скорость скачивания на n потоках"""
+        with self.lock:
+            self.in_use = max(0, self.in_use - n)
+            if not fragmented or failed or nbytes <= 0 or seconds <= 0:
+                return
+            st = self._state(host)
+            rate = nbytes / seconds
+            prev = st['rates'].get(n)
+            st['rates'][n] = rate if prev is None else (prev + rate) / 2
+            if n != st['level']:
+                return  # бюджет урезал задачу или уровень уже сменился - по ней уровень не двигаем
+            lower = max((lvl for lvl in st['rates'] if lvl < n), default=None)
+            if lower is None or st['rates'][n] >= st['rates'][lower] * FRAGMENT_GAIN:
+                st['level'] = min(FRAGMENT_CONCURRENCY_MAX, n + 1)
+            elif st['rates'][n] < st['rates'][lower]:
+                st['level'] = lower
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_use': self.in_use,
+                'budget': self.budget,
+                'levels': {host: st['level'] for host, st in self.hosts.items()},
+                'errors': sum(st['errors'] for st in self.hosts.values()),
+            }
+
+# --- ОГРАНИЧЕНИЕ СКОРОСТИ ---
+TASK_PRIORITIES = {'low': 1, 'normal': 2, 'high': 4}  # вес задачи в общей полосе
+PRIORITY_ORDER = ('low', 'normal', 'high')
+PRIORITY_ICONS = {'low': "▽", 'normal': "◇", 'high': "⚡"}
+BANDWIDTH_LIMITS_KB = (0, 256, 512, 1024, 2048, 5120, 10240, 20480)  # КБ/с, 0 - без ограничения
+BANDWIDTH_BURST = 0.5         # секунд своей доли, которые задача может набрать впрок
+BANDWIDTH_RATE_WINDOW = 3.0   # окно замера общей скорости, сек
+BANDWIDTH_BLOCK = 64 * 1024   # блок чтения при ограничении: иначе yt-dlp растит его до мегабайт и скорость скачет
+
+BANDWIDTH_MIN_READRATE = 0.01  # нижняя граница -readrate для ffmpeg (доля скорости воспроизведения)
+
+def get_task_weight(tasks):
+    return max(TASK_PRIORITIES.get(t.get('priority'), TASK_PRIORITIES['normal']) for t in tasks)
+
+def get_section_readrate(share, fmt_info, duration=None):
+    """-readrate для ffmpeg, который качает отрезок: доля полосы (байт/с) в долях скорости воспроизведения
+    по битрейту формата. None - ограничения нет или битрейт неизвестен"""
+    if not share:
+        return None
+    formats = fmt_info.get('requested_formats') or [fmt_info]
+    kbps = fmt_info.get('tbr') or sum(f.get('tbr') or 0 for f in formats)
+    if not kbps and duration:
+        kbps = sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in formats) * 8 / 1000 / duration
+    if not kbps:
+        return None
+    return max(share * 8 / 1000 / kbps, BANDWIDTH_MIN_READRATE)
+
+class BandwidthLimiter:
+    """Общая полоса для всех идущих скачиваний: token bucket на задачу, доля пропорциональна весу приоритета.
+
+    consume() вызывается из progress hook yt-dlp и засыпает, пока задача не уложится в свою долю,
+    поэтому срочные задачи получают большую часть полосы. rate (байт/с, 0 - без ограничения)
+    и веса можно менять на ходу. Общая скорость замеряется всегда, и при отключённом лимите.
+    Отрезки качает ffmpeg без progress hook: им доля (share) передаётся один раз при старте, как -readrate.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.tasks = {}                     # ключ скачивания -> {'weight', 'tokens', 'last'}
+        self.samples = collections.deque()  # (время, байт) за последние BANDWIDTH_RATE_WINDOW сек
+        self.window_bytes = 0
+
+    def register(self, tid, weight):
+        with self.lock:
+            self.tasks[tid] = {'weight': weight, 'tokens': 0.0, 'last': time.monotonic()}
+
+    def unregister(self, tid):
+        with self.lock:
+            self.tasks.pop(tid, None)
+
+    def set_weight(self, tid, weight):
+        with self.lock:
+            if tid in self.tasks:
+                self.tasks[tid]['weight'] = weight
+
+    def share(self, tid):
+        """Текущая доля полосы задачи, байт/с (0 - без ограничения)"""
+        with self.lock:
+            st = self.tasks.get(tid)
+            if not self.rate or st is None:
+                return 0
+            return self.rate * st['weight'] / sum(t['weight'] for t in self.tasks.values())
+
+    def _refill(self, st, now):
+        """Пополняет ведро задачи её текущей долей полосы. Возвращает долю (байт/с)"""
+        share = self.rate * st['weight'] / sum(t['weight'] for t in self.tasks.values())
+        st['tokens'] = min(share * BANDWIDTH_BURST, st['tokens'] + (now - st['last']) * share)
+        st['last'] = now
+        return share
+
+    def consume(self, tid, nbytes, should_abort=None):
+        with self.lock:
+            now = time.monotonic()
+            self.samples.append((now, nbytes))
+            self.window_bytes += nbytes
+            st = self.tasks.get(tid)
+            if not self.rate or st is None:
+                return
+            self._refill(st, now)
+            st['tokens'] -= nbytes
+        # Долг выплачиваем сном короткими кусками: смена лимита и приоритетов действует сразу
         while True:
-            new_name = f"{base_name}_{counter}{extension}"
-            new_path = os.path.join(base_path, new_name)
-            if not os.path.exists(new_path):
-                return new_path
-            counter += 1
-            if counter > 1000:  # Защита от бесконечного цикла
-                # Если достигли 1000, добавляем timestamp
-                timestamp = int(time.time())
-                new_name = f"{base_name}_{timestamp}{extension}"
-                return os.path.join(base_path, new_name)
-    
-    def get_quality_suffix(self, q_lbl, is_audio):
-        """Извлекает суффикс качества из метки для добавления в имя файла"""
-        if is_audio:
-            return "_audio"
-        
-        if not q_lbl:
-            return ""
-        
-        # Извлекаем разрешение из метки качества (проверяем сначала более специфичные случаи)
-        q_lbl_lower = q_lbl.lower()
-        
-        # Проверяем на 1080p (более специфично, чем просто "hd")
-        if '1080' in q_lbl_lower or 'full hd' in q_lbl_lower or 'fullhd' in q_lbl_lower:
-            return "_1080p"
-        # Проверяем на 720p
-        elif '720' in q_lbl_lower:
-            return "_720p"
-        # Проверяем на "best" или "auto" (лучшее качество)
-        elif 'best' in q_lbl_lower or 'auto' in q_lbl_lower or 'лучшее' in q_lbl_lower or 'лучшее' in q_lbl_lower:
-            return "_best"
-        # Общий случай HD (если не 1080 и не 720)
-        elif 'hd' in q_lbl_lower:
-            return "_hd"
-        else:
-            return ""
+            with self.lock:
+                st = self.tasks.get(tid)
+                if not self.rate or st is None:
+                    return
+                share = self._refill(st, time.monotonic())
+                if st['tokens'] >= 0:
+                    return
+                wait = -st['tokens'] / share
+            if should_abort and should_abort():
+                return
+            time.sleep(min(wait, 0.25))
+
+    def current_rate(self):
+        """Общая скорость всех скачиваний за последние секунды, байт/с"""
+        with self.lock:
+            edge = time.monotonic() - BANDWIDTH_RATE_WINDOW
+            while self.samples and self.samples[0][0] < edge:
+                self.window_bytes -= self.samples.popleft()[1]
+            if not self.samples:
+                return 0.0
+            # В начале скачивания окно ещё не заполнено: делим на фактически прошедшее время
+            span = min(BANDWIDTH_RATE_WINDOW, max(1.0, time.monotonic() - self.samples[0][0]))
+            return self.window_bytes / span
+
+# Кэш метаданных: стабильные поля (название, длительность) живут долго,
+# ссылки на потоки в formats - только до истечения подписи
+META_STABLE_TTL = 7 * 24 * 3600
+META_MAX_ENTRIES = 500
+# Тяжёлые поля, которые не нужны ни для карточки, ни для скачивания
+META_HEAVY_FIELDS = ('automatic_captions', 'subtitles', 'heatmap', 'thumbnails', 'comments', 'description')
+META_STABLE_FIELDS = ('id', 'extractor', 'extractor_key', 'title', 'duration', 'uploader', 'channel',
+                      'webpage_url', 'thumbnail', 'is_live', 'upload_date')
+
+# Поля формата, которых хватает resolve_format_ladder и describe_format (остальное на диск не пишем)
+META_FORMAT_FIELDS = ('format_id', 'ext', 'vcodec', 'acodec', 'height', 'tbr', 'filesize', 'filesize_approx',
+                      'url', 'protocol')
+
+def get_slim_formats(formats):
+    """Форматы для подбора качества: только META_FORMAT_FIELDS, без генерируемых фрагментов"""
+    if not formats:
+        return None
+    return [{k: f[k] for k in META_FORMAT_FIELDS if f.get(k) is not None}
+            for f in formats if not callable(f.get('fragments'))]
+
+_extractor_classes = None
+# Хост -> экстракторы, уже подходившие ссылкам с него (в порядке yt-dlp). Список yt-dlp не трогаем
+_extractors_by_host = {}
+_extractor_lock = threading.Lock()
+
+def get_canonical_video_key(url):
+    """Ключ 'Extractor:id' по URL без сетевых запросов, или None для Generic/неизвестных ссылок"""
+    global _extractor_classes
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    with _extractor_lock:
+        if _extractor_classes is None:
+            _extractor_classes = tuple(ie for ie in yt_dlp.extractor.gen_extractor_classes() if ie.ie_key() != 'Generic')
+        known = _extractors_by_host.get(host, ())
+    # Ссылки обычно идут пачками с одного сайта: сначала экстракторы, знакомые по этому хосту
+    for ie in itertools.chain(known, _extractor_classes):
+        try:
+            if not ie.suitable(url):
+                continue
+            if ie not in known:
+                with _extractor_lock:
+                    found = _extractors_by_host.get(host, ())
+                    if ie not in found:
+                        _extractors_by_host[host] = tuple(e for e in _extractor_classes if e in found or e is ie)
+            video_id = ie.get_temp_id(url)
+            return f"{ie.ie_key()}:{video_id}" if video_id else None
+        except Exception:
+            continue
+    return None
+
+def normalize_media_url(url):
+    """URL без #фрагмента, схема и хост в нижнем регистре"""
+    parts = urllib.parse.urlsplit(url.strip())
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+def get_info_video_key(info, url=None):
+    """Ключ видео по info: 'Extractor:id'. У Generic id - имя файла (video.mp4, master.m3u8),
+    поэтому для него ключ - нормализованный URL"""
+    ie_key = info.get('extractor_key') or info.get('extractor')
+    if ie_key and info.get('id') and ie_key.lower() != 'generic':
+        return f"{ie_key}:{info['id']}"
+    source = info.get('webpage_url') or info.get('original_url') or url
+    return f"Generic:{normalize_media_url(source)}" if source else None
+
+# Лёгкий probe для карточек: oEmbed отдаёт название одним запросом, без страницы плеера,
+# форматов и JS-подписей. Полный extract_info - только перед скачиванием
+OEMBED_ENDPOINTS = {
+    # ключ экстрактора: (endpoint, каноническая ссылка на видео по id)
+    'Youtube': ('https://www.youtube.com/oembed', 'https://www.youtube.com/watch?v={}'),
+    'Vimeo': ('https://vimeo.com/api/oembed.json', 'https://vimeo.com/{}'),
+}
+OEMBED_TIMEOUT = 5
+# Параметры ссылки, при которых экстрактор видео вернёт плейлист - такие ссылки probe-им полностью
+PLAYLIST_QUERY_PARAMS = ('list',)
+
+def fetch_light_meta(url, disable_proxy=False, timeout=OEMBED_TIMEOUT):
+    """Название (и что ещё отдаст oEmbed) по ссылке на одно видео, или None - тогда нужен полный probe"""
+    video_key = get_canonical_video_key(url)
+    if not video_key:
+        return None
+    ie_key, video_id = video_key.split(':', 1)
+    endpoint = OEMBED_ENDPOINTS.get(ie_key)
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    if not endpoint or any(p in query for p in PLAYLIST_QUERY_PARAMS):
+        return None
+    api, watch_url = endpoint
+    request_url = f"{api}?{urllib.parse.urlencode({'url': watch_url.format(video_id), 'format': 'json'})}"
+    handlers = [urllib.request.ProxyHandler({})] if disable_proxy else []
+    try:
+        with urllib.request.build_opener(*handlers).open(request_url, timeout=timeout) as resp:
+            data = json.loads(resp.read().decode('utf-8'))
+    except Exception as e:
+        # 401/403 у приватных и 18+ видео, сетевые ошибки: решит полный probe
+        logging.info(f"oEmbed probe failed for {url}: {e}")
+        return None
+    if not data.get('title'):
+        return None
+    meta = {'id': video_id, 'extractor_key': ie_key, 'title': data['title']}
+    if data.get('author_name'):
+        meta['uploader'] = data['author_name']
+    if data.get('duration'):
+        meta['duration'] = data['duration']
+    return meta
+
+class MetadataCache:
+    """Кэш результатов extract_info с TTL и LRU-вытеснением.
+
+    В памяти - полный info (его получает обработка), в metadata_cache.json - только
+    стабильные метаданные и урезанный список форматов (META_FORMAT_FIELDS) для подбора качества.
+    Файл читается в фоновом потоке: окно не ждёт его при старте.
+    """
+
+    def __init__(self, path, max_entries=META_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # key -> запись, порядок = LRU
+        self.url_index = {}                       # url -> key
+        self.hits = 0
+        self.misses = 0
+        self._save_timer = None
+        self.loaded = threading.Event()
+        threading.Thread(target=self.load, daemon=True).start()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                now = time.time()
+                with self.lock:
+                    for entry in data.get('entries', []):
+                        if now - entry.get('stable_at', 0) >= META_STABLE_TTL:
+                            continue
+                        # Файлы версии 1 хранили info целиком: оставляем от него только форматы
+                        formats = entry.pop('formats', None) or (entry.pop('info', None) or {}).get('formats')
+                        entry['formats'] = get_slim_formats(formats) if now < entry.get('info_expires', 0) else None
+                        entry['info'] = None
+                        self.entries[entry['key']] = entry
+                        for url in entry.get('urls', []):
+                            self.url_index[url] = entry['key']
+        except Exception as e:
+            logging.error(f"Error loading metadata cache: {e}")
+            with self.lock:
+                self.entries.clear()
+                self.url_index.clear()
+        finally:
+            self.loaded.set()
+
+    def save(self):
+        self.loaded.wait()
+        with self.lock:
+            self._save_timer = None
+            # Снимок под локом, запись на диск - без него: lookup из потоков не ждёт файловую систему
+            data = {'version': 2, 'entries': [{k: v for k, v in entry.items() if k != 'info'}
+                                              for entry in self.entries.values()]}
+        with self.save_lock:
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logging.error(f"Error saving metadata cache: {e}")
+
+    def _schedule_save(self):
+        # Пишем на диск не чаще раза в пару секунд: при пачке URL не переписываем файл на каждый
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(2.0, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _find(self, url):
+        key = self.url_index.get(url) or get_canonical_video_key(url)
+        entry = self.entries.get(key) if key else None
+        if not entry:
+            return None
+        if time.time() - entry['stable_at'] >= META_STABLE_TTL:
+            self._drop(key)
+            self._schedule_save()
+            return None
+        if entry.get('formats') is not None and time.time() >= entry['info_expires'] - INFO_REFRESH_MARGIN:
+            # Ссылки истекли: форматы выбрасываем, стабильные метаданные оставляем
+            entry['formats'] = entry['info'] = None
+            self._schedule_save()
+        self.entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key):
+        old = self.entries.pop(key, None)
+        for u in (old or {}).get('urls', []):
+            if self.url_index.get(u) == key:
+                del self.url_index[u]
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+        self._schedule_save()
+
+    def lookup(self, url, need_info=False):
+        """Возвращает (стабильные метаданные, info с форматами), любое может быть None.
+
+        info есть только у извлечённых в этом запуске видео. Попадание считается,
+        если нашлось то, что нужно: info при need_info, иначе метаданные.
+        """
+        self.loaded.wait()
+        with self.lock:
+            entry = self._find(url)
+            meta = entry['meta'] if entry else None
+            info = entry.get('info') if entry else None
+            if (info if need_info else meta) is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return meta, info
+
+    def get_formats(self, url):
+        """Урезанный список форматов для подбора качества (в том числе из прошлого запуска), или None"""
+        self.loaded.wait()
+        with self.lock:
+            entry = self._find(url)
+            return entry.get('formats') if entry else None
+
+    def put(self, url, info):
+        """Сохраняет info как вернул yt-dlp (не sanitize-нутый: его же получит обработка).
+        info с генерируемыми фрагментами не кэшируется - только стабильные метаданные"""
+        if not info or not info.get('id') or info.get('_type', 'video') != 'video':
+            return
+        key = get_info_video_key(info, url)
+        stored = None if has_generated_fragments(info) else {k: v for k, v in info.items() if k not in META_HEAVY_FIELDS}
+        self.loaded.wait()
+        with self.lock:
+            entry = self.entries.pop(key, None) or {'key': key, 'urls': []}
+            entry['meta'] = {k: info[k] for k in META_STABLE_FIELDS if k in info}
+            entry['stable_at'] = time.time()
+            entry['info'] = stored
+            entry['formats'] = get_slim_formats(info.get('formats')) if stored else None
+            entry['info_expires'] = get_info_expiry(info) if stored else 0
+            for u in (url, info.get('webpage_url'), info.get('original_url')):
+                if u and u not in entry['urls']:
+                    entry['urls'].append(u)
+                    self.url_index[u] = key
+            self._store(key, entry)
+
+    def put_meta(self, url, meta):
+        """Сохраняет только стабильные метаданные из лёгкого probe (info с форматами не трогает)"""
+        key = f"{meta['extractor_key']}:{meta['id']}"
+        self.loaded.wait()
+        with self.lock:
+            entry = self.entries.pop(key, None) or {'key': key, 'urls': [], 'info': None, 'formats': None, 'info_expires': 0}
+            entry['meta'] = dict(entry.get('meta') or {}, **meta)
+            entry['stable_at'] = time.time()
+            if url not in entry['urls']:
+                entry['urls'].append(url)
+                self.url_index[url] = key
+            self._store(key, entry)
+
+    def stats(self):
+        self.loaded.wait()
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'file_size': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            }
+
+# --- ПЛЕЙЛИСТЫ И КАНАЛЫ ---
+PLAYLIST_MAX_DEPTH = 2  # канал -> вкладки -> видео
+
+def iter_playlist_entries(ydl, playlist):
+    """Записи плоского плейлиста по мере загрузки страниц (генератор, LazyList, список или PagedList).
+    PlaylistEntries - тот же обход, что у самого yt-dlp: PagedList читается постранично через индексацию"""
+    if playlist.get('entries') is None:
+        return iter(())
+    return (entry for _, entry in yt_dlp.utils.PlaylistEntries(ydl, playlist)[:])
+
+def is_nested_playlist(entry, playlist):
+    """Ссылка в плоском плейлисте, которая сама может оказаться плейлистом (вкладки канала и т.п.):
+    её обрабатывает тот же экстрактор, что выдал список. Ложное срабатывание стоит одного лишнего извлечения"""
+    if entry.get('_type') != 'url' or not entry.get('ie_key'):
+        return False
+    return entry['ie_key'] == (playlist.get('extractor_key') or playlist.get('ie_key'))
+
+# --- ЖУРНАЛ ОЧЕРЕДИ ---
+JOURNAL_TASK_FIELDS = ('url', 's', 'e', 'fmt', 'is_audio', 'q_lbl', 'conv', 'bitrate', 'video_settings',
+                       'title', 'parent', 'priority')
+# стадии: extracted, downloading, downloaded, cut, renamed; expanded - плейлист развёрнут в задачи
+JOURNAL_DONE_STAGES = ('cut', 'renamed', 'expanded')
+TEMP_FILE_RE = re.compile(r'^temp_(?:download|cut)_([0-9a-f]+)')
+ORPHAN_MIN_AGE = 600  # свежие временные файлы могут принадлежать другому запущенному экземпляру
+
+class QueueJournal:
+    """Журнал очереди на диске: JSON Lines, только дописывание, fsync на каждую запись.
+
+    Переживает падение, закрытие окна и restart_app: при старте незавершённые задачи
+    поднимаются из журнала (load), а сам журнал сжимается до них (compact).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def append(self, op, key=None, sync=True, **fields):
+        """sync=False - без fsync (пачка записей при разворачивании плейлиста, fsync сделает следующая запись)"""
+        record = {'op': op, 'key': key, 'time': int(time.time()), **fields}
+        with self.lock:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    f.flush()
+                    if sync:
+                        os.fsync(f.fileno())
+            except Exception as e:
+                logging.error(f"Error writing queue journal: {e}")
+
+    def load(self):
+        """Возвращает {key: {'key', 'task', 'stage', ...}} в порядке добавления задач"""
+        records = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return records
+        except Exception as e:
+            logging.error(f"Error reading queue journal: {e}")
+            return records
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # строка, недописанная при падении
+            op, key = entry.get('op'), entry.get('key')
+            if op == 'add':
+                records[key] = {'key': key, 'task': entry['task'], 'stage': None}
+            elif op in ('stage', 'set') and key in records:
+                records[key].update({k: v for k, v in entry.items() if k not in ('op', 'key', 'time')})
+            elif op == 'clear':
+                records.clear()
+        return records
+
+    def compact(self, records):
+        """Переписывает журнал, оставляя только переданные записи"""
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for rec in records:
+                        f.write(json.dumps({'op': 'add', 'key': rec['key'], 'task': rec['task']}, ensure_ascii=False) + '\n')
+                        state = {k: v for k, v in rec.items() if k not in ('key', 'task') and v is not None}
+                        if state:
+                            f.write(json.dumps({'op': 'stage', 'key': rec['key'], **state}, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logging.error(f"Error compacting queue journal: {e}")
+
+def reconcile_temp_files(dirs, live_keys, min_age=ORPHAN_MIN_AGE):
+    """Удаляет временные файлы и папки (temp_download_*, temp_cut_*) задач, которых больше нет в очереди.
+    Файлы живых задач (.part и недообработанные) остаются: с них продолжится скачивание"""
+    removed = 0
+    now = time.time()
+    for d in dirs:
+        try:
+            names = os.listdir(d)
+        except OSError:
+            continue
+        for name in names:
+            m = TEMP_FILE_RE.match(name)
+            if not m or m.group(1) in live_keys:
+                continue
+            path = os.path.join(d, name)
+            try:
+                if now - os.path.getmtime(path) < min_age:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                removed += 1
+            except OSError as e:
+                logging.warning(f"Could not remove orphaned temp file {path}: {e}")
+    if removed:
+        logging.info(f"Removed {removed} orphaned temp files")
+    return removed
+
+# --- АРХИВ ЗАГРУЗОК ---
+def get_archive_key(video_key, task):
+    """Ключ архива: видео (Extractor:id) + качество + отрезок"""
+    section = 'full' if task['s'] is None else f"{task['s']}-{task['e']}"
+    return f"{video_key}|{task.get('q_key')}|{section}"
+
+class DownloadArchive:
+    """Что уже скачано (download_archive.jsonl): ключ get_archive_key -> итоговый файл.
+
+    Файл только дописывается, в памяти - dict, поэтому поиск O(1) и при сотнях тысяч записей.
+    Одна и та же ссылка в виде youtu.be, /shorts/ и watch?v= даёт один ключ (get_canonical_video_key).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['key']] = entry
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"Error loading download archive: {e}")
+        # Перекачанные заново записи дублируются в файле: сжимаем, когда дублей много
+        if lines > 2 * len(self.entries) + 1000:
+            self.compact()
+
+    def compact(self):
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for entry in self.entries.values():
+                        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logging.error(f"Error compacting download archive: {e}")
+
+    def lookup(self, key):
+        """Запись архива, если её файл всё ещё на месте"""
+        entry = self.entries.get(key)
+        if entry and os.path.exists(entry['file']):
+            return entry
+        return None
+
+    def add(self, key, file, title=None):
+        entry = {'key': key, 'file': file, 'title': title, 'time': int(time.time())}
+        with self.lock:
+            self.entries[key] = entry
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            except Exception as e:
+                logging.error(f"Error writing download archive: {e}")
+
+# --- КЭШ ИСХОДНИКОВ ---
+SOURCE_CACHE_SIZES_MB = (0, 1024, 2048, 5120, 10240, 20480)
+SOURCE_DIGEST_CHUNK = 64 * 1024
+
+def get_file_digest(path):
+    """Быстрая контрольная сумма: размер + sha1 начала и конца файла"""
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(SOURCE_DIGEST_CHUNK))
+        if size > SOURCE_DIGEST_CHUNK:
+            f.seek(max(SOURCE_DIGEST_CHUNK, size - SOURCE_DIGEST_CHUNK))
+            h.update(f.read(SOURCE_DIGEST_CHUNK))
+    return h.hexdigest()
+
+def link_or_copy(src, dst):
+    """Жёсткая ссылка (без копирования данных), если ФС позволяет, иначе копия"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class SourceMediaCache:
+    """Кэш скачанных исходников (папка source_cache) по ключу видео (get_info_video_key) + format_id.
+
+    Хранит целые файлы и отрезки (start, end), скачанные через download_ranges: отрезок
+    подходит любому фрагменту внутри него. Размер ограничен, вытесняются давно не нужные (LRU).
+    При выдаче файл сверяется с размером и контрольной суммой.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.index_path = os.path.join(path, 'index.json')
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.entries = collections.OrderedDict()  # имя файла -> запись, порядок = LRU
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def total_size(self):
+        return sum(e['size'] for e in self.entries.values())
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for entry in json.load(f).get('entries', []):
+                    if os.path.exists(os.path.join(self.path, entry['name'])):
+                        self.entries[entry['name']] = entry
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"Error loading source cache index: {e}")
+        # Файлы без записи в индексе (падение посреди put) - удаляем
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name != 'index.json' and name not in self.entries:
+                    try: os.remove(os.path.join(self.path, name))
+                    except OSError: pass
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.index_path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': 1, 'entries': list(self.entries.values())}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.index_path)
+            except Exception as e:
+                logging.error(f"Error saving source cache index: {e}")
+
+    def lookup(self, video_key, format_id, need=None):
+        """Путь и запись исходника, покрывающего need=(start, end) (None - нужен целый файл), или None"""
+        if not self.enabled():
+            return None
+        with self.lock:
+            for name, entry in list(self.entries.items()):
+                if entry['video'] != video_key or entry['format_id'] != format_id:
+                    continue
+                if entry['range'] is not None and (need is None or not (entry['range'][0] <= need[0] and need[1] <= entry['range'][1])):
+                    continue
+                path = os.path.join(self.path, name)
+                try:
+                    intact = os.path.getsize(path) == entry['size'] and get_file_digest(path) == entry['digest']
+                except OSError:
+                    intact = False
+                if not intact:
+                    logging.warning(f"Source cache entry {name} is damaged, dropping it")
+                    self._drop(name)
+                    continue
+                self.entries.move_to_end(name)
+                entry['used'] = time.time()
+                self.hits += 1
+                self.save()
+                return path, entry
+            self.misses += 1
+            return None
+
+    def put(self, video_key, format_id, src, section=None, move=False, start=None):
+        """Кладёт скачанный файл в кэш (move=True - переносит, иначе только жёсткая ссылка:
+        если ФС не позволяет, файл не кэшируется, а не копируется молча).
+        start - время видео, с которого отсчитывается файл отрезка (по умолчанию section[0])"""
+        if not self.enabled() or not os.path.exists(src):
+            return False
+        size = os.path.getsize(src)
+        if size > self.max_bytes:
+            return False
+        # У Generic ключ - целый URL: имя файла укорачиваем и различаем по хэшу ключа
+        key_hash = hashlib.sha1(f"{video_key}|{format_id}".encode('utf-8')).hexdigest()[:12]
+        safe_id = re.sub(r'[^\w.-]', '_', f"{video_key}_{format_id}")[:80] + '_' + key_hash
+        part = 'full' if section is None else f"{int(section[0])}-{int(section[1])}"
+        name = f"{safe_id}_{part}{os.path.splitext(src)[1]}"
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            self._drop(name)
+            dst = os.path.join(self.path, name)
+            try:
+                if move:
+                    shutil.move(src, dst)
+                else:
+                    os.link(src, dst)
+                digest = get_file_digest(dst)
+            except Exception as e:
+                logging.warning(f"Could not cache source {src}: {e}")
+                try: os.remove(dst)
+                except OSError: pass
+                return False
+            self.entries[name] = {
+                'name': name, 'video': video_key, 'format_id': format_id,
+                'range': list(section) if section else None,
+                'start': start if start is not None else (section[0] if section else 0),
+                'size': size, 'digest': digest, 'used': time.time(),
+            }
+            self.evict()
+            self.save()
+            return True
+
+    def evict(self):
+        with self.lock:
+            while self.entries and self.total_size() > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, name):
+        if self.entries.pop(name, None) is not None:
+            try: os.remove(os.path.join(self.path, name))
+            except OSError: pass
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'size': self.total_size(),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0,
+            }
+
+# --- КОНВЕЙЕР ЗАДАЧ (без GUI) ---
+def get_base_path():
+    if getattr(sys, 'frozen', False): return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def find_tool(base_path, name):
+    """Путь к ffmpeg/ffprobe/deno: рядом с программой (name.exe или name), иначе из PATH"""
+    for candidate in (os.path.join(base_path, f'{name}.exe'), os.path.join(base_path, name)):
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which(name) or os.path.join(base_path, f'{name}.exe')
+
+# --- КЭШ ПРОВЕРОК ИНСТРУМЕНТОВ ---
+TOOL_PROBE_TIMEOUT = 15
+JS_RUNTIME_PROBE_TIMEOUT = 2
+JS_RUNTIMES = (('deno', 'deno'), ('nodejs', 'node'), ('quickjs', 'qjs'))  # имя для yt-dlp, команда в PATH
+TOOL_REFRESH_DELAY_MS = 300  # проверки инструментов стартуют, когда окно уже показано
+
+def get_binary_fingerprint(tool):
+    """[путь, mtime, размер] бинарника (имя без пути ищется в PATH) или None, если его нет"""
+    path = tool if os.path.dirname(tool) else shutil.which(tool)
+    try:
+        st = os.stat(path) if path else None
+    except OSError:
+        return None
+    return [os.path.abspath(path), st.st_mtime, st.st_size] if st else None
+
+def parse_tool_version(output, returncode):
+    """(работает, строка версии) по выводу `tool --version`"""
+    output = output.strip()
+    if "version" in output.lower():
+        for line in output.split('\n'):
+            if "version" in line.lower():
+                return True, line.strip()[:60]
+        return True, "Версия определена (см. лог)"
+    if returncode == 0:
+        return True, output.split('\n')[0] if output else "Версия неизвестна"
+    return False, f"Ошибка выполнения: {output[:100]}"
+
+class ToolProbeCache:
+    """Результаты `tool --version` (tool_probes.json), действительные, пока бинарник тот же.
+
+    Запись привязана к отпечатку (путь, mtime, размер): пока он совпадает, повторный запуск
+    программы не порождает процессов. Таймауты и ошибки запуска не кэшируются.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}  # команда или путь -> запись
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                # В записях версии 1 нет кода возврата: такие инструменты проверяются заново
+                if data.get('version', 1) >= 2:
+                    self.entries = data.get('entries', {})
+        except Exception as e:
+            logging.error(f"Error loading tool probe cache: {e}")
+            self.entries = {}
+
+    def save(self):
+        with self.lock:
+            data = {'version': 2, 'entries': dict(self.entries)}
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Error saving tool probe cache: {e}")
+
+    def get(self, tool, verify=True):
+        """Запись из кэша без запуска. verify=False - не сверять отпечаток (ни одного обращения к диску)"""
+        with self.lock:
+            entry = self.entries.get(tool)
+        if entry and verify and entry['fingerprint'] != get_binary_fingerprint(tool):
+            return None
+        return entry
+
+    def probe(self, tool, version_arg='--version', timeout=TOOL_PROBE_TIMEOUT, force=False):
+        """Запись для инструмента: из кэша, если бинарник не менялся (и не force), иначе запуском.
+        Не вызывать из потока окна"""
+        fingerprint = get_binary_fingerprint(tool)
+        if fingerprint is None:
+            return {'found': False, 'ok': False, 'version': "Не найден", 'cached': False}
+        with self.lock:
+            entry = self.entries.get(tool)
+        if entry and entry['fingerprint'] == fingerprint and not force:
+            return dict(entry, cached=True)
+        entry = {'fingerprint': fingerprint, 'found': True, 'checked': time.time()}
+        started = time.perf_counter()
+        try:
+            proc = subprocess.Popen([fingerprint[0], version_arg], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    text=True, encoding='utf-8', errors='replace', startupinfo=get_startupinfo())
+            # Popen возвращается, когда процесс запущен: это и есть задержка запуска (антивирус и т.п.)
+            entry['spawn_ms'] = (time.perf_counter() - started) * 1000
+            try:
+                out, err = proc.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                entry.update(ok=False, version="Таймаут (Антивирус блокирует?)", seconds=time.perf_counter() - started)
+                return dict(entry, cached=False)
+        except Exception as e:
+            entry.update(ok=False, version=f"Ошибка: {str(e)[:100]}", seconds=time.perf_counter() - started)
+            return dict(entry, cached=False)
+        entry['seconds'] = time.perf_counter() - started
+        entry['returncode'] = proc.returncode
+        entry['ok'], entry['version'] = parse_tool_version(out + err, proc.returncode)
+        with self.lock:
+            self.entries[tool] = entry
+        self.save()
+        return dict(entry, cached=False)
+
+def setup_logging(enabled):
+    for h in logging.root.handlers[:]: logging.root.removeHandler(h)
+    if enabled:
+        logging.basicConfig(filename='app_log.txt', level=logging.INFO, 
+                            format='%(asctime)s - %(message)s', encoding='utf-8')
+
+class PipelineReporter:
+    """Куда конвейер сообщает о задачах. Окно рисует карточки, консольный режим печатает JSON.
+
+    task_update получает только изменившиеся поля: stage ('info', 'downloading', 'merging',
+    'postqueue' (скачано, ждёт пула обработки), 'cutting', 'done', 'paused', 'error'), status/color (текст для карточки), progress (0..1),
+    downloaded_bytes/total_bytes/speed, format, title, file, error, cpu_seconds (CPU ffmpeg на задачу).
+    task_added - задачу добавил сам конвейер (запись развёрнутого плейлиста).
+    """
+
+    def task_added(self, task):
+        pass
+
+    def task_update(self, task, **state):
+        pass
+
+    def overall(self, text, color=None):
+        pass
+
+# --- ПУЛ YoutubeDL ---
+# Опции, которые меняются от задачи к задаче. Остальные задают "сессию" (прокси, cookies,
+# js_runtime, таймауты, постпроцессоры) и входят в ключ пула
+YDL_TASK_OPTS = ('outtmpl', 'format', 'progress_hooks', 'download_ranges', 'force_keyframes_at_cuts',
+                 'external_downloader_args', 'concurrent_fragment_downloads', 'retry_sleep_functions', 'buffersize', 'noresizebuffer')
+YDL_POOL_IDLE_PER_KEY = 4   # простаивающих экземпляров на один набор опций
+YDL_POOL_MAX_KEYS = 4       # наборов опций (после смены прокси/cookies старые закрываются)
+# Старше этой версии params['outtmpl'] может быть строкой: экземпляры не переиспользуем
+YDL_POOL_MIN_VERSION = (2023, 11, 16)
+# Недокументированные атрибуты экземпляра, без которых переиспользование невозможно:
+# format_selector yt-dlp строит в __init__ из params['format'] и потом его не перечитывает
+YDL_POOL_INSTANCE_ATTRS = ('format_selector',)
+
+def ydl_reuse_supported():
+    """Можно ли переиспользовать YoutubeDL: версия не старше проверенной и есть нужные публичные методы"""
+    try:
+        version = tuple(int(part) for part in yt_dlp.version.__version__.split('.')[:3])
+    except (AttributeError, ValueError):
+        return False
+    return (version >= YDL_POOL_MIN_VERSION
+            and all(hasattr(yt_dlp.YoutubeDL, name) for name in ('build_format_selector', 'add_progress_hook')))
+
+def has_keepalive_handler():
+    """keep-alive между запросами даёт только обработчик requests; без пакета requests yt-dlp ходит через urllib"""
+    try:
+        from yt_dlp.dependencies import requests as requests_dep
+    except ImportError:
+        return False
+    return requests_dep is not None
+
+class YdlPool:
+    """Долгоживущие экземпляры YoutubeDL, общие для задач с одинаковыми опциями сессии.
+
+    Новый экземпляр на каждую задачу заново строит opener, теряет keep-alive соединения
+    (TLS-рукопожатие к тем же CDN), заново читает cookies браузера и создаёт экстракторы.
+    Экземпляр выдаётся одной задаче за раз (acquire). Задачные опции переустанавливаются
+    через params и публичные методы, кроме format_selector - это внутренний атрибут
+    (YDL_POOL_INSTANCE_ATTRS), его наличие проверяется. Если версия yt-dlp не проверена,
+    атрибута нет или настройка не удалась, пул выдаёт новый экземпляр на каждую задачу.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = collections.OrderedDict()  # ключ опций -> простаивающие экземпляры, порядок = LRU
+        self.task_hooks = {}  # экземпляр -> хуки прогресса текущей задачи
+        self.reuse = ydl_reuse_supported()
+        self.keepalive = has_keepalive_handler()
+        self.created = 0
+        self.reused = 0
+        self.closed = 0
+        if not self.reuse:
+            logging.warning(f"yt-dlp {yt_dlp.version.__version__}: YoutubeDL instances will not be reused")
+        elif not self.keepalive:
+            logging.info("requests is not installed: pooled YoutubeDL instances will not keep connections alive")
+
+    @staticmethod
+    def session_key(opts):
+        return json.dumps({k: v for k, v in opts.items() if k not in YDL_TASK_OPTS}, sort_keys=True, default=repr)
+
+    @contextlib.contextmanager
+    def acquire(self, opts):
+        if not self.reuse:
+            with self.lock:
+                self.created += 1
+            try:
+                with yt_dlp.YoutubeDL(dict(opts)) as ydl:
+                    yield ydl
+            finally:
+                with self.lock:
+                    self.closed += 1
+            return
+        key = self.session_key(opts)
+        ydl = None
+        with self.lock:
+            free = self.idle.get(key)
+            if free:
+                ydl = free.pop()
+                self.idle.move_to_end(key)
+                self.reused += 1
+            else:
+                self.created += 1
+        try:
+            if ydl is None:
+                ydl = self._create(opts)
+            self._configure(ydl, opts)
+        except Exception as e:
+            # Новая версия yt-dlp устроена иначе: дальше без переиспользования
+            logging.warning(f"Could not reconfigure pooled YoutubeDL, disabling reuse: {e}")
+            self.reuse = False
+            if ydl is not None:
+                self._close(ydl)
+            with self.acquire(opts) as fresh:
+                yield fresh
+            return
+        try:
+            yield ydl
+        finally:
+            self._release(key, ydl)
+
+    def _create(self, opts):
+        """Экземпляр с опциями сессии и одним хуком прогресса, который зовёт хуки текущей задачи"""
+        ydl = yt_dlp.YoutubeDL({k: v for k, v in opts.items() if k != 'progress_hooks'})
+        hooks = []
+        ydl.add_progress_hook(lambda d: [hook(d) for hook in list(hooks)])
+        with self.lock:
+            self.task_hooks[ydl] = hooks
+        return ydl
+
+    def _configure(self, ydl, opts):
+        """Переносит задачные опции в экземпляр: params, outtmpl['default'] и format_selector"""
+        missing = [name for name in YDL_POOL_INSTANCE_ATTRS if not hasattr(ydl, name)]
+        if missing or not isinstance(ydl.params.get('outtmpl'), dict):
+            raise AttributeError(f"YoutubeDL internals changed: {', '.join(missing) or 'outtmpl'}")
+        for k in YDL_TASK_OPTS:
+            if k in ('outtmpl', 'format', 'progress_hooks'):
+                continue
+            ydl.params.pop(k, None)
+            if k in opts:
+                ydl.params[k] = opts[k]
+        outtmpl = opts.get('outtmpl')
+        if outtmpl is not None:
+            ydl.params['outtmpl'] = dict(ydl.params['outtmpl'], **(outtmpl if isinstance(outtmpl, dict) else {'default': outtmpl}))
+        fmt = opts.get('format')
+        ydl.params['format'] = fmt
+        ydl.format_selector = ydl.build_format_selector(fmt) if fmt and not callable(fmt) else fmt
+        self.task_hooks[ydl][:] = opts.get('progress_hooks', [])
+
+    def _release(self, key, ydl):
+        # Хуки держат замыкания задачи: не даём им жить в простаивающем экземпляре
+        self.task_hooks[ydl].clear()
+        to_close = []
+        with self.lock:
+            free = self.idle.setdefault(key, [])
+            self.idle.move_to_end(key)
+            if len(free) < YDL_POOL_IDLE_PER_KEY:
+                free.append(ydl)
+            else:
+                to_close.append(ydl)
+            while len(self.idle) > YDL_POOL_MAX_KEYS:
+                _, old = self.idle.popitem(last=False)
+                to_close.extend(old)
+        for old in to_close:
+            self._close(old)
+
+    def _close(self, ydl):
+        try:
+            ydl.close()
+        except Exception as e:
+            logging.warning(f"Error closing YoutubeDL: {e}")
+        with self.lock:
+            self.task_hooks.pop(ydl, None)
+            self.closed += 1
+
+    def close_all(self):
+        with self.lock:
+            instances = [ydl for free in self.idle.values() for ydl in free]
+            self.idle.clear()
+        for ydl in instances:
+            self._close(ydl)
+
+    def stats(self):
+        with self.lock:
+            total = self.created + self.reused
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'closed': self.closed,
+                'idle': sum(len(free) for free in self.idle.values()),
+                'reuse_rate': (self.reused / total) if total else 0.0,
+                'reuse': self.reuse,
+                'keepalive': self.reuse and self.keepalive,
+            }
+
+PROBE_WORKERS = 4
+MULTI_URL_RE = re.compile(r'https?://\S+')
+PROBE_IDLE_EXIT = 30  # простаивающий поток пула завершается через столько секунд
+
+class ProbePool:
+    """Ограниченный пул фоновых probe (названия для карточек): не больше workers потоков на всю очередь.
+
+    Одинаковые URL, уже ждущие или извлекаемые, извлекаются один раз, результат получают все.
+    Отменённая задача убирается из очереди пула, а результат уже идущего извлечения для неё
+    выбрасывается. probe(task, should_abort) проверяет should_abort() между своими запросами:
+    когда отменены все задачи URL, извлечение прерывается и слот освобождается (сам идущий запрос
+    yt-dlp не прерывается). on_done(task, title, error) вызывается из потока пула.
+    """
+
+    def __init__(self, probe, on_done, workers=PROBE_WORKERS):
+        self.probe = probe
+        self.on_done = on_done
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.jobs = collections.OrderedDict()  # url -> задачи, ждущие probe (в порядке поступления)
+        self.running = {}                      # url -> задачи, чей probe идёт сейчас
+        self.threads = 0
+
+    def submit(self, task):
+        with self.cond:
+            url = task['url']
+            if url in self.running:
+                self.running[url].append(task)
+                return
+            self.jobs.setdefault(url, []).append(task)
+            if self.threads < self.workers:
+                self.threads += 1
+                threading.Thread(target=self._worker, daemon=True).start()
+            self.cond.notify()
+
+    def claim(self, task):
+        """Забирает ещё не начатый probe задачи (её берёт worker и извлечёт info сам). True, если забрал"""
+        with self.cond:
+            if not self._remove_queued(task):
+                return False
+        task['info_event'].set()
+        return True
+
+    def cancel(self, task):
+        with self.cond:
+            task['probe_cancelled'] = True
+            self._remove_queued(task)
+        task['info_event'].set()
+
+    def cancel_all(self):
+        with self.cond:
+            tasks = [t for waiting in list(self.jobs.values()) + list(self.running.values()) for t in waiting]
+            self.jobs.clear()
+            for t in tasks:
+                t['probe_cancelled'] = True
+        for t in tasks:
+            t['info_event'].set()
+
+    def _cancelled(self, url):
+        """Все задачи идущего probe отменены (к нему могли присоединиться новые)"""
+        with self.cond:
+            return all(t.get('probe_cancelled') for t in self.running.get(url, ()))
+
+    def _remove_queued(self, task):
+        waiting = self.jobs.get(task['url'])
+        if not waiting or not any(t is task for t in waiting):
+            return False
+        waiting[:] = [t for t in waiting if t is not task]
+        if not waiting:
+            del self.jobs[task['url']]
+        return True
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                if not self.jobs:
+                    self.cond.wait(PROBE_IDLE_EXIT)
+                if not self.jobs:
+                    self.threads -= 1
+                    return
+                url, tasks = self.jobs.popitem(last=False)
+                self.running[url] = tasks
+            leader = tasks[0]
+            title = error = None
+            try:
+                title = self.probe(leader, lambda: self._cancelled(url))
+            except Exception as e:
+                error = e
+            with self.cond:
+                tasks = self.running.pop(url)
+            for t in tasks:
+                # Лёгкий probe даёт только название, info у лидера может не быть
+                if t is not leader and error is None and 'info' in leader:
+                    t['info'] = leader['info']
+                if not t.get('probe_cancelled'):
+                    try:
+                        self.on_done(t, title, error)
+                    except Exception as e:
+                        logging.error(f"Probe callback failed: {e}")
+                t['info_event'].set()
+
+# --- СТАДИИ КОНВЕЙЕРА ---
+# Скачивание ограничивает DownloadScheduler (max_parallel, max_per_host). Извлечение info
+# и обработка ffmpeg идут в своих пулах: обрезка одной задачи не держит слот скачивания
+EXTRACT_WORKERS = 2
+EXTRACT_LOOKAHEAD = 3  # сколько ожидающих задач сверх слотов скачивания извлекать заранее
+POSTPROCESS_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+def get_ffmpeg_threads(workers):
+    """Потоков ffmpeg на одно задание обработки: в сумме на все workers не больше числа ядер"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+class StagePool:
+    """Пул одной стадии конвейера: задания по очереди, не больше workers одновременно.
+
+    Потоки daemon и создаются по мере надобности (как у ProbePool), простаивающие завершаются.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.jobs = collections.deque()
+        self.threads = 0
+        self.active = 0
+        self.closed = False
+
+    def submit(self, fn, *args):
+        with self.cond:
+            self.closed = False
+            self.jobs.append((fn, args))
+            if self.threads < self.workers:
+                self.threads += 1
+                threading.Thread(target=self._worker, daemon=True).start()
+            self.cond.notify()
+
+    def active_count(self):
+        with self.cond:
+            return self.active
+
+    def pending(self):
+        """Заданий в очереди и выполняется"""
+        with self.cond:
+            return len(self.jobs) + self.active
+
+    def is_idle(self):
+        return self.pending() == 0
+
+    def wait_idle(self):
+        with self.cond:
+            while self.jobs or self.active:
+                self.cond.wait(0.5)
+
+    def shutdown(self):
+        """Выбрасывает ждущие задания и отпускает простаивающие потоки (идущие задания доделываются)"""
+        with self.cond:
+            self.jobs.clear()
+            self.closed = True
+            self.cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                if not self.jobs and not self.closed:
+                    self.cond.wait(PROBE_IDLE_EXIT)
+                if not self.jobs:
+                    self.threads -= 1
+                    return
+                fn, args = self.jobs.popleft()
+                self.active += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"{self.name} pool: job crashed: {e}")
+            finally:
+                with self.cond:
+                    self.active -= 1
+                    self.cond.notify_all()
+
+class DownloadPipeline:
+    """Очередь задач и их выполнение: извлечение info, скачивание, обрезка, переименование.
+
+    Не зависит от Tk: используется и окном (ModernYouTubeCutter), и консольным режимом (--cli).
+    settings - общий dict настроек из settings.json, окно обновляет его при изменениях.
+    """
+
+    def __init__(self, base_path, settings, reporter, t=None, journal=None):
+        self.base_path = base_path
+        self.settings = settings
+        self.reporter = reporter
+        self.t = t or (lambda key: key)
+        self.ffmpeg_exe = find_tool(base_path, 'ffmpeg')
+        self.ffprobe_exe = find_tool(base_path, 'ffprobe')
+        self.ffmpeg_dir = os.path.dirname(self.ffmpeg_exe) or base_path
+        self.queue = []
+        self.queue_lock = threading.Lock()
+        self.expanding = 0  # сколько плейлистов сейчас разворачивается
+        self.abort_flag = False
+        self.scheduler = DownloadScheduler(int(settings.get('max_parallel', 3)), int(settings.get('max_per_host', 2)))
+        self.fragments = FragmentConcurrency(int(settings.get('connection_budget', 16)))
+        self.bandwidth = BandwidthLimiter(int(settings.get('bandwidth_limit_kb', 0)) * 1024)
+        # key задачи -> (ключ батча в bandwidth, батч). Не id: после clear() id начинаются с 0,
+        # а батч из прошлой очереди может ещё качаться
+        self.active_downloads = {}
+        self.filename_lock = threading.Lock()
+        self.run_stats = {'total': 0, 'started': 0, 'finished': 0}
+        self.is_running = False
+        self.metadata_cache = MetadataCache(os.path.join(base_path, 'metadata_cache.json'))
+        self.journal = journal  # QueueJournal или None (консольный режим очередь не сохраняет)
+        self.archive = DownloadArchive(os.path.join(base_path, 'download_archive.jsonl'))
+        self.probe_pool = ProbePool(self.probe_info, self.on_probe_done)
+        self.probe_stats = {'light': 0, 'full': 0}
+        self.ydl_pool = YdlPool()
+        self.extract_pool = StagePool('extract', EXTRACT_WORKERS)
+        self.post_pool = StagePool('postprocess', POSTPROCESS_WORKERS)
+        self.ffmpeg_threads = get_ffmpeg_threads(POSTPROCESS_WORKERS)
+        self.source_cache = SourceMediaCache(os.path.join(base_path, 'source_cache'),
+                                             int(settings.get('source_cache_mb', 2048)) * 1024 * 1024)
+
+    def add_task(self, url, s, e, fmt, is_audio, q_lbl, do_convert, bitrate='auto', video_settings='auto', probe=False,
+                 key=None, title=None, parent=None, sync=True, video_key=None, priority='normal', announce=False):
+        """Добавляет задачу в очередь. probe=True - вызывающий сейчас запустит probe_info, worker его дождётся.
+        key - постоянный id задачи из журнала (по нему названы временные файлы).
+        title/parent - название и key плейлиста для задач из развёрнутого плейлиста.
+        video_key - 'Extractor:id', если уже известен (записи плейлиста), иначе вычисляется по URL.
+        announce=True - задачу добавляет сам конвейер: reporter.task_added вызывается сразу при выдаче id"""
+        task = {
+            'key': key or uuid.uuid4().hex[:12],
+            'url': url, 's': s, 'e': e, 'fmt': fmt, 'is_audio': is_audio,
+            'q_key': get_q_key(fmt, is_audio), 
+            'conv': do_convert, 'bitrate': bitrate, 'video_settings': video_settings,
+            'q_lbl': q_lbl, 'done': False, 'error': None, 'abort': False,
+            'title': title, 'parent': parent, 'priority': priority,
+            'info': None, 'info_event': threading.Event(), 'info_lock': threading.Lock()
+        }
+        if not probe:
+            task['info_event'].set()
+        # Задачи добавляют и окно, и поток разворачивания плейлиста: id = индекс в очереди
+        with self.queue_lock:
+            task['id'] = len(self.queue)
+            if self.journal and not key:
+                self.journal.append('add', task['key'], sync=sync, task={k: task[k] for k in JOURNAL_TASK_FIELDS})
+            self.queue.append(task)
+            if self.is_running:
+                self.run_stats['total'] += 1
+            if announce:
+                # Под queue_lock: карточки создаются в порядке id и раньше любых task_update задачи
+                self.reporter.task_added(task)
+        if not key:
+            video_key = video_key or get_canonical_video_key(url)
+            if video_key:
+                self.skip_if_archived(task, video_key)
+        return task
+
+    def skip_if_archived(self, task, video_key):
+        """Если это видео с тем же качеством и отрезком уже скачано, задача сразу выполнена
+        и ссылается на существующий файл. Возвращает True, если задача пропущена"""
+        if not self.settings.get('skip_downloaded', True):
+            return False
+        entry = self.archive.lookup(get_archive_key(video_key, task))
+        if not entry:
+            return False
+        task['done'] = True
+        task['archived'] = True
+        task['output_file'] = entry['file']
+        task['title'] = task.get('title') or entry.get('title')
+        task['info'] = None
+        task['info_event'].set()
+        self.mark_stage([task], 'cut' if task['s'] is not None else 'renamed', file=entry['file'], archived=True)
+        if self.is_running:
+            self.run_stats['finished'] += 1
+        self.reporter.task_update(task, stage='done', status=f"✔ Уже скачано: {os.path.basename(entry['file'])}",
+                                  color="green", progress=1, file=entry['file'], title=task['title'])
+        logging.info(f"tid {task['id']}: already downloaded -> {entry['file']}")
+        return True
+
+    def clear(self):
+        """Останавливает и убирает все задачи"""
+        self.probe_pool.cancel_all()
+        for task in self.queue:
+            task['abort'] = True
+            task['removed'] = True
+        self.queue = []
+        if self.journal:
+            self.journal.append('clear')
+
+    def restore_queue(self, download_path, probe=False):
+        """Поднимает из журнала незавершённые задачи и убирает осиротевшие временные файлы.
+        Возвращает восстановленные задачи"""
+        if not self.journal:
+            return []
+        records = self.journal.load()
+        pending = [rec for rec in records.values() if rec.get('stage') not in JOURNAL_DONE_STAGES]
+        restored = []
+        for rec in pending:
+            t = rec['task']
+            task = self.add_task(t['url'], t['s'], t['e'], t['fmt'], t['is_audio'], t['q_lbl'], t['conv'],
+                                 t.get('bitrate', 'auto'), t.get('video_settings', 'auto'),
+                                 probe=probe and not t.get('title'), key=rec['key'],
+                                 title=t.get('title'), parent=t.get('parent'),
+                                 priority=rec.get('priority') or t.get('priority', 'normal'))
+            task['journal_stage'] = rec.get('stage')
+            restored.append(task)
+        self.journal.compact(pending)
+        # Временные файлы живых задач остаются: yt-dlp докачает .part с места остановки
+        dirs = {download_path} | {rec['save_path'] for rec in records.values() if rec.get('save_path')}
+        reconcile_temp_files(dirs, {task['key'] for task in restored})
+        if restored:
+            logging.info(f"Restored {len(restored)} tasks from queue journal")
+        return restored
+
+    def mark_stage(self, tasks, stage, **fields):
+        """Записывает в журнал стадию задач (extracted, downloading, downloaded, cut, renamed)"""
+        if not self.journal:
+            return
+        for t in tasks:
+            t['journal_stage'] = stage
+            self.journal.append('stage', t['key'], stage=stage, **fields)
+
+    def shutdown(self):
+        """При выходе: останавливает фоновые пулы, закрывает простаивающие YoutubeDL, сохраняет кэш метаданных"""
+        self.probe_pool.cancel_all()
+        self.extract_pool.shutdown()
+        self.post_pool.shutdown()
+        self.ydl_pool.close_all()
+        self.metadata_cache.save()
+
+    def set_priority(self, task, priority):
+        """Меняет приоритет задачи: порядок запуска и доля полосы (в том числе у уже идущей)"""
+        task['priority'] = priority
+        # Батч скачивается одним потоком и зарегистрирован в ограничителе под key первой задачи
+        with self.queue_lock:
+            active = self.active_downloads.get(task['key'])
+        if active:
+            self.bandwidth.set_weight(active[0], get_task_weight(active[1]))
+        if self.journal:
+            self.journal.append('set', task['key'], priority=priority)
+
+    def register_download(self, bw_key, batch):
+        """Скачивание батча началось: доля полосы по самому срочному приоритету в батче.
+        bw_key - постоянный key задачи (не id, который после clear() достаётся новым задачам)"""
+        with self.queue_lock:
+            for t in batch:
+                self.active_downloads[t['key']] = (bw_key, batch)
+        self.bandwidth.register(bw_key, get_task_weight(batch))
+
+    def unregister_download(self, bw_key, batch):
+        self.bandwidth.unregister(bw_key)
+        with self.queue_lock:
+            for t in batch:
+                if self.active_downloads.get(t['key'], (None,))[0] == bw_key:
+                    del self.active_downloads[t['key']]
+
+    def request_probe(self, task):
+        """Название для карточки в фоне (пул probe_pool). Задача должна быть добавлена с probe=True"""
+        self.probe_pool.submit(task)
+
+    def on_probe_done(self, task, title, error):
+        if error is not None:
+            logging.warning(f"Probe failed for tid {task['id']}: {error}")
+            self.reporter.task_update(task, title=f"❌ Ошибка: {str(error)[:50]}")
+        elif title:
+            self.reporter.task_update(task, title=title)
+
+    def probe_info(self, task, should_abort=None):
+        """Извлекает (или берёт из кэша) info задачи для карточки. Возвращает название.
+        should_abort() - probe больше не нужен (ProbePool): прерываемся между запросами"""
+        # Недавно виденное видео: название сразу из кэша
+        meta, cached_info = self.metadata_cache.lookup(task['url'])
+        if meta:
+            # Если ссылки на потоки истекли, info извлечётся прямо перед скачиванием
+            task['info'] = cached_info
+            # Форматы из кэша (и из прошлого запуска): качество видно в карточке сразу
+            formats = self.metadata_cache.get_formats(task['url'])
+            chosen = formats and resolve_format_ladder({'formats': formats}, get_format_ladder(task.get('q_key'), task.get('fmt')))
+            if chosen:
+                self.reporter.task_update(task, format=describe_format(chosen[1], meta.get('duration')))
+            return meta.get('title', 'Unknown')
+        # Лёгкий probe: только название, info извлечётся перед скачиванием (get_task_info)
+        meta = fetch_light_meta(task['url'], self.settings.get('disable_proxy'))
+        if meta:
+            self.probe_stats['light'] += 1
+            self.metadata_cache.put_meta(task['url'], meta)
+            return meta['title']
+        # Остальные сайты и плейлисты: полный info, при скачивании он переиспользуется
+        if should_abort and should_abort():
+            raise Exception("ABORTED_BY_USER")
+        self.probe_stats['full'] += 1
+        info = self.extract_url(task, self.settings.get('cookies_browser'), should_abort)
+        if info is None:
+            return task.get('title') or 'Playlist'
+        task['info'] = info
+        return info.get('title', 'Unknown')
+
+    def extract_url(self, task, cookie_browser, should_abort=None):
+        """Извлекает info по ссылке задачи (сразу в кэш метаданных).
+
+        Плейлист или канал целиком не извлекается: его записи добавляются в очередь
+        отдельными задачами (expand_playlist), а возвращается None.
+        """
+        def check_abort():
+            if should_abort and should_abort():
+                raise Exception("ABORTED_BY_USER")
+
+        opts = dict(self.get_extract_opts(cookie_browser), extract_flat='in_playlist')
+        with self.ydl_pool.acquire(opts) as ydl:
+            # process=False: для плейлиста получаем ленивые записи, а не полный info каждого видео
+            result = ydl.extract_info(task['url'], download=False, process=False)
+            for _ in range(PLAYLIST_MAX_DEPTH):
+                if result.get('_type') != 'url':
+                    break
+                check_abort()
+                result = ydl.extract_info(result['url'], ie_key=result.get('ie_key'), download=False, process=False)
+            check_abort()
+            if result.get('_type') == 'playlist':
+                self.expand_playlist(task, ydl, result)
+                return None
+            info = ydl.process_ie_result(result, download=False)
+        self.metadata_cache.put(task['url'], info)
+        return info
+
+    def expand_playlist(self, parent, ydl, playlist):
+        """Добавляет записи плейлиста/канала в очередь по мере загрузки страниц.
+
+        Записи плоские (ссылка и название), полный info каждой извлекается только когда
+        её возьмёт планировщик (get_task_info). Сама задача-плейлист помечается выполненной.
+        """
+        parent['done'] = True
+        parent['title'] = playlist.get('title') or parent.get('title')
+        parent['info_event'].set()  # worker не ждёт, пока развернётся весь плейлист
+        self.reporter.task_update(parent, stage='info', title=parent['title'],
+                                  status="📃 Разворачивание плейлиста...", color="cyan")
+        with self.queue_lock:
+            self.expanding += 1
+            known = {t['url'] for t in self.queue if t.get('parent') == parent['key']}
+        try:
+            count = self._add_playlist_entries(parent, ydl, playlist, known, 0)
+        except Exception:
+            # Уже добавленные записи остаются, при повторе они не задублируются (known)
+            parent['done'] = False
+            raise
+        finally:
+            with self.queue_lock:
+                self.expanding -= 1
+        self.mark_stage([parent], 'expanded', entries=count)
+        if self.is_running:
+            self.run_stats['finished'] += 1
+        self.reporter.task_update(parent, stage='done', status=f"📃 Плейлист: {len(known)} видео в очереди",
+                                  color="green", progress=1)
+        logging.info(f"Playlist tid {parent['id']} expanded into {count} new tasks")
+        return count
+
+    def _add_playlist_entries(self, parent, ydl, playlist, known, depth):
+        count = 0
+        for entry in iter_playlist_entries(ydl, playlist):
+            if parent.get('removed'):
+                break
+            if not entry:
+                continue
+            if entry.get('_type') == 'playlist' and depth < PLAYLIST_MAX_DEPTH:
+                count += self._add_playlist_entries(parent, ydl, entry, known, depth + 1)
+                continue
+            url = entry.get('url') or entry.get('webpage_url')
+            if not url or url in known:
+                continue
+            if depth < PLAYLIST_MAX_DEPTH and is_nested_playlist(entry, playlist):
+                # Вкладки канала (Videos, Shorts...) - тоже плейлисты
+                sub = ydl.extract_info(url, ie_key=entry.get('ie_key'), download=False, process=False)
+                if sub.get('_type') == 'playlist':
+                    count += self._add_playlist_entries(parent, ydl, sub, known, depth + 1)
+                    continue
+            known.add(url)
+            child = self.add_task(url, parent['s'], parent['e'], parent['fmt'], parent['is_audio'], parent['q_lbl'],
+                                  parent['conv'], parent['bitrate'], parent['video_settings'],
+                                  title=entry.get('title'), parent=parent['key'], sync=False, announce=True,
+                                  video_key=f"{entry['ie_key']}:{entry['id']}" if entry.get('ie_key') and entry.get('id') else None)
+            count += 1
+        return count
+
+    def run(self, save_path):
+        """Выполняет все невыполненные задачи очереди. Блокирует до конца или до остановки"""
+        self.is_running = True
+        self.abort_flag = False
+        # Отменённые по одной задачи снова попадают в очередь при повторном старте
+        for task in self.queue:
+            task['abort'] = False
+            task.pop('info_requested', None)
+        self.run_stats = {
+            'total': len([t for t in self.queue if not t['done']]),
+            'started': 0,
+            'finished': 0,
+        }
+        run_ctx = {
+            'save_path': save_path,
+            'cookie_browser': self.settings.get('cookies_browser', 'Disabled'),
+        }
+        self.scheduler.max_parallel = int(self.settings.get('max_parallel', 3))
+        self.scheduler.max_per_host = int(self.settings.get('max_per_host', 2))
+        self.fragments.budget = int(self.settings.get('connection_budget', 16))
+        self.bandwidth.rate = int(self.settings.get('bandwidth_limit_kb', 0)) * 1024
+        try:
+            self.scheduler.run(
+                lambda: self.pending_tasks(run_ctx['cookie_browser']),
+                lambda batch: self.process_task(batch, run_ctx),
+                lambda: self.abort_flag,
+                group_key=get_batch_key,
+                # Пока плейлист разворачивается или задачи ещё режутся, опустевшая очередь - не конец прогона
+                keep_waiting=lambda: self.expanding > 0 or not self.post_pool.is_idle(),
+                # Отрезками качаются только близкие фрагменты; без них видео качается целиком - один раз на все
+                group_select=select_batch if self.settings.get('section_download', True) else None,
+            )
+            # При остановке планировщик выходит сразу: дожидаемся идущей обработки
+            self.post_pool.wait_idle()
+        finally:
+            self.is_running = False
+
+    def get_unique_filename(self, base_path, base_name, extension):
+        """Генерирует уникальное имя файла, добавляя суффикс если файл уже существует"""
+        full_path = os.path.join(base_path, f"{base_name}{extension}")
+        
+        if not os.path.exists(full_path):
+            return full_path
+        
+        # Если файл существует, добавляем суффикс _1, _2, и т.д.
+        counter = 1
+        while True:
+            new_name = f"{base_name}_{counter}{extension}"
+            new_path = os.path.join(base_path, new_name)
+            if not os.path.exists(new_path):
+                return new_path
+            counter += 1
+            if counter > 1000:  # Защита от бесконечного цикла
+                # Если достигли 1000, добавляем timestamp
+                timestamp = int(time.time())
+                new_name = f"{base_name}_{timestamp}{extension}"
+                return os.path.join(base_path, new_name)
+
+    def reserve_unique_filename(self, base_path, base_name, extension):
+        """Как get_unique_filename, но сразу занимает имя пустым файлом (для параллельных задач)"""
+        with self.filename_lock:
+            path = self.get_unique_filename(base_path, base_name, extension)
+            open(path, 'a').close()
+            return path
+    
+    def get_safe_title(self, info, tid):
+        """Название видео без символов, недопустимых в имени файла"""
+        return "".join([c for c in info.get('title', f'video_{tid}') if c.isalpha() or c.isdigit() or c in ' .-_']).strip()
+    
+    def get_quality_suffix(self, q_lbl, is_audio):
+        """Извлекает суффикс качества из метки для добавления в имя файла"""
+        if is_audio:
+            return "_audio"
+        
+        if not q_lbl:
+            return ""
+        
+        # Извлекаем разрешение из метки качества (проверяем сначала более специфичные случаи)
+        q_lbl_lower = q_lbl.lower()
+        
+        # Проверяем на 1080p (более специфично, чем просто "hd")
+        if '1080' in q_lbl_lower or 'full hd' in q_lbl_lower or 'fullhd' in q_lbl_lower:
+            return "_1080p"
+        # Проверяем на 720p
+        elif '720' in q_lbl_lower:
+            return "_720p"
+        # Проверяем на "best" или "auto" (лучшее качество)
+        elif 'best' in q_lbl_lower or 'auto' in q_lbl_lower or 'лучшее' in q_lbl_lower or 'лучшее' in q_lbl_lower:
+            return "_best"
+        # Общий случай HD (если не 1080 и не 720)
+        elif 'hd' in q_lbl_lower:
+            return "_hd"
+        else:
+            return ""
+
+    def get_extract_opts(self, cookie_browser=None):
+        """Опции извлечения info. Общие для probe_info и скачивания, чтобы info можно было переиспользовать"""
+        opts = {
+            'quiet': True, 'no_warnings': True,
+            'remote_components': ['ejs:github'],
+            'socket_timeout': 30,
+        }
+        if self.settings.get('disable_proxy'):
+            opts['noproxy'] = '*'
+            opts['proxy'] = ''
+        if self.settings.get('js_runtime', 'auto') != 'auto':
+            opts['js_runtimes'] = [self.settings['js_runtime']]
+        if cookie_browser and cookie_browser != "Disabled":
+            opts['cookiesfrombrowser'] = (cookie_browser.lower(), )
+        return opts
+
+    def get_task_info(self, task, cookie_browser, force_refresh=False):
+        """Возвращает info задачи. Повторно извлекает только если info нет или ссылки на потоки истекают.
+
+        Вызывается и из пула извлечения (prefetch_info), и из слота скачивания: info_lock
+        не даёт извлечь одну задачу дважды. None - задача оказалась плейлистом и развёрнута.
+        """
+        if not force_refresh:
+            # Probe из очереди пула ещё не начат - забираем его себе, а идущий ждём,
+            # чтобы не извлекать параллельно второй раз
+            if not self.probe_pool.claim(task):
+                task['info_event'].wait(timeout=60)
+        with task['info_lock']:
+            if task['done']:
+                return None  # плейлист уже развёрнут, пока ждали
+            info = task.get('info')
+            if not force_refresh and (not info or time.time() > get_info_expiry(info) - INFO_REFRESH_MARGIN):
+                # Тот же URL мог быть недавно извлечён другой задачей или в прошлом запуске
+                info = self.metadata_cache.lookup(task['url'], need_info=True)[1] or info
+            if force_refresh or not info or time.time() > get_info_expiry(info) - INFO_REFRESH_MARGIN:
+                logging.info(f"Extracting info for tid {task['id']} (refresh={force_refresh or bool(info)})")
+                info = self.extract_url(task, cookie_browser)
+            task['info'] = info
+            return info
+
+    def prefetch_info(self, task, cookie_browser):
+        """Задание пула извлечения: info задачи готов к тому моменту, как ей достанется слот скачивания.
+        Ошибку только пишем в лог: задача извлечёт info сама и покажет ошибку как обычно"""
+        if self.abort_flag or task['done'] or task.get('abort') or task.get('removed'):
+            return
+        try:
+            self.get_task_info(task, cookie_browser)
+        except Exception as e:
+            logging.info(f"Prefetch failed for tid {task['id']}: {e}")
+
+    def pending_tasks(self, cookie_browser):
+        """Невыполненные задачи: срочные первыми (sorted устойчив, внутри приоритета - порядок очереди).
+
+        Для первых из них (слоты скачивания + EXTRACT_LOOKAHEAD) info заранее извлекается
+        в пуле извлечения, пока слоты заняты скачиванием.
+        """
+        pending = sorted((t for t in self.queue if not t['done'] and not t.get('abort')),
+                         key=lambda t: -TASK_PRIORITIES.get(t.get('priority'), TASK_PRIORITIES['normal']))
+        for task in pending[:max(1, self.scheduler.max_parallel) + EXTRACT_LOOKAHEAD]:
+            if not task.get('info_requested') and not task.get('info'):
+                task['info_requested'] = True
+                self.extract_pool.submit(self.prefetch_info, task, cookie_browser)
+        return pending
+
+    def is_idle(self):
+        """Нет ни скачиваний, ни заданий обработки"""
+        return self.scheduler.is_idle() and self.post_pool.is_idle()
+
+    def report_overall(self, text=None, color="#4CAF50"):
+        """Сообщает сводку по всем параллельным задачам (строка статуса окна)"""
+        stats = self.run_stats
+        summary = f"[{stats['finished']}/{stats['total']}]"
+        active = self.scheduler.active_count()
+        if active:
+            summary += f" ⬇ {active} | {self.bandwidth.current_rate() / 1024 / 1024:.1f} MB/s"
+            if self.bandwidth.rate:
+                summary += f" (лимит {self.bandwidth.rate / 1024 / 1024:.1f})"
+        cutting = self.post_pool.active_count()
+        if cutting:
+            summary += f" | ✂ {cutting}"
+        self.reporter.overall(f"📥 {summary} {text}" if text else f"📥 {summary}", color)
+
+    def process_task(self, batch, run_ctx):
+        """Выполняет задачу очереди (скачивание + обрезка/переименование) в своём потоке.
+
+        batch - список задач от планировщика: одна задача или несколько фрагментов одного
+        источника (get_batch_key). Источник скачивается один раз, все фрагменты режутся из него.
+        """
+        save_path = run_ctx['save_path']
+        cookie_browser = run_ctx['cookie_browser']
+        batch = [t for t in batch if not t.get('removed')]
+        if not batch: return
+        task = batch[0]  # по ней качаем: у всех задач батча одинаковые URL и качество
+        tid = task['id']
+        bw_key = task['key']  # ключ в ограничителе полосы
+        self.run_stats['started'] += len(batch)
+        for t in batch:
+            t['info_requested'] = True  # info извлекает сама задача, пулу извлечения не нужно
+
+        def is_aborted():
+            return self.abort_flag or all(t.get('abort') for t in batch)
+
+        def report(**state):
+            for t in batch:
+                if not t.get('abort'):
+                    self.reporter.task_update(t, **state)
+
+        def set_status(text, color, stage=None):
+            report(status=text, color=color, **({'stage': stage} if stage else {}))
+
+        def set_progress(value):
+            report(progress=value)
+
+        set_status("⏳ Получение информации...", "yellow", 'info')
+        
+        # Для фрагментов сразу ставим другой статус
+        if task['s'] is not None and self.settings.get('section_download', True):
+            status_msg = "⬇ Скачивание отрезка..."
+        elif task['s'] is not None:
+            status_msg = self.t('status_work') # "Скачивание полного видео..."
+        else:
+            status_msg = "⬇ Скачивание..."
+        self.report_overall(status_msg, "#FF9800")
+
+        opts = {
+            'ffmpeg_location': self.ffmpeg_dir,
+            'quiet': True, 'no_warnings': True, 'noprogress': True,
+            'restrictfilenames': True,
+            # Временное имя постоянно для задачи (key из журнала), поэтому после перезапуска
+            # yt-dlp продолжает скачивание с .part, а готовый файл не качает заново
+            'continuedl': True,
+            'retries': 10, 'fragment_retries': 10,
+            'socket_timeout': 60,
+            'remote_components': ['ejs:github'],
+            'merge_output_format': 'mp4', 
+        }
+        
+        if self.settings.get('disable_proxy'):
+            opts['noproxy'] = '*'
+            opts['proxy'] = ''
+
+        if self.settings.get('js_runtime', 'auto') != 'auto':
+            opts['js_runtimes'] = [self.settings['js_runtime']]
+
+        if cookie_browser != "Disabled":
+            opts['cookiesfrombrowser'] = (cookie_browser.lower(), )
+
+        # Для фрагмента качаем только отрезок с запасом (download_ranges), а точную обрезку
+        # делаем сами. Если отрезок не прошёл проверку точности - качаем всё видео целиком.
+
+        # Формат подбирается локально по info['formats'] (см. resolve_format_ladder)
+        # Пост-процессоры yt-dlp не используем: обрезка и конвертация полного аудио в MP3
+        # идут на стадии обработки (postprocess_task), не занимая слот скачивания
+
+        last_progress_time = time.time()
+        last_ui_update = 0
+        max_idle_time = 300
+        
+        # Для отслеживания реального имени файла на диске
+        downloaded_file_path = [None] 
+        # Скачано байт по файлам (видео и аудио при склейке) - для замера скорости на N потоках
+        downloaded_bytes = {}
+
+        def hook(d):
+            nonlocal last_progress_time, last_ui_update
+            if is_aborted(): raise Exception("ABORTED_BY_USER")
+            
+            current_time = time.time()
+            if current_time - last_progress_time > max_idle_time:
+                raise Exception("TIMEOUT: Download stalled for more than 5 minutes")
+            
+            if d['status'] == 'downloading':
+                last_progress_time = current_time
+                if 'filename' in d:
+                     downloaded_file_path[0] = d['filename']
+                fname, done_bytes = d.get('filename'), d.get('downloaded_bytes') or 0
+                # Первое событие файла - точка отсчёта: при докачке .part в нём уже лежит прошлый объём
+                delta = done_bytes - downloaded_bytes[fname] if fname in downloaded_bytes else 0
+                downloaded_bytes[fname] = done_bytes
+                if delta > 0:
+                    self.bandwidth.consume(bw_key, delta, is_aborted)
+
+                # Троттлинг отрисовки у каждой задачи свой, иначе параллельные задачи перебивают друг друга
+                now = time.time()
+                if now - last_ui_update > 0.1: 
+                    try:
+                        downloaded = d.get('downloaded_bytes', 0)
+                        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                        speed = d.get('_speed_str', 'N/A')
+                        
+                        if total:
+                            percent_val = downloaded / total
+                            report(progress=percent_val, downloaded_bytes=downloaded, total_bytes=total,
+                                   speed=d.get('speed'))
+                            percent_str = f"{percent_val*100:.1f}%"
+                            downloaded_mb = downloaded / (1024 * 1024)
+                            total_mb = total / (1024 * 1024)
+                            size_info = f"{downloaded_mb:.1f}MB / {total_mb:.1f}MB"
+                        else:
+                            import math
+                            pulse = (math.sin(now * 3) + 1) / 2 
+                            report(progress=0.1 + pulse * 0.1, downloaded_bytes=downloaded, speed=d.get('speed'))
+                            percent_str = "..."
+                            downloaded_mb = downloaded / (1024 * 1024)
+                            size_info = f"{downloaded_mb:.1f}MB"
+                        
+                        status_text = f"⬇ Скачивание: {percent_str} | {speed} | {size_info}"
+                        set_status(status_text, "yellow", 'downloading')
+                        self.report_overall()
+                        last_ui_update = now
+                    except: pass
+            elif d['status'] == 'finished':
+                 if 'filename' in d:
+                     downloaded_file_path[0] = d['filename']
+                 set_progress(0.95)
+                 # Показываем правильное сообщение в зависимости от типа файла
+                 if task['is_audio']:
+                     set_status(self.t('status_merge_mp3'), "cyan", 'merging')
+                 else:
+                     set_status(self.t('status_merge_mp4'), "cyan", 'merging')
+                 last_progress_time = current_time
+
+        opts['progress_hooks'] = [hook]
+
+        try:
+            # 1. СКАЧИВАНИЕ (полное видео или только нужный отрезок)
+            # Info извлекается один раз на задачу и переиспользуется
+            base_info = self.get_task_info(task, cookie_browser)
+            if base_info is None:
+                return  # это был плейлист: его записи уже в очереди отдельными задачами
+            # Повторная проверка архива: у ссылок без канонического вида (Generic) ключ известен только из info
+            video_key = get_info_video_key(base_info, task['url'])
+            batch = [t for t in batch if not self.skip_if_archived(t, video_key)]
+            if not batch:
+                return
+            task = batch[0]
+            self.mark_stage(batch, 'extracted')
+            ladder = get_format_ladder(task.get('q_key'), task.get('fmt'))
+            
+            def download_source(section):
+                """Скачивает выбранный формат целиком или только section=(start, end). Возвращает (info, файл)"""
+                nonlocal base_info
+                # Отрезок входит в имя: файл, скачанный для другого отрезка, не будет принят за готовый
+                base_temp_name = os.path.join(save_path, f"temp_download_{task['key']}")
+                if section:
+                    base_temp_name += f"_{int(section[0])}-{int(section[1])}"
+                opts['outtmpl'] = base_temp_name + ".%(ext)s"
+                self.mark_stage(batch, 'downloading', save_path=save_path)
+                if section:
+                    opts['download_ranges'] = yt_dlp.utils.download_range_func(None, [section])
+                    opts['force_keyframes_at_cuts'] = False  # точную обрезку делаем сами
+                    # ffmpeg копирует с ключевого кадра до начала отрезка и отсчитывает метки от -ss:
+                    # сдвиг возвращает файлу время исходного видео, по нему check_section_accuracy
+                    # находит настоящее начало
+                    opts['external_downloader_args'] = {'ffmpeg_o': ['-output_ts_offset', str(section[0])]}
+                else:
+                    opts.pop('download_ranges', None)
+                    opts.pop('force_keyframes_at_cuts', None)
+                    opts.pop('external_downloader_args', None)
+                downloaded_file_path[0] = None
+                
+                for refresh_attempt in range(2):
+                    if is_aborted():
+                        raise Exception("ABORTED_BY_USER")
+                    
+                    # Выбираем формат по лестнице качества без сетевых запросов
+                    chosen = resolve_format_ladder(base_info, ladder)
+                    if not chosen:
+                        raise Exception("Requested format is not available: ни один вариант качества не найден среди форматов видео")
+                    spec, fmt_info = chosen
+                    fmt_summary = describe_format(fmt_info, base_info.get('duration'))
+                    logging.info(f"tid {tid}: selector '{spec}' -> {fmt_info.get('format_id')} ({fmt_summary}), section={section}")
+                    for t in batch:
+                        t['chosen_format'] = fmt_summary
+                    report(format=fmt_summary)
+                    
+                    # HLS/DASH: потоков на фрагменты столько, сколько выучено для этого CDN,
+                    # в пределах общего бюджета соединений (отрезок качает ffmpeg, ему не нужно)
+                    fragmented = not section and is_fragmented_format(fmt_info)
+                    frag_host = get_host_key((fmt_info.get('requested_formats') or [fmt_info])[0].get('url') or task['url'])
+                    frag_setting = self.settings.get('fragment_concurrency', 'auto')
+                    frag_threads = self.fragments.acquire(frag_host, fragmented, None if frag_setting == 'auto' else int(frag_setting))
+                    frag_errors = 0
+                    
+                    def on_fragment_retry(n):
+                        nonlocal frag_errors
+                        frag_errors += 1
+                        self.fragments.on_error(frag_host)
+                        return get_fragment_backoff(n)
+                    
+                    opts['concurrent_fragment_downloads'] = frag_threads
+                    opts['retry_sleep_functions'] = {'fragment': on_fragment_retry}
+                    if self.bandwidth.rate:
+                        opts.update(buffersize=BANDWIDTH_BLOCK, noresizebuffer=True)
+                    else:
+                        opts.pop('buffersize', None)
+                        opts.pop('noresizebuffer', None)
+                    self.register_download(bw_key, batch)
+                    if section:
+                        # ffmpeg не вызывает progress hook до конца отрезка, поэтому consume() его не сдерживает
+                        share = self.bandwidth.share(bw_key)
+                        readrate = get_section_readrate(share, fmt_info, base_info.get('duration'))
+                        if readrate:
+                            opts['external_downloader_args']['ffmpeg_i'] = ['-readrate', f"{readrate:.3f}"]
+                        else:
+                            opts['external_downloader_args'].pop('ffmpeg_i', None)
+                            if share:
+                                logging.info(f"tid {tid}: format bitrate unknown, section download is not rate limited")
+                    downloaded_bytes.clear()
+                    dl_started = time.time()
+                    dl_failed = True
+                    try:
+                        # Передаём точный format_id, поэтому yt-dlp скачивает ровно то, что показано в карточке
+                        opts['format'] = fmt_info['format_id']
+                        with self.ydl_pool.acquire(opts) as ydl:
+                            # process_ie_result не извлекает видео заново, а сразу скачивает.
+                            # Передаём копию, потому что yt-dlp дописывает в info свои поля
+                            dl_info = ydl.process_ie_result(copy_info(base_info), download=True)
+                        dl_failed = False
+                        break
+                    except Exception as dl_error:
+                        if refresh_attempt == 0 and is_expired_url_error(dl_error):
+                            # Ссылки на потоки истекли: одно обновление info и повтор
+                            logging.info(f"Stream URLs expired for tid {tid}, refreshing info")
+                            base_info = self.get_task_info(task, cookie_browser, force_refresh=True)
+                            continue
+                        raise
+                    finally:
+                        self.unregister_download(bw_key, batch)
+                        self.fragments.release(frag_host, frag_threads, fragmented, sum(downloaded_bytes.values()),
+                                               time.time() - dl_started, failed=dl_failed or frag_errors > 0)
+                
+                # Ищем реальный файл (так как расширение могло измениться на .mkv/.webm)
+                # Список кандидатов на имя файла
+                search_candidates = []
+                if downloaded_file_path[0]: search_candidates.append(downloaded_file_path[0])
+                
+                # Добавляем варианты с разными расширениями на основе имени временного файла
+                search_candidates.extend([
+                    base_temp_name + ".mp4",
+                    base_temp_name + ".mkv",
+                    base_temp_name + ".webm",
+                    base_temp_name + ".mp3",
+                    base_temp_name + ".m4a",
+                    base_temp_name + ".opus"
+                ])
+                
+                for cand in search_candidates:
+                    if cand and os.path.exists(cand):
+                        self.mark_stage(batch, 'downloaded', file=cand)
+                        return dl_info, cand
+                raise Exception("File not found after download (logic error)")
+            
+            def stream_source(fmt_info):
+                """Качает аудио прогрессивного формата сразу в stdin ffmpeg: обработка идёт во время
+                скачивания, временного файла нет. Возвращает [(задача, файл)] или None - тогда качаем файлом"""
+                safe_title = self.get_safe_title(base_info, tid)
+                quality_suffix = self.get_quality_suffix(task.get('q_lbl', ''), True)
+                codec = get_audio_codec_name(fmt_info.get('acodec'))
+                # (задача, начало, конец, файл, аргументы кодека); полное аудио пишется во временное имя
+                outputs = []
+                if task['s'] is None:
+                    profile = get_encoding_profile(task.get('video_settings'), task.get('bitrate', 'auto'))
+                    do_convert = wants_mp3(task, profile)
+                    if codec is None and not do_convert:
+                        return None  # кодек в info не указан: по файлу ffprobe выберет родной контейнер, а не .mka
+                    ext, codec_args = plan_audio_codec(codec, do_convert, task.get('bitrate', 'auto'), profile['audio_bitrate'])
+                    codec_args = ['-map_metadata', '0', *codec_args, *get_audio_output_args(base_info, ext)]
+                    outputs.append((task, None, None, os.path.join(save_path, f"temp_download_{task['key']}.stream{ext}"), codec_args))
+                else:
+                    plans = []
+                    for member in batch:
+                        if member.get('abort'): continue
+                        profile = get_encoding_profile(member.get('video_settings'), member.get('bitrate', 'auto'))
+                        do_convert = wants_mp3(member, profile)
+                        if codec is None and not do_convert:
+                            return None
+                        plans.append((member, *plan_audio_codec(codec, do_convert, member.get('bitrate', 'auto'), profile['audio_bitrate'])))
+                    for member, ext, codec_args in plans:
+                        cut_name = self.reserve_unique_filename(
+                            save_path, f"{safe_title}_cut_{member['s']}-{member['e']}{quality_suffix}", ext)
+                        outputs.append((member, member['s'], member['e'], cut_name, codec_args))
+                
+                self.mark_stage(batch, 'downloading', save_path=save_path)
+                fmt_summary = describe_format(fmt_info, base_info.get('duration'))
+                for t in batch:
+                    t['chosen_format'] = fmt_summary
+                report(format=fmt_summary + " · поток")
+                set_status("⬇ Скачивание и обработка...", "yellow", 'downloading')
+                # Звук кодируется в один поток: бюджет ядер остаётся пулу обработки
+                proc, stderr_tail = open_ffmpeg_stream(self.ffmpeg_exe, [o[1:] for o in outputs], 1)
+                total = fmt_info.get('filesize') or fmt_info.get('filesize_approx')
+                done_bytes, last_ui_update, started = 0, 0, time.time()
+                self.register_download(bw_key, batch)
+                try:
+                    with self.ydl_pool.acquire(opts) as ydl:
+                        for data in iter_http_chunks(ydl, fmt_info):
+                            if is_aborted():
+                                raise Exception("ABORTED_BY_USER")
+                            try:
+                                proc.stdin.write(data)
+                            except OSError:
+                                break  # ffmpeg дописал все фрагменты и вышел: дальше качать не нужно
+                            done_bytes += len(data)
+                            self.bandwidth.consume(bw_key, len(data), is_aborted)
+                            now = time.time()
+                            if now - last_ui_update > 0.1:
+                                report(progress=min(done_bytes / total, 0.99) if total else 0.5, downloaded_bytes=done_bytes,
+                                       total_bytes=total, speed=done_bytes / max(now - started, 0.001))
+                                self.report_overall()
+                                last_ui_update = now
+                    try: proc.stdin.close()
+                    except OSError: pass
+                    if wait_process(proc) != 0:
+                        raise Exception(f"FFmpeg error ({proc.returncode}): {' | '.join(stderr_tail)[-500:]}")
+                except Exception as stream_error:
+                    proc.kill()
+                    proc.wait()
+                    for output in outputs:
+                        try: os.remove(output[3])
+                        except: pass
+                    if "ABORTED_BY_USER" in str(stream_error):
+                        raise
+                    # Контейнер не читается из pipe (moov в конце mp4), сеть... - обычный путь через файл
+                    logging.warning(f"tid {tid}: streaming to ffmpeg failed, falling back to file download: {stream_error}")
+                    return None
+                finally:
+                    self.unregister_download(bw_key, batch)
+                logging.info(f"tid {tid}: streamed {done_bytes} bytes into ffmpeg ({len(outputs)} outputs)")
+                
+                if task['s'] is not None:
+                    return [(output[0], output[3]) for output in outputs]
+                temp_name = outputs[0][3]
+                with self.filename_lock:
+                    final_name = self.get_unique_filename(save_path, f"{safe_title}{quality_suffix}", os.path.splitext(temp_name)[1])
+                    os.rename(temp_name, final_name)
+                return [(task, final_name)]
+            
+            # Для фрагментов качаем только [min s, max e] батча с запасом на ключевые кадры
+            # (в батч попадают только близкие фрагменты, см. select_batch)
+            section = None
+            if task['s'] is not None:
+                span_start = min(t['s'] for t in batch)
+                span_end = max(t['e'] for t in batch)
+                if self.settings.get('section_download', True):
+                    section = get_section_range(span_start, span_end, base_info.get('duration'))
+            
+            # В кэш идут исходники фрагментов; целые видео - только если это включено в настройках
+            cacheable = self.source_cache.enabled() and (task['s'] is not None or self.settings.get('source_cache_full', False))
+            source_hit = None
+            if cacheable:
+                chosen = resolve_format_ladder(base_info, ladder)
+                if chosen:
+                    need = (span_start, span_end) if task['s'] is not None else None
+                    source_hit = self.source_cache.lookup(video_key, chosen[1]['format_id'], need)
+            
+            # Аудио одним прогрессивным файлом можно не сохранять на диск, а сразу отдавать ffmpeg.
+            # Кэш исходников при этом не пополняется. Фрагменты с download_ranges и так качают только отрезок
+            if not source_hit and section is None and task['is_audio'] and self.settings.get('stream_to_ffmpeg', False):
+                chosen = resolve_format_ladder(base_info, ladder)
+                with track_cpu() as cpu:
+                    streamed = stream_source(chosen[1]) if chosen and is_streamable_format(chosen[1]) else None
+                if streamed is not None:
+                    self.finish_tasks(batch, streamed, video_key, base_info, cpu[0])
+                    return
+            
+            # Смещение времени начала скачанного файла относительно начала видео
+            cut_offset = 0
+            if source_hit:
+                # Исходник уже есть в кэше: сеть не нужна
+                cached_path, cached_entry = source_hit
+                info = base_info
+                cut_offset = cached_entry['start']
+                report(format=describe_format(chosen[1], base_info.get('duration')) + " · кэш")
+                logging.info(f"tid {tid}: source cache hit {cached_entry['name']}")
+                if task['s'] is not None:
+                    final_file = cached_path  # только читаем при обрезке
+                else:
+                    final_file = os.path.join(save_path, f"temp_download_{task['key']}{os.path.splitext(cached_path)[1]}")
+                    link_or_copy(cached_path, final_file)
+            else:
+                info, final_file = download_source(section)
+                if section:
+                    section_offset = check_section_accuracy(self.ffprobe_exe, final_file, span_start, span_end)
+                    if section_offset is not None:
+                        cut_offset = section_offset
+                    else:
+                        # Отрезок не покрывает [s, e] (нет ключевых кадров, кривой манифест...): качаем целиком как раньше
+                        logging.warning(f"tid {tid}: section download failed accuracy check, falling back to full download")
+                        set_status(self.t('status_work'), "yellow", 'downloading')
+                        try: os.remove(final_file)
+                        except: pass
+                        section = None
+                        info, final_file = download_source(None)
+
+            # 2. ОБРАБОТКА - в пуле обработки: слот скачивания освобождается сразу,
+            # и следующая задача качается, пока эта режется
+            set_status("⏳ Ожидает обработки...", "cyan", 'postqueue')
+            self.post_pool.submit(self.postprocess_task, batch, {
+                'save_path': save_path, 'info': info, 'final_file': final_file, 'section': section,
+                'source_hit': source_hit, 'cut_offset': cut_offset, 'cacheable': cacheable, 'video_key': video_key,
+            })
+        except Exception as e:
+            self.report_task_error(batch, e)
+
+    def postprocess_task(self, batch, job):
+        """Стадия обработки (задание post_pool): обрезка фрагментов или конвертация и переименование.
+
+        job - что стадия скачивания знает о скачанном исходнике (final_file, section, cut_offset...).
+        ffmpeg получает свой бюджет потоков (ffmpeg_threads), чтобы параллельные задания
+        обработки вместе не занимали больше ядер, чем есть.
+        """
+        batch = [t for t in batch if not t.get('removed')]
+        if not batch: return
+        if self.abort_flag or all(t.get('abort') for t in batch):
+            # Скачанный исходник остаётся на месте: при повторном старте yt-dlp его не качает заново
+            for t in batch:
+                self.reporter.task_update(t, stage='paused', status=self.t('status_paused'), color="orange")
+            return
+        task = batch[0]
+        tid = task['id']
+        save_path, info, final_file = job['save_path'], job['info'], job['final_file']
+        section, source_hit, cut_offset = job['section'], job['source_hit'], job['cut_offset']
+        cacheable, video_key = job['cacheable'], job['video_key']
+        threads = self.ffmpeg_threads
+
+        def set_status(text, color, stage):
+            for t in batch:
+                if not t.get('abort'):
+                    self.reporter.task_update(t, status=text, color=color, stage=stage)
+
+        try:
+            with track_cpu() as cpu:
+                # Если это ФРАГМЕНТ (видео или аудио)
+                if task['s'] is not None:
+                    set_status(self.t('status_cutting'), "orange", 'cutting')
+                    self.report_overall("✂ Обрезка FFmpeg...", "orange")
+                    
+                    # Имя для финального файла (берем из метаданных видео)
+                    # Но очищаем от недопустимых символов, если что
+                    safe_title = self.get_safe_title(info, tid)
+                    
+                    # Добавляем суффикс качества для различения фрагментов с разным разрешением
+                    q_lbl = task.get('q_lbl', '')
+                    quality_suffix = self.get_quality_suffix(q_lbl, task.get('is_audio', False))
+                    
+                    # План обрезки для каждого фрагмента батча: (задача, начало, конец, файл, аргументы кодека, профиль)
+                    cuts = []
+                    work_dir = tempfile.mkdtemp(prefix=f"temp_cut_{task['key']}_", dir=save_path)
+                    try:
+                        for member in batch:
+                            if member.get('abort'): continue
+                            profile = get_encoding_profile(member.get('video_settings'), member.get('bitrate', 'auto'), threads)
+                            base_name = f"{safe_title}_cut_{member['s']}-{member['e']}{quality_suffix}"
+                            if member['is_audio']:
+                                # Обрезка аудио фрагмента: копия потока, если перекодирование не требуется
+                                ext, codec_args = plan_audio_cut(self.ffprobe_exe, final_file, wants_mp3(member, profile),
+                                                                 member.get('bitrate', 'auto'), profile['audio_bitrate'])
+                            elif profile['copy']:
+                                # Без перекодирования: контейнер исходника принимает его кодеки как есть
+                                ext, codec_args = os.path.splitext(final_file)[1] or ".mp4", ['-c', 'copy']
+                            else:
+                                # Обрезка видео фрагмента
+                                ext, codec_args = ".mp4", [*profile['full_args'], '-c:a', 'aac', '-b:a', profile['audio_bitrate']]
+                            cut_name = self.reserve_unique_filename(save_path, base_name, ext)
+                            cuts.append((member, member['s'] - cut_offset, member['e'] - cut_offset, cut_name, codec_args, profile))
+                        
+                        # Копия видео режется поиском по входу (с ключевого кадра), в общий проход её не берём
+                        for member, cut_start, cut_end, cut_name, codec_args, profile in cuts:
+                            if not member['is_audio'] and profile['copy']:
+                                cut_copy(self.ffmpeg_exe, final_file, cut_start, cut_end, cut_name)
+                        encodes = [cut for cut in cuts if cut[0]['is_audio'] or not cut[5]['copy']]
+                        
+                        if len(encodes) == 1:
+                            member, cut_start, cut_end, cut_name, codec_args, profile = encodes[0]
+                            if member['is_audio']:
+                                cut_audio(self.ffmpeg_exe, final_file, cut_start, cut_end, cut_name, codec_args, threads)
+                            else:
+                                # Дешевле всего smart cut: перекодируются только края, середина копируется
+                                try:
+                                    smart_done = cut_video_smart(self.ffmpeg_exe, self.ffprobe_exe, final_file,
+                                                                 cut_start, cut_end, cut_name,
+                                                                 profile['audio_bitrate'], work_dir, threads, profile['edge_opts'])
+                                except Exception as smart_error:
+                                    logging.warning(f"Smart cut failed for tid {tid}, re-encoding: {smart_error}")
+                                    smart_done = False
+                                if not smart_done:
+                                    cut_video_reencode(self.ffmpeg_exe, final_file, cut_start, cut_end, cut_name,
+                                                       profile['audio_bitrate'], threads, profile['full_args'])
+                        elif encodes:
+                            # Несколько фрагментов: один запуск ffmpeg, вход декодируется один раз
+                            logging.info(f"tid {tid}: cutting {len(encodes)} fragments in one ffmpeg pass")
+                            cut_many(self.ffmpeg_exe, final_file,
+                                     [(cut_start, cut_end, cut_name, (['-vn'] if member['is_audio'] else []) + codec_args)
+                                      for member, cut_start, cut_end, cut_name, codec_args, profile in encodes], threads)
+                    except Exception:
+                        # Освобождаем зарезервированные имена
+                        for cut in cuts:
+                            try: os.remove(cut[3])
+                            except: pass
+                        raise
+                    finally:
+                        shutil.rmtree(work_dir, ignore_errors=True)
+                    
+                    # Временный исходник уходит в кэш (для следующих фрагментов этого видео) или удаляется
+                    if not source_hit:
+                        if not (cacheable and self.source_cache.put(video_key, info.get('format_id'), final_file, section,
+                                                                         move=True, start=cut_offset)):
+                            try: os.remove(final_file)
+                            except: pass
+                    done_tasks = [(cut[0], cut[3]) for cut in cuts]
+                    
+                else:
+                    # Если это ПОЛНОЕ видео, просто переименовываем красиво
+                    safe_title = self.get_safe_title(info, tid)
+                    source_file = final_file
+                    if task['is_audio']:
+                        # Полное аудио: MP3 по запросу (wants_mp3), иначе перепаковка исходного потока с тегами
+                        profile = get_encoding_profile(task.get('video_settings'), task.get('bitrate', 'auto'), threads)
+                        ext, codec_args = plan_audio_cut(self.ffprobe_exe, source_file, wants_mp3(task, profile),
+                                                         task.get('bitrate', 'auto'), profile['audio_bitrate'])
+                        if codec_args == ['-c:a', 'copy']:
+                            set_status("📦 Перепаковка аудио...", "cyan", 'merging')
+                        else:
+                            set_status(self.t('status_merge_mp3'), "cyan", 'merging')
+                        self.report_overall()
+                        final_file = os.path.splitext(source_file)[0] + ".conv" + ext
+                        convert_audio(self.ffmpeg_exe, source_file, final_file, codec_args + get_audio_output_args(info, ext), threads)
+                    ext = os.path.splitext(final_file)[1]
+                    
+                    # Добавляем суффикс качества для различения файлов с разным разрешением
+                    q_lbl = task.get('q_lbl', '')
+                    quality_suffix = self.get_quality_suffix(q_lbl, task.get('is_audio', False))
+                    base_name = f"{safe_title}{quality_suffix}"
+                    
+                    if source_file != final_file:
+                        # Исходник аудио больше не нужен здесь: в кэш (если включён) или удаляем
+                        if source_hit or not (cacheable and self.source_cache.put(video_key, info.get('format_id'), source_file, move=True)):
+                            try: os.remove(source_file)
+                            except: pass
+                    elif cacheable and not source_hit:
+                        self.source_cache.put(video_key, info.get('format_id'), final_file)
+                    
+                    # Генерируем уникальное имя файла (под локом: параллельные задачи не должны выбрать одно имя)
+                    with self.filename_lock:
+                        final_name = self.get_unique_filename(save_path, base_name, ext)
+                        os.rename(final_file, final_name)
+                    done_tasks = [(task, final_name)]
+
+            self.finish_tasks(batch, done_tasks, video_key, info, cpu[0])
+        except Exception as e:
+            self.report_task_error(batch, e)
+
+    def finish_tasks(self, batch, done_tasks, video_key, info, cpu_seconds=0.0):
+        """Отмечает задачи батча выполненными. done_tasks - [(задача, готовый файл)].
+        cpu_seconds - CPU ffmpeg на весь батч, делится между его задачами поровну"""
+        cpu_share = round(cpu_seconds / len(done_tasks), 2) if done_tasks else 0.0
+        if done_tasks:
+            logging.info(f"tid {batch[0]['id']}: ffmpeg CPU {cpu_seconds:.2f}s for {len(done_tasks)} outputs")
+        for t, output_file in done_tasks:
+            t['cpu_seconds'] = cpu_share
+            self.mark_stage([t], 'cut' if t['s'] is not None else 'renamed', file=output_file, cpu_seconds=cpu_share)
+            t['done'] = True
+            t['output_file'] = output_file
+            t['info'] = None  # в длинной очереди не держим info выполненных задач
+            self.archive.add(get_archive_key(video_key, t), output_file, info.get('title'))
+            self.run_stats['finished'] += 1
+            status = f"✔ Готово! (CPU {cpu_share:.1f} с)" if cpu_share >= 0.1 else "✔ Готово!"
+            self.reporter.task_update(t, stage='done', status=status, color="green", progress=1, file=output_file,
+                                      cpu_seconds=cpu_share)
+        for t in batch:
+            if t.get('abort') and not t['done']:
+                self.reporter.task_update(t, stage='paused', status=self.t('status_paused'), color="orange")
+        self.report_overall("✅ Завершено")
+
+    def report_task_error(self, batch, e):
+        """Сообщает об ошибке задачи любой стадии (остановка - пауза, таймаут, прочее)"""
+        tid = batch[0]['id']
+        if "ABORTED_BY_USER" in str(e):
+            for t in batch:
+                self.reporter.task_update(t, stage='paused', status=self.t('status_paused'), color="orange")
+            return
+        elif "TIMEOUT" in str(e):
+            err_msg = "Скачивание зависло (таймаут 5 минут). Попробуйте еще раз или проверьте соединение."
+            status_text = "⏱ Таймаут"
+            logging.error(f"Timeout tid {tid}: {e}")
+        else:
+            err_msg = str(e)
+            error_lower = err_msg.lower()
+            
+            # Специальная обработка ошибок формата
+            if "format is not available" in error_lower or "requested format" in error_lower:
+                err_msg = f"Запрошенный формат недоступен. Попробованы все альтернативные форматы.\n\nОшибка: {str(e)}"
+            
+            if "cookie" in error_lower or "locked" in error_lower:
+                err_msg += "\n\n💡 ПОДСКАЗКА: Закройте браузер перед скачиванием!"
+            
+            status_text = "❌ Error"
+            logging.error(f"Error tid {tid}: {e}")
+        
+        for t in batch:
+            if t.get('abort'): continue
+            t['error'] = err_msg
+            self.reporter.task_update(t, stage='error', status=status_text, color="red", error=err_msg)
+
+# --- КОНСОЛЬНЫЙ РЕЖИМ (--cli) ---
+CLI_QUALITY = {'best': 'q_best', '1080': 'q_1080', '720': 'q_720', 'audio': 'q_audio'}
+CLI_BITRATES = ('auto', '128', '192', '320')
+CLI_PROGRESS_INTERVAL = 1.0
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+def parse_time(value):
+    """'HH:MM:SS', 'MM:SS' или секунды -> секунды"""
+    parts = value.split(':')
+    if len(parts) > 3 or not all(p.isdigit() for p in parts):
+        raise ValueError(f"неверное время: {value}")
+    seconds = 0
+    for p in parts:
+        seconds = seconds * 60 + int(p)
+    return seconds
+
+def is_time_range(first, second):
+    """Два поля после URL - START END? Числа вида '1080 192' - это QUALITY BITRATE, а не время"""
+    if not all(re.fullmatch(r'[\d:]+', f) for f in (first, second)):
+        return False
+    if ':' in first or ':' in second:
+        return True
+    return not (first in CLI_QUALITY and second in CLI_BITRATES)
+
+def parse_batch_line(line):
+    """Строка пакетного файла: URL [START END] [QUALITY] [BITRATE]. '-' вместо START END - целиком"""
+    fields = line.split()
+    task = {'url': fields.pop(0), 's': None, 'e': None, 'quality': 'best', 'bitrate': 'auto'}
+    if fields and fields[0] == '-':
+        fields.pop(0)
+    elif len(fields) >= 2 and is_time_range(*fields[:2]):
+        task['s'], task['e'] = parse_time(fields.pop(0)), parse_time(fields.pop(0))
+        if task['e'] <= task['s']:
+            raise ValueError("END должен быть больше START")
+    if fields:
+        task['quality'] = fields.pop(0).lower().rstrip('p')
+        if task['quality'] not in CLI_QUALITY:
+            raise ValueError(f"неизвестное качество: {task['quality']} (есть: {', '.join(CLI_QUALITY)})")
+    if fields:
+        task['bitrate'] = fields.pop(0).lower().rstrip('k')
+        if task['bitrate'] not in CLI_BITRATES:
+            raise ValueError(f"неизвестный битрейт: {task['bitrate']} (есть: {', '.join(CLI_BITRATES)})")
+    if fields:
+        raise ValueError(f"лишние поля: {' '.join(fields)}")
+    return task
+
+def load_batch_file(path):
+    """Читает пакетный файл ('-' - stdin). Пустые строки и строки с # пропускаются"""
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    tasks = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            tasks.append(parse_batch_line(line))
+        except ValueError as e:
+            raise ValueError(f"{path}:{lineno}: {e}")
+    return tasks
+
+class CliReporter(PipelineReporter):
+    """Печатает события задач в stdout в формате JSON Lines, по строке на событие"""
+
+    FIELDS = ('stage', 'title', 'progress', 'downloaded_bytes', 'total_bytes', 'speed', 'format', 'file', 'error',
+              'cpu_seconds')
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.last_progress = {}
+        self.last_stage = {}
+
+    def emit(self, event):
+        with self.lock:
+            self.stream.write(json.dumps(event, ensure_ascii=False) + '\n')
+            self.stream.flush()
+
+    def task_added(self, task):
+        self.emit({'event': 'added', 'id': task['id'], 'url': task['url'], 'title': task.get('title')})
+
+    def task_update(self, task, **state):
+        event = {k: state[k] for k in self.FIELDS if state.get(k) is not None}
+        if not event:
+            return
+        # Смены стадий печатаем всегда, прогресс - не чаще раза в секунду на задачу
+        if event.get('stage') == self.last_stage.get(task['id']):
+            del event['stage']
+        if 'stage' in event:
+            self.last_stage[task['id']] = event['stage']
+        else:
+            now = time.time()
+            if now - self.last_progress.get(task['id'], 0) < CLI_PROGRESS_INTERVAL:
+                return
+            self.last_progress[task['id']] = now
+        self.emit({'event': 'task', 'id': task['id'], 'url': task['url'], **event})
+
+def run_cli(argv):
+    """python yt-dlp-ultimate.py --cli BATCH_FILE [-o DIR] [--parallel N]. Возвращает код выхода"""
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]),
+        description="Пакетное скачивание без окна. Строка файла: URL [START END] [QUALITY] [BITRATE], "
+                    "время - HH:MM:SS, MM:SS или секунды, QUALITY - best/1080/720/audio, BITRATE - auto/128/192/320.")
+    parser.add_argument('--cli', dest='batch_file', required=True, metavar='BATCH_FILE',
+                        help="пакетный файл ('-' - читать из stdin)")
+    parser.add_argument('-o', '--output', help="папка загрузок (по умолчанию download_path из settings.json)")
+    parser.add_argument('--parallel', type=int, help="сколько задач качать одновременно")
+    parser.add_argument('--mp3', action='store_true',
+                        help="конвертировать аудио в mp3 (по умолчанию исходный поток без перекодирования, "
+                             "mp3 - и при явном BITRATE)")
+    parser.add_argument('--no-convert', action='store_true', help=argparse.SUPPRESS)  # поведение по умолчанию
+    parser.add_argument('--stream', action='store_true', help="аудио: обрабатывать во время скачивания, без временного файла")
+    parser.add_argument('--profile', choices=sorted(ENCODING_PROFILES), default='auto',
+                        help="профиль кодирования при обрезке и конвертации (passthrough - без перекодирования)")
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return EXIT_OK if e.code == 0 else EXIT_USAGE
+
+    base_path = get_base_path()
+    settings = load_settings(base_path)
+    setup_logging(settings.get('logging_enabled', True))
+    try:
+        entries = load_batch_file(args.batch_file)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if args.parallel is not None:
+        if args.parallel < 1:
+            print("Ошибка: --parallel должен быть не меньше 1", file=sys.stderr)
+            return EXIT_USAGE
+        settings['max_parallel'] = args.parallel
+    if args.stream:
+        settings['stream_to_ffmpeg'] = True
+
+    save_path = args.output or settings.get('download_path') or os.path.join(base_path, 'downloads')
+    os.makedirs(save_path, exist_ok=True)
+
+    reporter = CliReporter()
+    locale = load_locale(base_path).get(settings.get('language', 'en'), {})
+    pipeline = DownloadPipeline(base_path, settings, reporter, t=lambda key: locale.get(key, key))
+    for entry in entries:
+        q_key = CLI_QUALITY[entry['quality']]
+        pipeline.add_task(entry['url'], entry['s'], entry['e'], QUALITY_MAP[q_key], q_key == 'q_audio',
+                          entry['quality'], args.mp3, entry['bitrate'], args.profile)
+
+    interrupted = False
+    try:
+        pipeline.run(save_path)
+    except KeyboardInterrupt:
+        # Задачи выходят через abort, как по кнопке "Стоп"
+        interrupted = True
+        pipeline.abort_flag = True
+        deadline = time.time() + 10
+        while not pipeline.is_idle() and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        pipeline.shutdown()
+
+    done = [t for t in pipeline.queue if t['done']]
+    failed = [t for t in pipeline.queue if t['error'] and not t['done']]
+    reporter.emit({'event': 'summary', 'total': len(pipeline.queue), 'done': len(done), 'failed': len(failed),
+                   'interrupted': interrupted})
+    if interrupted:
+        return EXIT_INTERRUPTED
+    return EXIT_OK if len(done) == len(pipeline.queue) else EXIT_FAILED
+
+# --- ОБНОВЛЕНИЕ ОКНА ИЗ ФОНОВЫХ ПОТОКОВ ---
+UI_FRAME_MS = 50        # как часто окно забирает накопленные обновления
+UI_FRAME_BUDGET = 0.015 # сколько секунд кадра можно тратить на отрисовку
+
+class UiUpdateBus:
+    """Очередь обновлений окна. Фоновые потоки только кладут сюда данные, Tk-виджеты трогает
+    лишь поток окна в drain (через after).
+
+    Состояния карточек сливаются по задаче: сколько бы событий ни пришло за кадр,
+    рисуется только последнее состояние каждой карточки.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # tid -> слитое состояние карточки
+        self.calls = collections.deque()
+        self.overall = None
+
+    def push_task(self, tid, state):
+        with self.lock:
+            self.pending.setdefault(tid, {}).update(state)
+
+    def push_overall(self, text, color):
+        with self.lock:
+            self.overall = (text, color)
+
+    def call(self, fn, *args, **kwargs):
+        """Выполнить fn(*args, **kwargs) в потоке окна (в порядке добавления)"""
+        with self.lock:
+            self.calls.append((fn, args, kwargs))
+
+    def drop_tasks(self):
+        with self.lock:
+            self.pending.clear()
+
+    def drain(self, apply_task, apply_overall, budget=UI_FRAME_BUDGET):
+        """Применяет накопленное, пока не кончится бюджет кадра. Остаток ждёт следующего кадра"""
+        deadline = time.perf_counter() + budget
+        applied = 0
+        while time.perf_counter() < deadline:
+            with self.lock:
+                if self.calls:
+                    fn, args, kwargs = self.calls.popleft()
+                elif self.pending:
+                    # Первой идёт карточка, ждущая дольше всех: перерисованная уходит в конец
+                    tid = next(iter(self.pending))
+                    fn, args, kwargs = apply_task, (tid, self.pending.pop(tid)), {}
+                elif self.overall:
+                    fn, args, kwargs = apply_overall, self.overall, {}
+                    self.overall = None
+                else:
+                    break
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logging.warning(f"UI update failed: {e}")
+            applied += 1
+        return applied
+
+if ctk:
+    ctk.set_appearance_mode("Dark")
+    ctk.set_default_color_theme("blue")
+
+# --- СПИСОК ОЧЕРЕДИ ---
+QUEUE_ROW_HEIGHT = 92  # высота строки вместе с отступом, px
+QUEUE_ROW_GAP = 8
+
+class QueueViewModel:
+    """Состояние карточек очереди без виджетов: строки по id задачи, в списке - по возрастанию id.
+
+    Строки добавляются не по порядку id: запись плейлиста получает id в фоновом потоке,
+    а карточку поток окна создаёт позже (ui_bus), когда могли добавиться и другие задачи.
+    """
+
+    def __init__(self):
+        self.rows = {}   # tid -> состояние строки
+        self.order = []  # позиция в списке -> tid
+
+    def __len__(self):
+        return len(self.order)
+
+    def tid_at(self, index):
+        return self.order[index]
+
+    def add(self, tid, desc, status, title=None, priority='normal'):
+        if tid not in self.rows:
+            bisect.insort(self.order, tid)
+        self.rows[tid] = {'tid': tid, 'title': title or "...", 'desc': desc, 'desc_base': desc,
+                          'status': status, 'color': None, 'progress': 0, 'error': False, 'priority': priority}
+
+    def update(self, tid, state):
+        """Переносит в строку состояние из PipelineReporter.task_update. Возвращает строку или None"""
+        row = self.rows.get(tid)
+        if row is None:
+            return None
+        if 'title' in state:
+            row['title'] = state['title']
+        if 'status' in state:
+            row['status'] = state['status']
+            row['color'] = state.get('color', "yellow")
+        if 'progress' in state:
+            row['progress'] = state['progress']
+        if 'priority' in state:
+            row['priority'] = state['priority']
+        if 'format' in state:
+            row['desc'] = f"{row['desc_base']} | {state['format']}"
+        if state.get('stage') == 'error':
+            row['error'] = True
+        elif state.get('stage') == 'info':
+            row['error'] = False
+        return row
+
+    def clear(self):
+        self.rows = {}
+        self.order = []
+
+class VirtualTaskList(ctk.CTkFrame if ctk else object):
+    """Список очереди, который держит виджеты только для видимых строк.
+
+    Строки фиксированной высоты, при прокрутке одни и те же виджеты перепривязываются
+    к другим задачам, поэтому число виджетов не зависит от длины очереди.
+    """
+
+    def __init__(self, master, model, on_cancel, on_show_error, on_priority=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.model = model
+        self.on_cancel = on_cancel
+        self.on_show_error = on_show_error
+        self.on_priority = on_priority
+        self.offset = 0       # прокрутка в пикселях от начала списка
+        self.pool = []        # виджеты строк для повторного использования
+        self.visible = {}     # tid -> строка пула, показанная сейчас
+        self.refresh_pending = False
+
+        self.area = ctk.CTkFrame(self, fg_color="transparent")
+        self.area.pack(side="left", fill="both", expand=True)
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.area.bind('<Configure>', lambda e: self.refresh())
+        self.bind_wheel(self.area)
+
+    def bind_wheel(self, widget):
+        widget.bind('<MouseWheel>', self.on_wheel)
+        widget.bind('<Button-4>', self.on_wheel)
+        widget.bind('<Button-5>', self.on_wheel)
+
+    def make_row(self):
+        c = ctk.CTkFrame(self.area, fg_color="#2b2b2b")
+        info = ctk.CTkFrame(c, fg_color="transparent")
+        info.pack(fill="x", padx=10, pady=5)
+        t_lbl = ctk.CTkLabel(info, text="...", font=("Roboto",12,"bold"), anchor="w")
+        t_lbl.pack(side="left", fill="x", expand=True)
+        row = {'tid': None, 'shown': {}, 'card': c, 't': t_lbl}
+        ctk.CTkButton(info, text="✖", width=24, height=20, fg_color="#444", hover_color="#C0392B",
+                      command=lambda: row['tid'] is not None and self.on_cancel(row['tid'])).pack(side="right", padx=(5, 0))
+        # Приоритет: ▽ низкий, ◇ обычный, ⚡ срочно (доля полосы и порядок запуска)
+        row['prio'] = ctk.CTkButton(info, text=PRIORITY_ICONS['normal'], width=24, height=20, fg_color="#444",
+                                    command=lambda: row['tid'] is not None and self.on_priority and self.on_priority(row['tid']))
+        row['prio'].pack(side="right", padx=(5, 0))
+        row['d'] = ctk.CTkLabel(info, text="", text_color="gray")
+        row['d'].pack(side="right")
+        row['p'] = ctk.CTkProgressBar(c, height=10)
+        row['p'].set(0)
+        row['p'].pack(fill="x", padx=10, pady=5)
+        row['s'] = ctk.CTkLabel(c, text="", font=("Arial",10), anchor="w")
+        row['s'].pack(fill="x", padx=10, pady=(0,5))
+        row['err_btn'] = ctk.CTkButton(c, text="Показать ошибку", fg_color="red", height=20,
+                                       command=lambda: row['tid'] is not None and self.on_show_error(row['tid']))
+        for w in (c, info, t_lbl, row['d'], row['p'], row['s']):
+            self.bind_wheel(w)
+        return row
+
+    def paint(self, row, state):
+        """Обновляет только изменившиеся виджеты строки"""
+        shown = row['shown']
+        if shown.get('title') != state['title']:
+            row['t'].configure(text=state['title'])
+        if shown.get('desc') != state['desc']:
+            row['d'].configure(text=state['desc'])
+        if (shown.get('status'), shown.get('color')) != (state['status'], state['color']):
+            row['s'].configure(text=state['status'], text_color=state['color'] or "#DCE4EE")
+        if shown.get('progress') != state['progress']:
+            row['p'].set(state['progress'])
+        if shown.get('priority') != state['priority']:
+            row['prio'].configure(text=PRIORITY_ICONS[state['priority']],
+                                  fg_color="#E67E22" if state['priority'] == 'high' else "#444")
+        if shown.get('error') != state['error']:
+            if state['error']:
+                row['err_btn'].pack(side="right", padx=5)
+            else:
+                row['err_btn'].pack_forget()
+        row['shown'] = dict(state)
+
+    def add_task(self, tid, desc, status, title=None, priority='normal'):
+        self.model.add(tid, desc, status, title, priority)
+        self.schedule_refresh()
+
+    def update_task(self, tid, state):
+        row_state = self.model.update(tid, state)
+        row = self.visible.get(tid)
+        if row_state and row:
+            self.paint(row, row_state)
+
+    def clear(self):
+        self.model.clear()
+        self.offset = 0
+        self.refresh()
+
+    def schedule_refresh(self):
+        # Пачку добавлений (вставка плейлиста) перерисовываем один раз
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.after_idle(self.refresh)
+
+    def refresh(self):
+        self.refresh_pending = False
+        height = max(self.area.winfo_height(), 1)
+        total = len(self.model) * QUEUE_ROW_HEIGHT
+        self.offset = max(0, min(self.offset, total - height))
+        first, shift = divmod(self.offset, QUEUE_ROW_HEIGHT)
+        need = height // QUEUE_ROW_HEIGHT + 2
+        while len(self.pool) < need:
+            self.pool.append(self.make_row())
+
+        self.visible = {}
+        for i, row in enumerate(self.pool):
+            index = first + i
+            if i < need and index < len(self.model):
+                tid = self.model.tid_at(index)
+                if row['tid'] != tid:
+                    row['tid'] = tid
+                self.paint(row, self.model.rows[tid])
+                row['card'].place(x=0, y=i * QUEUE_ROW_HEIGHT - shift, relwidth=1,
+                                  height=QUEUE_ROW_HEIGHT - QUEUE_ROW_GAP)
+                self.visible[tid] = row
+            elif row['tid'] is not None:
+                row['tid'] = None
+                row['card'].place_forget()
+
+        if total > height:
+            self.scrollbar.set(self.offset / total, (self.offset + height) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll_to(self, offset):
+        self.offset = int(offset)
+        self.refresh()
+
+    def on_scrollbar(self, action, value, unit=None):
+        total = len(self.model) * QUEUE_ROW_HEIGHT
+        if action == 'moveto':
+            self.scroll_to(float(value) * total)
+        elif action == 'scroll':
+            step = self.area.winfo_height() if unit == 'pages' else QUEUE_ROW_HEIGHT
+            self.scroll_to(self.offset + int(value) * step)
+
+    def on_wheel(self, event):
+        if getattr(event, 'num', None) in (4, 5):
+            rows = -1 if event.num == 4 else 1
+        else:
+            # Windows: delta кратна 120, macOS: мелкие значения
+            rows = -int(event.delta / 120) if abs(event.delta) >= 120 else (-1 if event.delta > 0 else 1)
+        self.scroll_to(self.offset + rows * QUEUE_ROW_HEIGHT)
+        return "break"
+
+class ModernYouTubeCutter(ctk.CTk if ctk else object):
+    def __init__(self):
+        super().__init__()
+        self.base_path = get_base_path()
+        
+        # Загружаем настройки из settings.json
+        settings = load_settings(self.base_path)
+        self.lang = settings.get('language', 'en')
+        self.logging_enabled = settings.get('logging_enabled', True)
+        self.disable_proxy = settings.get('disable_proxy', False)
+        self.js_runtime = settings.get('js_runtime', 'auto')
+        self.audio_bitrate = 'auto' 
+        self.video_settings = 'auto'
+        self.setup_logging()
+
+        # Загружаем локализацию из JSON файлов
+        self.LOCALE = load_locale(self.base_path)
+        
+        # Устанавливаем иконку
+        icon_path = os.path.join(self.base_path, 'icon.ico')
+        if os.path.exists(icon_path):
+            try:
+                self.iconbitmap(icon_path)
+            except Exception as e:
+                logging.warning(f"Could not set icon: {e}")
+
+        self.title("YT-DLP Ultimate v1.7")
+        self.geometry("950x800")
+        self.minsize(600, 500)
+        
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+        # Очередь, кэши и скачивание живут в конвейере, окно только показывает их состояние
+        self.pipeline = DownloadPipeline(self.base_path, settings, self, t=self.t,
+                                         journal=QueueJournal(os.path.join(self.base_path, 'queue_journal.jsonl')))
+        self.ffmpeg_exe = self.pipeline.ffmpeg_exe
+        self.ffprobe_exe = self.pipeline.ffprobe_exe
+        self.deno_exe = os.path.join(self.base_path, 'deno.exe')
+        
+        env_path = os.environ.get('PATH', '')
+        if self.base_path not in env_path:
+            os.environ['PATH'] = self.base_path + os.pathsep + env_path
+
+        # Загружаем путь загрузок из настроек или используем дефолтный
+        default_dl = os.path.join(self.base_path, 'downloads')
+        download_path = settings.get('download_path')
+        if download_path and os.path.exists(download_path):
+            default_dl = download_path
+        elif not os.path.exists(default_dl):
+            os.makedirs(default_dl)
+        self.download_path_var = ctk.StringVar(value=default_dl)
+
+        self.ui_bus = UiUpdateBus()
+        self.js_runtime_paths = {}
+        self.max_parallel = int(settings.get('max_parallel', 3))
+        self.max_per_host = int(settings.get('max_per_host', 2))
+        self.section_download = settings.get('section_download', True)
+        self.skip_downloaded = settings.get('skip_downloaded', True)
+        self.source_cache_mb = int(settings.get('source_cache_mb', 2048))
+        self.source_cache_full = settings.get('source_cache_full', False)
+        self.fragment_concurrency = settings.get('fragment_concurrency', 'auto')
+        self.connection_budget = int(settings.get('connection_budget', 16))
+        self.bandwidth_limit_kb = int(settings.get('bandwidth_limit_kb', 0))
+        self.stream_to_ffmpeg = settings.get('stream_to_ffmpeg', False)
+        
+        # Сохраняем загруженные настройки для использования в UI
+        self.loaded_settings = settings
+
+        self.tool_probes = ToolProbeCache(os.path.join(self.base_path, 'tool_probes.json'))
+        self.create_ui()
+        self.restore_queue()
+        self.after(TOOL_REFRESH_DELAY_MS, self.refresh_tools_async)
+        self.after(UI_FRAME_MS, self.drain_ui_updates)
+    
+    def save_settings_to_file(self):
+        """Сохраняет текущие настройки в settings.json"""
+        settings = {
+            'language': self.lang,
+            'logging_enabled': self.logging_enabled,
+            'disable_proxy': self.disable_proxy,
+            'js_runtime': self.js_runtime,
+            'cookies_browser': self.cookies_val.get() if hasattr(self, 'cookies_val') else 'Disabled',
+            'download_path': self.download_path_var.get(),
+            'max_parallel': self.max_parallel,
+            'max_per_host': self.max_per_host,
+            'section_download': self.section_download,
+            'skip_downloaded': self.skip_downloaded,
+            'source_cache_mb': self.source_cache_mb,
+            'source_cache_full': self.source_cache_full,
+            'fragment_concurrency': self.fragment_concurrency,
+            'connection_budget': self.connection_budget,
+            'bandwidth_limit_kb': self.bandwidth_limit_kb,
+            'stream_to_ffmpeg': self.stream_to_ffmpeg
+        }
+        self.loaded_settings.update(settings)
+        save_settings(self.base_path, settings)
+
+    def setup_logging(self):
+        setup_logging(self.logging_enabled)
 
     def t(self, key):
         return self.LOCALE.get(self.lang, {}).get(key, key)
@@ -270,7 +3745,12 @@ class ModernYouTubeCutter(ctk.CTk):
         t.grid_columnconfigure(0, weight=1)
         ctk.CTkLabel(t, text=self.t('lbl_url'), font=("Roboto", 14, "bold")).pack(anchor="w", pady=(20, 5), padx=30)
         self.entry_url_full = ctk.CTkEntry(t, height=40)
-        self.entry_url_full.pack(fill="x", padx=30, pady=(0, 20))
+        self.entry_url_full.pack(fill="x", padx=30, pady=(0, 10))
+
+        # Пачка ссылок: названия для всех получает общий ограниченный пул, а не поток на ссылку
+        ctk.CTkLabel(t, text="Несколько ссылок (по одной в строке)").pack(anchor="w", padx=30)
+        self.txt_urls_full = ctk.CTkTextbox(t, height=80)
+        self.txt_urls_full.pack(fill="x", padx=30, pady=(5, 20))
         
         ctk.CTkLabel(t, text=self.t('lbl_quality')).pack(anchor="w", padx=30)
         vals = [self.t(k) for k in ['q_best', 'q_1080', 'q_720', 'q_audio']]
@@ -286,13 +3766,13 @@ class ModernYouTubeCutter(ctk.CTk):
         
         # Настройки видео
         ctk.CTkLabel(t, text=self.t('lbl_video_settings')).pack(anchor="w", padx=30, pady=(10, 0))
-        video_vals = [self.t('video_settings_auto'), self.t('video_settings_fast'), self.t('video_settings_quality')]
+        video_vals = [self.t(f'video_settings_{choice}') for choice in VIDEO_SETTINGS_CHOICES]
         self.combo_video_full = ctk.CTkOptionMenu(t, values=video_vals, width=250)
         self.combo_video_full.set(self.t('video_settings_auto'))
         self.combo_video_full.pack(anchor="w", padx=30, pady=(5, 5))
         
+        # По умолчанию звук не перекодируется: MP3 - по галочке или явному битрейту
         self.chk_conv_full = ctk.CTkCheckBox(t, text=self.t('chk_convert'))
-        self.chk_conv_full.select()
         self.chk_conv_full.pack(anchor="w", padx=30, pady=(5, 20))
 
         ctk.CTkButton(t, text=self.t('btn_add_full'), height=50, command=self.add_full_task).pack(fill="x", padx=50)
@@ -324,13 +3804,12 @@ class ModernYouTubeCutter(ctk.CTk):
         
         # Настройки видео
         ctk.CTkLabel(t, text=self.t('lbl_video_settings')).pack(anchor="w", padx=30, pady=(10, 0))
-        video_vals = [self.t('video_settings_auto'), self.t('video_settings_fast'), self.t('video_settings_quality')]
+        video_vals = [self.t(f'video_settings_{choice}') for choice in VIDEO_SETTINGS_CHOICES]
         self.combo_video_frag = ctk.CTkOptionMenu(t, values=video_vals, width=250)
         self.combo_video_frag.set(self.t('video_settings_auto'))
         self.combo_video_frag.pack(anchor="w", padx=30, pady=(5, 5))
         
         self.chk_conv_frag = ctk.CTkCheckBox(t, text=self.t('chk_convert'))
-        self.chk_conv_frag.select()
         self.chk_conv_frag.pack(anchor="w", padx=30, pady=(5, 10))
         
         ctk.CTkButton(t, text=self.t('btn_add_frag'), height=50, fg_color="#1f6aa5", command=self.add_frag_task).pack(fill="x", padx=50, pady=20)
@@ -347,8 +3826,8 @@ class ModernYouTubeCutter(ctk.CTk):
 
     def ui_queue_tab(self):
         t = self.tab_queue
-        self.scroll_frame = ctk.CTkScrollableFrame(t)
-        self.scroll_frame.pack(fill="both", expand=True, padx=5, pady=5)
+        self.queue_list = VirtualTaskList(t, QueueViewModel(), self.cancel_task, self.show_error, self.cycle_priority)
+        self.queue_list.pack(fill="both", expand=True, padx=5, pady=5)
         
         ctrl = ctk.CTkFrame(t, fg_color="transparent")
         ctrl.pack(fill="x", padx=10, pady=5)
@@ -382,6 +3861,54 @@ class ModernYouTubeCutter(ctk.CTk):
         if self.disable_proxy: self.chk_noproxy.select()
         self.chk_noproxy.pack(pady=10)
         
+        ctk.CTkLabel(t, text="Параллельные загрузки (всего / на один сайт):").pack(pady=(10, 5))
+        par_frame = ctk.CTkFrame(t, fg_color="transparent")
+        par_frame.pack(pady=5)
+        self.combo_parallel = ctk.CTkOptionMenu(par_frame, values=[str(n) for n in range(1, 9)], width=80, command=self.update_parallel_setting)
+        self.combo_parallel.set(str(self.max_parallel))
+        self.combo_parallel.pack(side="left", padx=5)
+        self.combo_per_host = ctk.CTkOptionMenu(par_frame, values=[str(n) for n in range(1, 9)], width=80, command=self.update_parallel_setting)
+        self.combo_per_host.set(str(self.max_per_host))
+        self.combo_per_host.pack(side="left", padx=5)
+        
+        ctk.CTkLabel(t, text="Ограничение скорости на все загрузки (КБ/с, 0 - без ограничения):").pack(pady=(10, 5))
+        self.combo_bandwidth = ctk.CTkOptionMenu(t, values=[str(n) for n in BANDWIDTH_LIMITS_KB], width=100, command=self.update_bandwidth_setting)
+        self.combo_bandwidth.set(str(self.bandwidth_limit_kb))
+        self.combo_bandwidth.pack(pady=5)
+        
+        ctk.CTkLabel(t, text="Потоки HLS/DASH (на задачу / всего соединений):").pack(pady=(10, 5))
+        frag_frame = ctk.CTkFrame(t, fg_color="transparent")
+        frag_frame.pack(pady=5)
+        self.combo_fragments = ctk.CTkOptionMenu(frag_frame, values=["Авто"] + [str(n) for n in FRAGMENT_CONCURRENCY_VALUES],
+                                                 width=80, command=self.update_fragments_setting)
+        self.combo_fragments.set("Авто" if self.fragment_concurrency == 'auto' else str(self.fragment_concurrency))
+        self.combo_fragments.pack(side="left", padx=5)
+        self.combo_conn_budget = ctk.CTkOptionMenu(frag_frame, values=[str(n) for n in FRAGMENT_CONNECTION_BUDGETS],
+                                                   width=80, command=self.update_fragments_setting)
+        self.combo_conn_budget.set(str(self.connection_budget))
+        self.combo_conn_budget.pack(side="left", padx=5)
+        
+        self.chk_section = ctk.CTkCheckBox(t, text="Фрагменты: качать только нужный отрезок", command=self.update_section_setting)
+        if self.section_download: self.chk_section.select()
+        self.chk_section.pack(pady=10)
+        
+        self.chk_stream = ctk.CTkCheckBox(t, text="Аудио: обрабатывать во время скачивания, без временного файла", command=self.update_stream_setting)
+        if self.stream_to_ffmpeg: self.chk_stream.select()
+        self.chk_stream.pack(pady=10)
+        
+        self.chk_skip_downloaded = ctk.CTkCheckBox(t, text="Не скачивать повторно то, что уже скачано", command=self.update_skip_downloaded_setting)
+        if self.skip_downloaded: self.chk_skip_downloaded.select()
+        self.chk_skip_downloaded.pack(pady=10)
+        
+        ctk.CTkLabel(t, text="Кэш исходников для повторной обрезки (МБ, 0 - выкл.):").pack(pady=(10, 5))
+        self.combo_source_cache = ctk.CTkOptionMenu(t, values=[str(n) for n in SOURCE_CACHE_SIZES_MB], width=100, command=self.update_source_cache_setting)
+        self.combo_source_cache.set(str(self.source_cache_mb))
+        self.combo_source_cache.pack(pady=5)
+        
+        self.chk_source_cache_full = ctk.CTkCheckBox(t, text="Кэшировать и целиком скачанные видео", command=self.update_source_cache_full_setting)
+        if self.source_cache_full: self.chk_source_cache_full.select()
+        self.chk_source_cache_full.pack(pady=10)
+        
         ctk.CTkLabel(t, text=self.t('sett_js_runtime')).pack(pady=(10, 5))
         available_runtimes = self.detect_js_runtimes()
         runtime_values = [self.t('sett_js_auto')]
@@ -394,9 +3921,10 @@ class ModernYouTubeCutter(ctk.CTk):
         self.combo_js_runtime = ctk.CTkOptionMenu(t, values=runtime_values, variable=self.js_runtime_val, command=self.update_js_runtime)
         self.combo_js_runtime.pack(pady=5)
         
-        if not available_runtimes:
-            ctk.CTkLabel(t, text=self.t('sett_js_not_found'), 
-                        text_color="orange", font=("Arial", 9)).pack(pady=(5, 10))
+        # Пока кэш пуст, результата проверки ещё нет: надпись покажет apply_js_runtimes
+        self.lbl_js_not_found = ctk.CTkLabel(t, text=self.t('sett_js_not_found'), text_color="orange", font=("Arial", 9))
+        if not available_runtimes and self.tool_probes.entries:
+            self.lbl_js_not_found.pack(pady=(5, 10))
         
         ctk.CTkLabel(t, text=self.t('sett_lang')).pack(pady=(20, 5))
         self.lang_combo = ctk.CTkOptionMenu(t, values=["Русский", "English"], command=self.change_lang_req)
@@ -431,10 +3959,10 @@ class ModernYouTubeCutter(ctk.CTk):
         def run_upd():
             try:
                 subprocess.check_call([sys.executable, "-m", "pip", "install", "--upgrade", "yt-dlp"])
-                messagebox.showinfo("Success", self.t('msg_upd_ok'))
+                self.ui_bus.call(messagebox.showinfo, "Success", self.t('msg_upd_ok'))
             except Exception as e:
-                messagebox.showerror("Error", f"Update failed: {e}")
-            self.lbl_status.configure(text=self.t('status_ready'))
+                self.ui_bus.call(messagebox.showerror, "Error", f"Update failed: {e}")
+            self.ui_bus.push_overall(self.t('status_ready'), "#aaa")
         threading.Thread(target=run_upd, daemon=True).start()
 
     def change_lang_req(self, v):
@@ -458,6 +3986,52 @@ class ModernYouTubeCutter(ctk.CTk):
     def update_cookies_setting(self, value):
         self.save_settings_to_file()
     
+    def update_parallel_setting(self, value):
+        self.max_parallel = int(self.combo_parallel.get())
+        self.max_per_host = int(self.combo_per_host.get())
+        # Планировщик читает лимиты на каждом шаге, так что они применяются сразу
+        self.pipeline.scheduler.max_parallel = self.max_parallel
+        self.pipeline.scheduler.max_per_host = self.max_per_host
+        self.save_settings_to_file()
+    
+    def update_bandwidth_setting(self, value):
+        self.bandwidth_limit_kb = int(value)
+        # Лимит действует сразу, в том числе на уже идущие скачивания
+        self.pipeline.bandwidth.rate = self.bandwidth_limit_kb * 1024
+        self.save_settings_to_file()
+    
+    def update_fragments_setting(self, value):
+        value = self.combo_fragments.get()
+        self.fragment_concurrency = 'auto' if value == "Авто" else int(value)
+        self.connection_budget = int(self.combo_conn_budget.get())
+        # Число потоков читается при старте каждого скачивания, бюджет - сразу
+        self.pipeline.fragments.budget = self.connection_budget
+        self.save_settings_to_file()
+    
+    def update_section_setting(self):
+        self.section_download = bool(self.chk_section.get())
+        self.save_settings_to_file()
+    
+    def update_stream_setting(self):
+        self.stream_to_ffmpeg = bool(self.chk_stream.get())
+        self.save_settings_to_file()
+    
+    def update_skip_downloaded_setting(self):
+        self.skip_downloaded = bool(self.chk_skip_downloaded.get())
+        self.save_settings_to_file()
+    
+    def update_source_cache_setting(self, value):
+        self.source_cache_mb = int(value)
+        # Новый лимит применяется сразу, лишнее вытесняется
+        self.pipeline.source_cache.max_bytes = self.source_cache_mb * 1024 * 1024
+        self.pipeline.source_cache.evict()
+        self.pipeline.source_cache.save()
+        self.save_settings_to_file()
+    
+    def update_source_cache_full_setting(self):
+        self.source_cache_full = bool(self.chk_source_cache_full.get())
+        self.save_settings_to_file()
+    
     def update_js_runtime(self, value):
         if value == self.t('sett_js_auto'):
             self.js_runtime = 'auto'
@@ -484,22 +4058,25 @@ class ModernYouTubeCutter(ctk.CTk):
         return 'auto'
     
     def get_video_settings_value(self, display_val):
-        if display_val == self.t('video_settings_auto'):
-            return 'auto'
-        elif display_val == self.t('video_settings_fast'):
-            return 'fast'
-        elif display_val == self.t('video_settings_quality'):
-            return 'quality'
+        for choice in VIDEO_SETTINGS_CHOICES:
+            if display_val == self.t(f'video_settings_{choice}'):
+                return choice
         return 'auto'
     
     def add_full_task(self):
-        url = self.entry_url_full.get()
-        if not url: return
+        urls = [self.entry_url_full.get().strip()] + MULTI_URL_RE.findall(self.txt_urls_full.get("1.0", "end"))
+        urls = [u for u in dict.fromkeys(urls) if u]
+        if not urls: return
         val = self.combo_q_full.get()
         bitrate = self.get_bitrate_value(self.combo_bitrate_full.get())
         video_settings = self.get_video_settings_value(self.combo_video_full.get())
-        self.add_card(url, None, None, self.get_q_string(val), self.is_audio(val), val, 
-                     self.chk_conv_full.get(), bitrate, video_settings)
+        for i, url in enumerate(urls):
+            # Журнал сбрасываем на диск один раз за пачку
+            task = self.pipeline.add_task(url, None, None, self.get_q_string(val), self.is_audio(val), val,
+                                          self.chk_conv_full.get(), bitrate, video_settings,
+                                          probe=True, sync=(i == len(urls) - 1))
+            self.show_card(task)
+        self.txt_urls_full.delete("1.0", "end")
         self.tabview.set(self.t('tab_queue'))
 
     def add_frag_task(self):
@@ -523,98 +4100,104 @@ class ModernYouTubeCutter(ctk.CTk):
         self.tabview.set(self.t('tab_queue'))
 
     def add_card(self, url, s, e, fmt, is_audio, q_lbl, do_convert, bitrate='auto', video_settings='auto'):
-        tid = len(self.download_queue)
-        c = ctk.CTkFrame(self.scroll_frame, fg_color="#2b2b2b")
-        c.pack(fill="x", pady=5)
-        
-        info = ctk.CTkFrame(c, fg_color="transparent")
-        info.pack(fill="x", padx=10, pady=5)
-        t_lbl = ctk.CTkLabel(info, text="...", font=("Roboto",12,"bold"), anchor="w")
-        t_lbl.pack(side="left", fill="x", expand=True)
-        
+        task = self.pipeline.add_task(url, s, e, fmt, is_audio, q_lbl, do_convert, bitrate, video_settings, probe=True)
+        self.show_card(task)
+
+    def show_card(self, task):
+        """Строка задачи в списке очереди + получение названия в фоне"""
+        if task.get('removed'): return
+        s, e = task['s'], task['e']
         desc = "FULL" if s is None else f"{str(datetime.timedelta(seconds=s))}-{str(datetime.timedelta(seconds=e))}"
-        icon = "🎵" if is_audio else "🎬"
-        ctk.CTkLabel(info, text=f"{icon} {desc} | {q_lbl}", text_color="gray").pack(side="right")
-        
-        p = ctk.CTkProgressBar(c, height=10); p.set(0); p.pack(fill="x", padx=10, pady=5)
-        st = ctk.CTkLabel(c, text=self.t('status_ready'), font=("Arial",10), anchor="w")
-        st.pack(fill="x", padx=10, pady=(0,5))
-        
-        err_btn = ctk.CTkButton(c, text="Показать ошибку", fg_color="red", height=20, command=lambda: self.show_error(tid))
-        
-        self.task_widgets[tid] = {'t': t_lbl, 'p': p, 's': st, 'err_btn': err_btn, 'card': c}
-        self.download_queue.append({
-            'id': tid, 'url': url, 's': s, 'e': e, 'fmt': fmt, 'is_audio': is_audio, 
-            'conv': do_convert, 'bitrate': bitrate, 'video_settings': video_settings,
-            'q_lbl': q_lbl, 'done': False, 'error': None
-        })
-        threading.Thread(target=self.fetch_title, args=(tid, url)).start()
+        icon = "🎵" if task['is_audio'] else "🎬"
+        self.queue_list.add_task(task['id'], f"{icon} {desc} | {task['q_lbl']}", self.t('status_ready'), task.get('title'),
+                                 task.get('priority', 'normal'))
+        # Записи плейлиста приходят уже с названием, полный info извлечётся при скачивании
+        if not task['info_event'].is_set():
+            self.pipeline.request_probe(task)
 
-    def fetch_title(self, tid, url):
-        try:
-            fetch_opts = {
-                'quiet': True,
-                'remote_components': ['ejs:github'],
-                'socket_timeout': 30,
-            }
-            if self.disable_proxy:
-                fetch_opts['noproxy'] = '*'
-                fetch_opts['proxy'] = ''
-            if self.js_runtime != 'auto':
-                fetch_opts['js_runtimes'] = [self.js_runtime]
-            
-            import signal
-            def timeout_handler(signum, frame):
-                raise TimeoutError("Timeout getting video info")
-            
-            result = [None]
-            error = [None]
-            
-            def extract_info():
-                try:
-                    with yt_dlp.YoutubeDL(fetch_opts) as ydl:
-                        result[0] = ydl.extract_info(url, download=False)
-                except Exception as e:
-                    error[0] = e
-            
-            thread = threading.Thread(target=extract_info, daemon=True)
-            thread.start()
-            thread.join(timeout=30)
-            
-            if thread.is_alive():
-                self.task_widgets[tid]['t'].configure(text="⏱ Таймаут получения информации")
-                return
-            
-            if error[0]:
-                raise error[0]
-            
-            if result[0]:
-                self.task_widgets[tid]['t'].configure(text=result[0].get('title','Unknown'))
-        except Exception as e:
-            self.task_widgets[tid]['t'].configure(text=f"❌ Ошибка: {str(e)[:50]}")
+    def restore_queue(self):
+        """Возвращает в очередь задачи, не доделанные до закрытия/падения программы"""
+        restored = self.pipeline.restore_queue(self.download_path_var.get(), probe=True)
+        for task in restored:
+            self.show_card(task)
+        if restored:
+            self.lbl_status.configure(text=f"↻ Восстановлено задач: {len(restored)}", text_color="#FF9800")
 
     def show_error(self, tid):
-        err = self.download_queue[tid].get('error', 'Unknown error')
+        err = self.pipeline.queue[tid].get('error', 'Unknown error')
         messagebox.showerror("Error Details", f"{err}")
 
+    def cancel_task(self, tid):
+        """Останавливает одну задачу, не трогая остальные"""
+        queue = self.pipeline.queue
+        task = queue[tid] if tid < len(queue) else None
+        if not task or task['done']: return
+        task['abort'] = True
+        self.pipeline.probe_pool.cancel(task)
+        self.ui_bus.push_task(tid, {'stage': 'paused', 'status': self.t('status_paused'), 'color': "orange"})
+
+    def cycle_priority(self, tid):
+        """Кнопка приоритета в строке очереди: низкий -> обычный -> срочно -> низкий"""
+        queue = self.pipeline.queue
+        task = queue[tid] if tid < len(queue) else None
+        if not task or task['done']: return
+        priority = PRIORITY_ORDER[(PRIORITY_ORDER.index(task.get('priority', 'normal')) + 1) % len(PRIORITY_ORDER)]
+        self.pipeline.set_priority(task, priority)
+        self.queue_list.update_task(tid, {'priority': priority})
+
+    def task_added(self, task):
+        """PipelineReporter: запись развёрнутого плейлиста, карточку создаёт поток окна"""
+        self.ui_bus.call(self.show_card, task)
+
+    def task_update(self, task, **state):
+        """PipelineReporter: вызывается из потоков задач, поэтому только кладёт состояние в ui_bus"""
+        if task.get('removed'):
+            return  # после очистки очереди id снова с 0: не рисуем старую задачу на новой карточке
+        self.ui_bus.push_task(task['id'], state)
+
+    def overall(self, text, color=None):
+        """PipelineReporter: строка статуса внизу окна (тоже через ui_bus)"""
+        self.ui_bus.push_overall(text, color or "#4CAF50")
+
+    def drain_ui_updates(self):
+        """Каждые UI_FRAME_MS забирает из ui_bus накопленные обновления и рисует их"""
+        # Следующий кадр планируем заранее: модальное окно из ui_bus.call не должно останавливать отрисовку
+        self.after(UI_FRAME_MS, self.drain_ui_updates)
+        self.ui_bus.drain(self.apply_task_state, self.apply_overall_status)
+
+    def apply_task_state(self, tid, state):
+        """Переносит слитое состояние задачи в список очереди (поток окна)"""
+        self.queue_list.update_task(tid, state)
+
+    def apply_overall_status(self, text, color):
+        self.lbl_status.configure(text=text, text_color=color)
+
     def stop_download_only(self):
-        if self.is_running:
-            self.abort_flag = True
+        if self.pipeline.is_running:
+            self.pipeline.abort_flag = True
             self.lbl_status.configure(text="Stopping...", text_color="yellow")
 
     def hard_reset(self):
-        self.abort_flag = True 
+        self.pipeline.abort_flag = True 
         def cleaner():
             time.sleep(0.5)
-            self.download_queue = []
-            for w in self.scroll_frame.winfo_children(): w.destroy()
-            self.task_widgets = {}
-            self.lbl_status.configure(text=self.t('status_ready'), text_color="#aaa")
-            self.is_running = False
-            self.abort_flag = False
-            self.btn_start.configure(state="normal")
+            # Даём параллельным задачам выйти через abort, прежде чем удалять их карточки
+            deadline = time.time() + 10
+            while not self.pipeline.is_idle() and time.time() < deadline:
+                time.sleep(0.1)
+            self.pipeline.clear()
+            self.pipeline.is_running = False
+            self.pipeline.abort_flag = False
+            self.ui_bus.call(self.reset_queue_view)
         threading.Thread(target=cleaner).start()
 
+    def reset_queue_view(self):
+        # Обновления удалённых карточек больше не нужны
+        self.ui_bus.drop_tasks()
+        self.queue_list.clear()
+        self.lbl_status.configure(text=self.t('status_ready'), text_color="#aaa")
+        self.btn_start.configure(state="normal")
+
     def change_path(self):
         d = filedialog.askdirectory()
         if d:
@@ -624,62 +4207,26 @@ class ModernYouTubeCutter(ctk.CTk):
         p = self.download_path_var.get()
         if os.path.exists(p): os.startfile(p)
     def exit_app(self):
-        if self.is_running:
+        if self.pipeline.is_running:
             title = "Выход" if self.lang == 'ru' else "Exit"
             if not messagebox.askyesno(title, self.t('msg_exit_confirm')):
                 return
-            self.abort_flag = True
+            self.pipeline.abort_flag = True
+        self.pipeline.shutdown()
         self.quit()
         self.destroy()
     def restart_app(self):
-        if self.is_running:
+        if self.pipeline.is_running:
             title = "Перезапуск" if self.lang == 'ru' else "Restart"
             if not messagebox.askyesno(title, self.t('msg_restart_confirm')):
                 return
-            self.abort_flag = True
+            self.pipeline.abort_flag = True
+        self.pipeline.shutdown()
         python = sys.executable
         os.execl(python, python, *sys.argv)
     
-    def check_tool_version(self, tool_path, version_arg='--version'):
-        try:
-            if not os.path.exists(tool_path):
-                return None, "Файл не найден"
-            
-            startupinfo = None
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            
-            result = subprocess.run(
-                [tool_path, version_arg], 
-                capture_output=True, 
-                text=True, 
-                timeout=15,
-                startupinfo=startupinfo,
-                encoding='utf-8', errors='replace' 
-            )
-            
-            output = (result.stdout + result.stderr).strip()
-            
-            if "version" in output.lower():
-                lines = output.split('\n')
-                for line in lines:
-                    if "version" in line.lower():
-                        return True, line.strip()[:60] 
-                return True, "Версия определена (см. лог)"
-            
-            if result.returncode == 0:
-                return True, output.split('\n')[0] if output else "Версия неизвестна"
-            else:
-                return False, f"Ошибка выполнения: {output[:100]}"
-                
-        except subprocess.TimeoutExpired:
-            return False, "Таймаут (Антивирус блокирует?)"
-        except Exception as e:
-            return False, f"Ошибка: {str(e)[:100]}"
-    
-    def show_diagnostics(self):
-        """Показывает окно диагностики системы внутри вкладки"""
+    def show_diagnostics(self, force=False):
+        """Показывает окно диагностики системы внутри вкладки. force - перепроверить инструменты в обход кэша"""
         tab_name = self.t('diag_title')
         
         try:
@@ -699,67 +4246,23 @@ class ModernYouTubeCutter(ctk.CTk):
         title_label = ctk.CTkLabel(scroll_frame, text=self.t('diag_title'), font=("Roboto", 18, "bold"))
         title_label.pack(pady=(0, 20))
         
-        results = []
-        
-        ffmpeg_exists = os.path.exists(self.ffmpeg_exe)
-        if ffmpeg_exists:
-            ffmpeg_works, ffmpeg_version = self.check_tool_version(self.ffmpeg_exe)
-            results.append((self.t('diag_ffmpeg'), ffmpeg_exists, ffmpeg_works, ffmpeg_version, self.ffmpeg_exe))
-        else:
-            results.append((self.t('diag_ffmpeg'), False, False, "Не найден", self.ffmpeg_exe))
-        
-        ffprobe_exists = os.path.exists(self.ffprobe_exe)
-        if ffprobe_exists:
-            ffprobe_works, ffprobe_version = self.check_tool_version(self.ffprobe_exe)
-            results.append((self.t('diag_ffprobe'), ffprobe_exists, ffprobe_works, ffprobe_version, self.ffprobe_exe))
-        else:
-            results.append((self.t('diag_ffprobe'), False, False, "Не найден", self.ffprobe_exe))
-        
-        deno_exists = os.path.exists(self.deno_exe)
-        if deno_exists:
-            deno_works, deno_version = self.check_tool_version(self.deno_exe)
-            results.append((self.t('diag_deno'), deno_exists, deno_works, deno_version, self.deno_exe))
-        else:
-            try:
-                result = subprocess.run(['deno', '--version'], capture_output=True, text=True, timeout=2)
-                if result.returncode == 0:
-                    deno_version = result.stdout.strip().split('\n')[0]
-                    results.append((self.t('diag_deno'), True, True, deno_version, "Системный (в PATH)"))
-                else:
-                    results.append((self.t('diag_deno'), False, False, "Не найден", "Не найден локально и в системе"))
-            except:
-                results.append((self.t('diag_deno'), False, False, "Не найден", "Не найден локально и в системе"))
+        # Карточки рисуются сразу, а версии заполняются из фоновых потоков по мере готовности:
+        # запуск exe под антивирусом может идти десятки секунд, окно при этом не замирает
+        tools = [
+            (self.t('diag_ffmpeg'), [self.ffmpeg_exe]),
+            (self.t('diag_ffprobe'), [self.ffprobe_exe]),
+            (self.t('diag_deno'), [self.deno_exe, 'deno']),
+        ]
+        for name, candidates in tools:
+            card = self.make_diag_card(scroll_frame, name)
+            threading.Thread(target=self.probe_diag_tool, args=(card, candidates, force), daemon=True).start()
         
+        card = self.make_diag_card(scroll_frame, self.t('diag_ytdlp'))
         try:
             import yt_dlp
-            ytdlp_version = yt_dlp.version.__version__
-            results.append((self.t('diag_ytdlp'), True, True, ytdlp_version, "Установлен"))
+            self.fill_diag_card(card, {'found': True, 'ok': True, 'version': yt_dlp.version.__version__}, "Установлен")
         except Exception as e:
-            results.append((self.t('diag_ytdlp'), False, False, f"Ошибка: {str(e)[:50]}", "Не установлен"))
-        
-        for name, found, working, version, path in results:
-            frame = ctk.CTkFrame(scroll_frame, fg_color="#2b2b2b")
-            frame.pack(fill="x", pady=5, padx=10)
-            
-            name_label = ctk.CTkLabel(frame, text=name, font=("Roboto", 12, "bold"), anchor="w")
-            name_label.pack(anchor="w", padx=10, pady=(10, 5))
-            
-            found_text = self.t('diag_found') if found else self.t('diag_not_found')
-            found_color = "#4CAF50" if found else "#E74C3C"
-            found_label = ctk.CTkLabel(frame, text=found_text, text_color=found_color, anchor="w")
-            found_label.pack(anchor="w", padx=10, pady=2)
-            
-            if found:
-                working_text = self.t('diag_working') if working else self.t('diag_not_working')
-                working_color = "#4CAF50" if working else "#E74C3C"
-                working_label = ctk.CTkLabel(frame, text=working_text, text_color=working_color, anchor="w")
-                working_label.pack(anchor="w", padx=10, pady=2)
-            
-            version_label = ctk.CTkLabel(frame, text=f"{self.t('diag_version')} {version}", text_color="#aaa", anchor="w", font=("Arial", 10))
-            version_label.pack(anchor="w", padx=10, pady=2)
-            
-            path_label = ctk.CTkLabel(frame, text=f"Путь: {path}", text_color="#888", anchor="w", font=("Arial", 9))
-            path_label.pack(anchor="w", padx=10, pady=(2, 10))
+            self.fill_diag_card(card, {'found': False, 'ok': False, 'version': f"Ошибка: {str(e)[:50]}"}, "Не установлен")
         
         info_frame = ctk.CTkFrame(scroll_frame, fg_color="#2b2b2b")
         info_frame.pack(fill="x", pady=10, padx=10)
@@ -778,437 +4281,398 @@ class ModernYouTubeCutter(ctk.CTk):
         python_version = sys.version.split()[0]
         ctk.CTkLabel(info_frame, text=f"Python: {python_version}", text_color="#aaa", anchor="w", font=("Arial", 9)).pack(anchor="w", padx=10, pady=2)
         
+        cache_stats = self.pipeline.metadata_cache.stats()
+        cache_text = (f"Кэш метаданных: попаданий {cache_stats['hits']}, промахов {cache_stats['misses']} "
+                      f"({cache_stats['hit_rate']*100:.0f}%), записей {cache_stats['entries']}, "
+                      f"{cache_stats['file_size'] / 1024:.0f} KB")
+        ctk.CTkLabel(info_frame, text=cache_text, text_color="#aaa", anchor="w", font=("Arial", 9)).pack(anchor="w", padx=10, pady=2)
+        pool_stats = self.pipeline.ydl_pool.stats()
+        pool_text = (f"Пул YoutubeDL: создано {pool_stats['created']}, переиспользовано {pool_stats['reused']} "
+                     f"({pool_stats['reuse_rate']*100:.0f}%), простаивает {pool_stats['idle']}, "
+                     f"keep-alive: {'да' if pool_stats['keepalive'] else 'нет (нет пакета requests)' if pool_stats['reuse'] else 'нет (пул выключен для этой версии yt-dlp)'}")
+        ctk.CTkLabel(info_frame, text=pool_text, text_color="#aaa", anchor="w", font=("Arial", 9)).pack(anchor="w", padx=10, pady=2)
+        frag_stats = self.pipeline.fragments.stats()
+        levels = ", ".join(f"{host} {lvl}" for host, lvl in frag_stats['levels'].items()) or "ещё нет замеров"
+        frag_text = (f"Потоки HLS/DASH: {levels}; соединений {frag_stats['in_use']} / {frag_stats['budget']}, "
+                     f"повторов фрагментов {frag_stats['errors']}")
+        ctk.CTkLabel(info_frame, text=frag_text, text_color="#aaa", anchor="w", font=("Arial", 9)).pack(anchor="w", padx=10, pady=2)
+        probe_stats = self.pipeline.probe_stats
+        probe_text = f"Названия карточек: лёгких probe {probe_stats['light']}, полных извлечений {probe_stats['full']}"
+        ctk.CTkLabel(info_frame, text=probe_text, text_color="#aaa", anchor="w", font=("Arial", 9)).pack(anchor="w", padx=10, pady=2)
+        
+        src_stats = self.pipeline.source_cache.stats()
+        src_text = (f"Кэш исходников: {src_stats['size'] / 1024 / 1024:.0f} / {src_stats['max_bytes'] / 1024 / 1024:.0f} MB, "
+                    f"файлов {src_stats['entries']}, попаданий {src_stats['hits']}, промахов {src_stats['misses']} "
+                    f"({src_stats['hit_rate']*100:.0f}%)")
+        ctk.CTkLabel(info_frame, text=src_text, text_color="#aaa", anchor="w", font=("Arial", 9)).pack(anchor="w", padx=10, pady=2)
+        
         def close_tab():
             try:
                 self.tabview.delete(tab_name)
             except: pass
             
-        close_btn = ctk.CTkButton(t, text=self.t('diag_close'), command=close_tab, width=150, height=40)
-        close_btn.pack(pady=20)
+        btn_frame = ctk.CTkFrame(t, fg_color="transparent")
+        btn_frame.pack(pady=20)
+        ctk.CTkButton(btn_frame, text="Перепроверить", command=lambda: self.show_diagnostics(force=True),
+                      width=150, height=40, fg_color="#555").pack(side="left", padx=5)
+        close_btn = ctk.CTkButton(btn_frame, text=self.t('diag_close'), command=close_tab, width=150, height=40)
+        close_btn.pack(side="left", padx=5)
+
+    def make_diag_card(self, parent, name):
+        """Карточка инструмента в диагностике, пока без результата проверки"""
+        frame = ctk.CTkFrame(parent, fg_color="#2b2b2b")
+        frame.pack(fill="x", pady=5, padx=10)
+        ctk.CTkLabel(frame, text=name, font=("Roboto", 12, "bold"), anchor="w").pack(anchor="w", padx=10, pady=(10, 5))
+        card = {'frame': frame}
+        card['found'] = ctk.CTkLabel(frame, text="⏳ Проверяется...", text_color="#aaa", anchor="w")
+        card['found'].pack(anchor="w", padx=10, pady=2)
+        card['working'] = ctk.CTkLabel(frame, text="", anchor="w")
+        card['version'] = ctk.CTkLabel(frame, text="", text_color="#aaa", anchor="w", font=("Arial", 10))
+        card['version'].pack(anchor="w", padx=10, pady=2)
+        card['timing'] = ctk.CTkLabel(frame, text="", text_color="#888", anchor="w", font=("Arial", 9))
+        card['timing'].pack(anchor="w", padx=10, pady=2)
+        card['path'] = ctk.CTkLabel(frame, text="", text_color="#888", anchor="w", font=("Arial", 9))
+        card['path'].pack(anchor="w", padx=10, pady=(2, 10))
+        return card
+
+    def probe_diag_tool(self, card, candidates, force=False):
+        """Фоновый поток: первый найденный из candidates (путь или имя в PATH), результат - в карточку через ui_bus"""
+        started = time.perf_counter()
+        for tool in candidates:
+            entry = self.tool_probes.probe(tool, force=force)
+            if entry['found']:
+                break
+        entry['total_ms'] = (time.perf_counter() - started) * 1000
+        if not entry['found']:
+            path = "Не найден локально и в системе" if len(candidates) > 1 else candidates[0]
+        elif os.path.dirname(tool):
+            path = tool
+        else:
+            path = f"{entry['fingerprint'][0]} (в PATH)"
+        self.ui_bus.call(self.fill_diag_card, card, entry, path)
 
-    def check_tools(self):
+    def fill_diag_card(self, card, entry, path):
+        if not card['frame'].winfo_exists():
+            return  # вкладку закрыли, пока шла проверка
+        found = entry['found']
+        card['found'].configure(text=self.t('diag_found') if found else self.t('diag_not_found'),
+                                text_color="#4CAF50" if found else "#E74C3C")
+        if found:
+            card['working'].configure(text=self.t('diag_working') if entry['ok'] else self.t('diag_not_working'),
+                                      text_color="#4CAF50" if entry['ok'] else "#E74C3C")
+            card['working'].pack(anchor="w", padx=10, pady=2, after=card['found'])
+        card['version'].configure(text=f"{self.t('diag_version')} {entry['version']}")
+        if 'seconds' in entry:
+            run = f"запуск процесса {entry.get('spawn_ms', 0):.1f} мс, ответ {entry['seconds'] * 1000:.0f} мс"
+            if entry.get('cached'):
+                card['timing'].configure(text=f"Проверка: {entry['total_ms']:.0f} мс, из кэша (бинарник не менялся); "
+                                              f"при последнем запуске: {run}")
+            else:
+                card['timing'].configure(text=f"Проверка: {entry['total_ms']:.0f} мс; {run}")
+        card['path'].configure(text=f"Путь: {path}")
+
+    def refresh_tools_async(self):
+        """Проверки ffmpeg/ffprobe и JS-рантаймов после показа окна: в фоне, результат - через ui_bus"""
+        threading.Thread(target=self.refresh_tools, daemon=True).start()
+
+    def refresh_tools(self):
         if not os.path.exists(self.ffmpeg_exe) or not os.path.exists(self.ffprobe_exe):
-            messagebox.showwarning("Warning", "ffmpeg/ffprobe missing!")
-    
-    def detect_js_runtimes(self):
+            self.ui_bus.call(messagebox.showwarning, "Warning", "ffmpeg/ffprobe missing!")
+        available = self.detect_js_runtimes(refresh=True)
+        self.ui_bus.call(self.apply_js_runtimes, available)
+
+    def detect_js_runtimes(self, refresh=False):
+        """Доступные JS-рантаймы. refresh=False - только из кэша, без процессов (для построения окна);
+        refresh=True - устаревшие записи проверяются запуском (только из фонового потока)"""
         available = []
         runtime_paths = {}
-        
-        if os.path.exists(self.deno_exe):
-            try:
-                result = subprocess.run([self.deno_exe, '--version'], capture_output=True, timeout=2)
-                if result.returncode == 0:
-                    available.append('deno')
-                    runtime_paths['deno'] = self.deno_exe
-            except: pass
-        
-        if 'deno' not in available:
-            try:
-                result = subprocess.run(['deno', '--version'], capture_output=True, timeout=2)
-                if result.returncode == 0:
-                    available.append('deno')
-                    runtime_paths['deno'] = 'deno'
-            except: pass
-        
-        try:
-            result = subprocess.run(['node', '--version'], capture_output=True, timeout=2)
-            if result.returncode == 0:
-                available.append('nodejs')
-                runtime_paths['nodejs'] = 'node'
-        except: pass
-        
-        try:
-            result = subprocess.run(['qjs', '--version'], capture_output=True, timeout=2)
-            if result.returncode == 0:
-                available.append('quickjs')
-                runtime_paths['quickjs'] = 'qjs'
-        except: pass
-        
+        for name, tool in [('deno', self.deno_exe)] + list(JS_RUNTIMES):
+            if name in available:
+                continue
+            if refresh:
+                entry = self.tool_probes.probe(tool, timeout=JS_RUNTIME_PROBE_TIMEOUT)
+            else:
+                entry = self.tool_probes.get(tool, verify=False)
+            # Рантайм, который напечатал версию и упал, не годится: нужен код возврата 0
+            if entry and entry.get('ok') and entry.get('returncode') == 0:
+                available.append(name)
+                runtime_paths[name] = tool
         self.js_runtime_paths = runtime_paths
         return available
+
+    def apply_js_runtimes(self, available):
+        """Обновляет список рантаймов в настройках по результату фоновой проверки"""
+        self.combo_js_runtime.configure(values=[self.t('sett_js_auto')] + (available or ['deno', 'nodejs', 'quickjs']))
+        if available:
+            self.lbl_js_not_found.pack_forget()
+        else:
+            self.lbl_js_not_found.pack(pady=(5, 10), after=self.combo_js_runtime)
+
     def start_download_thread(self):
-        if self.is_running: return 
-        self.is_running = True
-        self.abort_flag = False
+        if self.pipeline.is_running: return 
+        self.pipeline.is_running = True
         self.btn_start.configure(state="disabled")
-        threading.Thread(target=self.worker, daemon=True).start()
+        threading.Thread(target=self.worker, args=(self.download_path_var.get(),), daemon=True).start()
 
-    def worker(self):
-        save_path = self.download_path_var.get()
-        cookie_browser = self.cookies_val.get()
-        total_tasks = len([t for t in self.download_queue if not t['done']])
-        current_task_num = 0
+    def worker(self, save_path):
+        self.pipeline.run(save_path)
+
+        self.ui_bus.call(self.btn_start.configure, state="normal")
         
-        for task in self.download_queue:
-            if self.abort_flag: break
-            if task['done']: continue
-            
-            current_task_num += 1
-            tid = task['id']
-            w = self.task_widgets.get(tid)
-            if not w: continue
-            
-            task_title = w['t'].cget('text')
-            if len(task_title) > 40:
-                task_title = task_title[:37] + "..."
-            self.lbl_status.configure(
-                text=f"📥 Задача {current_task_num}/{total_tasks}: {task_title}",
-                text_color="#4CAF50"
-            )
-            
-            w['s'].configure(text="⏳ Получение информации...", text_color="yellow")
-            w['err_btn'].pack_forget()
-            
-            # Для фрагментов сразу ставим другой статус, так как будем качать полное
-            if task['s'] is not None:
-                status_msg = self.t('status_work') # "Скачивание полного видео..."
-            else:
-                status_msg = "⬇ Скачивание..."
+        if self.pipeline.abort_flag:
+            self.ui_bus.push_overall("⏹ Остановлено пользователем", "orange")
+            self.pipeline.abort_flag = False
+        else:
+            completed = len([t for t in self.pipeline.queue if t['done']])
+            total = len(self.pipeline.queue)
+            self.ui_bus.push_overall(f"✅ Все задачи выполнены ({completed}/{total})", "#4CAF50")
+            self.ui_bus.call(messagebox.showinfo, "Info", self.t('msg_done'))
 
-            self.lbl_status.configure(
-                text=f"📥 [{current_task_num}/{total_tasks}] {status_msg}",
-                text_color="#FF9800"
-            )
+# --- ЗАМЕРЫ (--bench) ---
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0
 
-            # Используем временное имя для скачивания
-            temp_filename_tpl = f"temp_download_{tid}.%(ext)s"
-            
-            opts = {
-                'ffmpeg_location': self.ffmpeg_dir,
-                'quiet': True, 'no_warnings': True, 'noprogress': True,
-                'outtmpl': os.path.join(save_path, temp_filename_tpl),
-                'restrictfilenames': True,
-                'retries': 10, 'fragment_retries': 10,
-                'socket_timeout': 60,
-                'remote_components': ['ejs:github'],
-                'merge_output_format': 'mp4', 
-            }
-            
-            if self.disable_proxy:
-                opts['noproxy'] = '*'
-                opts['proxy'] = ''
-
-            if self.js_runtime != 'auto':
-                opts['js_runtimes'] = [self.js_runtime]
-
-            if cookie_browser != "Disabled":
-                opts['cookiesfrombrowser'] = (cookie_browser.lower(), )
-
-            # ВАЖНО: Если это фрагмент, мы НЕ используем download_sections.
-            # Мы качаем всё видео целиком, чтобы потом гарантированно его обрезать.
-            # Для полного видео (если task['s'] is None) настройки обычные.
-
-            # Определяем формат для скачивания
-            original_format = None
-            if task['is_audio']:
-                original_format = 'bestaudio/best'
-                opts['format'] = original_format
-                opts['postprocessors'] = [{'key': 'FFmpegExtractAudio','preferredcodec': 'mp3'}]
-            else:
-                # Используем формат из задачи для правильного разрешения
-                # Если формат не задан, используем дефолтный
-                if task.get('fmt'):
-                    original_format = task['fmt']
-                    opts['format'] = original_format
-                else:
-                    # Дефолтный формат
-                    original_format = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-                    opts['format'] = original_format
-            
-            # ОТКЛЮЧАЕМ сложные пост-процессоры внутри YT-DLP для видео,
-            # чтобы избежать конфликтов. Обрезку делаем сами.
+def bench_queue_view(args):
+    """Задержки добавления, обновления и прокрутки списка очереди при args.tasks задачах"""
+    root = ctk.CTk()
+    root.geometry("950x800")
+    view = VirtualTaskList(root, QueueViewModel(), lambda tid: None, lambda tid: None)
+    view.pack(fill="both", expand=True)
+    root.update()
 
-            download_start_time = time.time()
-            last_progress_time = time.time()
-            max_idle_time = 300
-            
-            # Для отслеживания реального имени файла на диске
-            downloaded_file_path = [None] 
+    add_times = []
+    start = time.perf_counter()
+    for tid in range(args.tasks):
+        t0 = time.perf_counter()
+        view.add_task(tid, f"🎬 FULL | 1080p #{tid}", "Ready")
+        add_times.append(time.perf_counter() - t0)
+    root.update()
+    add_total = time.perf_counter() - start
 
-            def hook(d):
-                nonlocal last_progress_time
-                if self.abort_flag: raise Exception("ABORTED_BY_USER")
-                
-                current_time = time.time()
-                if current_time - last_progress_time > max_idle_time:
-                    raise Exception("TIMEOUT: Download stalled for more than 5 minutes")
-                
-                if d['status'] == 'downloading':
-                    last_progress_time = current_time
-                    if 'filename' in d:
-                         downloaded_file_path[0] = d['filename']
-
-                    now = time.time()
-                    if now - self.last_ui_update > 0.1: 
-                        try:
-                            downloaded = d.get('downloaded_bytes', 0)
-                            total = d.get('total_bytes') or d.get('total_bytes_estimate')
-                            speed = d.get('_speed_str', 'N/A')
-                            
-                            if total:
-                                percent_val = downloaded / total
-                                w['p'].set(percent_val)
-                                percent_str = f"{percent_val*100:.1f}%"
-                                downloaded_mb = downloaded / (1024 * 1024)
-                                total_mb = total / (1024 * 1024)
-                                size_info = f"{downloaded_mb:.1f}MB / {total_mb:.1f}MB"
-                            else:
-                                import math
-                                pulse = (math.sin(now * 3) + 1) / 2 
-                                w['p'].set(0.1 + pulse * 0.1) 
-                                percent_str = "..."
-                                downloaded_mb = downloaded / (1024 * 1024)
-                                size_info = f"{downloaded_mb:.1f}MB"
-                            
-                            status_text = f"⬇ Скачивание: {percent_str} | {speed} | {size_info}"
-                            w['s'].configure(text=status_text, text_color="yellow")
-                            self.lbl_status.configure(
-                                text=f"📥 [{current_task_num}/{total_tasks}] {percent_str} | {speed}",
-                                text_color="#4CAF50"
-                            )
-                            self.last_ui_update = now
-                        except: pass
-                elif d['status'] == 'finished':
-                     if 'filename' in d:
-                         downloaded_file_path[0] = d['filename']
-                     w['p'].set(0.95)
-                     # Показываем правильное сообщение в зависимости от типа файла
-                     if task['is_audio']:
-                         w['s'].configure(text=self.t('status_merge_mp3'), text_color="cyan")
-                     else:
-                         w['s'].configure(text=self.t('status_merge_mp4'), text_color="cyan")
-                     last_progress_time = current_time
-
-            opts['progress_hooks'] = [hook]
+    update_times = []
+    for i in range(2000):
+        t0 = time.perf_counter()
+        view.update_task((i * 7919) % args.tasks, {'progress': (i % 100) / 100, 'status': f"⬇ {i}", 'color': "yellow"})
+        update_times.append(time.perf_counter() - t0)
 
-            try:
-                # 1. СКАЧИВАНИЕ ПОЛНОГО ВИДЕО
-                download_success = False
-                last_error = None
-                
-                # Пытаемся скачать с основным форматом и fallback вариантами
-                formats_to_try = [original_format] if original_format else [opts.get('format', 'best')] if original_format else []
-                
-                # Добавляем fallback форматы если основной формат задан
-                if task.get('fmt'):
-                    # Определяем тип качества для fallback
-                    q_key = None
-                    fmt_to_check = task['fmt']
-                    
-                    # Проверяем точное совпадение
-                    for key, fmt_val in QUALITY_MAP.items():
-                        if fmt_val == fmt_to_check:
-                            q_key = key
-                            break
-                    
-                    # Если не нашли точное совпадение, проверяем по содержимому
-                    if not q_key:
-                        fmt_lower = fmt_to_check.lower()
-                        if '1080' in fmt_lower or 'height=1080' in fmt_lower:
-                            q_key = 'q_1080'
-                        elif '720' in fmt_lower or 'height=720' in fmt_lower:
-                            q_key = 'q_720'
-                        elif task['is_audio'] or 'audio' in fmt_lower:
-                            q_key = 'q_audio'
-                        else:
-                            q_key = 'q_best'
-                    
-                    if q_key and q_key in FALLBACK_FORMATS:
-                        formats_to_try.extend(FALLBACK_FORMATS[q_key])
-                    else:
-                        # Общие fallback форматы
-                        if task['is_audio']:
-                            formats_to_try.extend(['bestaudio/best', 'audio', 'best'])
-                        else:
-                            formats_to_try.extend(['bestvideo+bestaudio/best', 'best'])
-                else:
-                    # Если формат не задан, используем общие fallback
-                    if task['is_audio']:
-                        formats_to_try = ['bestaudio/best', 'audio', 'best']
-                    else:
-                        formats_to_try = ['bestvideo+bestaudio/best', 'best']
-                
-                # Пробуем скачать с каждым форматом по очереди
-                for fmt_attempt in formats_to_try:
-                    if self.abort_flag:
-                        raise Exception("ABORTED_BY_USER")
-                    
-                    try:
-                        opts['format'] = fmt_attempt
-                        with yt_dlp.YoutubeDL(opts) as ydl:
-                            info = ydl.extract_info(task['url'], download=False)
-                            # Получаем имя, которое yt-dlp хотел бы дать
-                            target_filename = ydl.prepare_filename(info)
-                            ydl.download([task['url']])
-                        download_success = True
-                        break  # Успешно скачали, выходим из цикла
-                    except Exception as fmt_error:
-                        error_str = str(fmt_error).lower()
-                        # Если это ошибка формата, пробуем следующий
-                        if "format is not available" in error_str or "requested format" in error_str:
-                            last_error = fmt_error
-                            logging.info(f"Format {fmt_attempt} not available, trying next...")
-                            continue
-                        else:
-                            # Другая ошибка - пробрасываем дальше
-                            raise
-                
-                if not download_success:
-                    raise last_error if last_error else Exception("Failed to download with any available format")
-                
-                # Ищем реальный файл (так как расширение могло измениться на .mkv/.webm)
-                final_file = None
-                
-                # Список кандидатов на имя файла
-                search_candidates = []
-                if downloaded_file_path[0]: search_candidates.append(downloaded_file_path[0])
-                
-                # Добавляем варианты с разными расширениями на основе ID задачи
-                base_temp_name = os.path.join(save_path, f"temp_download_{tid}")
-                search_candidates.extend([
-                    base_temp_name + ".mp4",
-                    base_temp_name + ".mkv",
-                    base_temp_name + ".webm",
-                    base_temp_name + ".mp3"
-                ])
-                
-                for cand in search_candidates:
-                    if cand and os.path.exists(cand):
-                        final_file = cand
-                        break
-                
-                if not final_file:
-                    raise Exception("File not found after download (logic error)")
+    scroll_times = []
+    total_height = args.tasks * QUEUE_ROW_HEIGHT
+    for i in range(300):
+        t0 = time.perf_counter()
+        view.scroll_to((i * 104729) % total_height)
+        root.update_idletasks()
+        scroll_times.append(time.perf_counter() - t0)
+    result = {
+        'bench': 'queue-view', 'tasks': args.tasks, 'row_widgets': len(view.pool),
+        'add_total_s': round(add_total, 3),
+        'add_p50_ms': round(percentile(add_times, 0.5) * 1000, 3),
+        'add_p99_ms': round(percentile(add_times, 0.99) * 1000, 3),
+        'update_p99_ms': round(percentile(update_times, 0.99) * 1000, 3),
+        'scroll_p50_ms': round(percentile(scroll_times, 0.5) * 1000, 3),
+        'scroll_p99_ms': round(percentile(scroll_times, 0.99) * 1000, 3),
+    }
+    root.destroy()
+    return result
 
-                # 2. ОБРАБОТКА (ОБРЕЗКА ИЛИ ПЕРЕИМЕНОВАНИЕ)
-                
-                # Если это ФРАГМЕНТ (видео или аудио)
-                if task['s'] is not None:
-                    w['s'].configure(text=self.t('status_cutting'), text_color="orange")
-                    self.lbl_status.configure(text=f"✂ [{current_task_num}/{total_tasks}] Обрезка FFmpeg...", text_color="orange")
-                    
-                    # Имя для финального файла (берем из метаданных видео)
-                    # Но очищаем от недопустимых символов, если что
-                    safe_title = "".join([c for c in info.get('title', f'video_{tid}') if c.isalpha() or c.isdigit() or c in ' .-_']).strip()
-                    
-                    # Битрейт аудио
-                    bitrate = task.get('bitrate', 'auto')
-                    a_bitrate = '192k'
-                    if bitrate == '128' or bitrate == 'fast': a_bitrate = '128k'
-                    elif bitrate == '320': a_bitrate = '320k'
-                    
-                    # Добавляем суффикс качества для различения фрагментов с разным разрешением
-                    q_lbl = task.get('q_lbl', '')
-                    quality_suffix = self.get_quality_suffix(q_lbl, task.get('is_audio', False))
-                    
-                    if task['is_audio']:
-                        # Обрезка аудио фрагмента
-                        base_name = f"{safe_title}_cut_{task['s']}-{task['e']}{quality_suffix}"
-                        final_cut_name = self.get_unique_filename(save_path, base_name, ".mp3")
-                        
-                        # КОМАНДА FFmpeg для аудио
-                        cmd = [
-                            self.ffmpeg_exe, '-y',
-                            '-i', final_file,         # Входной файл (полный)
-                            '-ss', str(task['s']),    # Время начала
-                            '-to', str(task['e']),    # Время конца
-                            '-acodec', 'libmp3lame',  # Кодек MP3
-                            '-b:a', a_bitrate,        # Битрейт
-                            final_cut_name            # Выходной файл
-                        ]
-                    else:
-                        # Обрезка видео фрагмента
-                        base_name = f"{safe_title}_cut_{task['s']}-{task['e']}{quality_suffix}"
-                        final_cut_name = self.get_unique_filename(save_path, base_name, ".mp4")
-                        
-                        # КОМАНДА FFmpeg для видео
-                        cmd = [
-                            self.ffmpeg_exe, '-y',
-                            '-i', final_file,         # Входной файл (полный)
-                            '-ss', str(task['s']),    # Время начала
-                            '-to', str(task['e']),    # Время конца
-                            '-c:v', 'libx264',        # Перекодируем видео (гарантия точности)
-                            '-preset', 'ultrafast',   # Максимально быстро
-                            '-c:a', 'aac',            # Перекодируем звук (гарантия работы)
-                            '-b:a', a_bitrate,
-                            final_cut_name            # Выходной файл
-                        ]
-                    
-                    startupinfo = None
-                    if os.name == 'nt':
-                        startupinfo = subprocess.STARTUPINFO()
-                        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+def bench_fragments(args):
+    """Скорость HLS-скачивания с локального сервера на разном числе потоков и работа FragmentConcurrency.
 
-                    subprocess.run(cmd, check=True, startupinfo=startupinfo)
-                    
-                    # Удаляем временный полный файл
-                    try: os.remove(final_file)
-                    except: pass
-                    
-                else:
-                    # Если это ПОЛНОЕ видео, просто переименовываем красиво
-                    safe_title = "".join([c for c in info.get('title', f'video_{tid}') if c.isalpha() or c.isdigit() or c in ' .-_']).strip()
-                    ext = os.path.splitext(final_file)[1]
-                    
-                    # Добавляем суффикс качества для различения файлов с разным разрешением
-                    q_lbl = task.get('q_lbl', '')
-                    quality_suffix = self.get_quality_suffix(q_lbl, task.get('is_audio', False))
-                    base_name = f"{safe_title}{quality_suffix}"
-                    
-                    # Генерируем уникальное имя файла
-                    final_name = self.get_unique_filename(save_path, base_name, ext)
-                    
-                    os.rename(final_file, final_name)
+    Сервер отдаёт каждое соединение не быстрее args.conn_kbps и с задержкой args.latency_ms
+    (как CDN), а больше args.server_limit одновременных запросов отклоняет с 429.
+    """
+    import http.server
+    root = tempfile.mkdtemp(prefix='bench_fragments_')
+    payload = os.urandom(args.fragment_kb * 1024)
+    for i in range(args.fragments):
+        with open(os.path.join(root, f'seg{i}.ts'), 'wb') as f:
+            f.write(payload)
+    with open(os.path.join(root, 'index.m3u8'), 'w') as f:
+        f.write("#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:0\n")
+        f.write("".join(f"#EXTINF:2.0,\nseg{i}.ts\n" for i in range(args.fragments)))
+        f.write("#EXT-X-ENDLIST\n")
 
-                task['done'] = True
-                w['s'].configure(text="✔ Готово!", text_color="green")
-                w['p'].set(1)
-                
-                self.lbl_status.configure(
-                    text=f"✅ [{current_task_num}/{total_tasks}] Завершено",
-                    text_color="#4CAF50"
-                )
-            except Exception as e:
-                if "ABORTED_BY_USER" in str(e):
-                    w['s'].configure(text=self.t('status_paused'), text_color="orange")
+    active = [0]
+    active_lock = threading.Lock()
+    rejected = [0]
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, directory=root, **kw)
+
+        def log_message(self, *a):
+            pass
+
+        def copyfile(self, source, outputfile):
+            # Ограничение скорости одного соединения
+            chunk = 16 * 1024
+            while True:
+                data = source.read(chunk)
+                if not data:
                     break
-                elif "TIMEOUT" in str(e):
-                    err_msg = "Скачивание зависло (таймаут 5 минут). Попробуйте еще раз или проверьте соединение."
-                    task['error'] = err_msg
-                    w['s'].configure(text="⏱ Таймаут", text_color="red")
-                    w['err_btn'].pack(side="right", padx=5)
-                    logging.error(f"Timeout tid {tid}: {e}")
+                outputfile.write(data)
+                time.sleep(len(data) / (args.conn_kbps * 1024))
+
+        def do_GET(self):
+            with active_lock:
+                over = args.server_limit and active[0] >= args.server_limit
+                if over:
+                    rejected[0] += 1
                 else:
-                    err_msg = str(e)
-                    error_lower = err_msg.lower()
-                    
-                    # Специальная обработка ошибок формата
-                    if "format is not available" in error_lower or "requested format" in error_lower:
-                        err_msg = f"Запрошенный формат недоступен. Попробованы все альтернативные форматы.\n\nОшибка: {str(e)}"
-                    
-                    if "cookie" in error_lower or "locked" in error_lower:
-                        err_msg += "\n\n💡 ПОДСКАЗКА: Закройте браузер перед скачиванием!"
-                    
-                    task['error'] = err_msg
-                    w['s'].configure(text="❌ Error", text_color="red")
-                    w['err_btn'].pack(side="right", padx=5)
-                    logging.error(f"Error tid {tid}: {e}")
+                    active[0] += 1
+            if over:
+                self.send_error(429)
+                return
+            try:
+                time.sleep(args.latency_ms / 1000)
+                super().do_GET()
+            finally:
+                with active_lock:
+                    active[0] -= 1
 
-        self.is_running = False
-        self.btn_start.configure(state="normal")
-        
-        if self.abort_flag:
-            self.lbl_status.configure(text="⏹ Остановлено пользователем", text_color="orange")
-            self.abort_flag = False
-        else:
-            completed = len([t for t in self.download_queue if t['done']])
-            total = len(self.download_queue)
-            self.lbl_status.configure(
-                text=f"✅ Все задачи выполнены ({completed}/{total})",
-                text_color="#4CAF50"
-            )
-            messagebox.showinfo("Info", self.t('msg_done'))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/index.m3u8"
+    info = {'id': 'bench', 'title': 'bench', 'extractor': 'generic', 'extractor_key': 'Generic', 'webpage_url': url,
+            'formats': [{'format_id': 'hls', 'url': url, 'protocol': 'm3u8_native', 'ext': 'ts'}]}
+    total_mb = args.fragments * args.fragment_kb / 1024
+
+    def download(threads, on_retry):
+        out = os.path.join(root, 'out')
+        for name in os.listdir(root):
+            if name.startswith('out'):
+                os.remove(os.path.join(root, name))
+        opts = {'quiet': True, 'no_warnings': True, 'noprogress': True, 'outtmpl': out + '.%(ext)s',
+                'format': 'hls', 'fixup': 'never', 'fragment_retries': 20, 'skip_unavailable_fragments': False,
+                'concurrent_fragment_downloads': threads, 'retry_sleep_functions': {'fragment': on_retry}}
+        t0 = time.perf_counter()
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            ydl.process_ie_result(dict(info), download=True)
+        return time.perf_counter() - t0
+
+    try:
+        levels = {}
+        for threads in args.levels:
+            rejected[0] = 0
+            seconds = download(threads, lambda n: get_fragment_backoff(n) / 10)
+            levels[threads] = {'mb_s': round(total_mb / seconds, 2), 'seconds': round(seconds, 2), 'http_429': rejected[0]}
+
+        # Адаптивный режим: несколько скачиваний подряд, как задачи очереди одного CDN
+        controller = FragmentConcurrency(args.budget)
+        adaptive = []
+        for _ in range(args.rounds):
+            rejected[0] = 0
+            errors = [0]
+            threads = controller.acquire('bench', True)
+
+            def on_retry(n):
+                errors[0] += 1
+                controller.on_error('bench')
+                return get_fragment_backoff(n) / 10
+
+            seconds = download(threads, on_retry)
+            controller.release('bench', threads, True, total_mb * 1024 * 1024, seconds, failed=errors[0] > 0)
+            adaptive.append({'threads': threads, 'mb_s': round(total_mb / seconds, 2), 'http_429': rejected[0]})
+    finally:
+        server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+    return {
+        'bench': 'fragments', 'fragments': args.fragments, 'fragment_kb': args.fragment_kb,
+        'conn_kbps': args.conn_kbps, 'latency_ms': args.latency_ms, 'server_limit': args.server_limit,
+        'levels': levels, 'adaptive': adaptive,
+    }
+
+def bench_audio(args):
+    """Пропускная способность пакета полного аудио: перепаковка исходного потока против конвертации в MP3.
+
+    Источник - синтетический трек (args.codec, args.track_seconds), размноженный на args.tracks файлов.
+    Обработка идёт так же, как на стадии обработки конвейера: StagePool на POSTPROCESS_WORKERS
+    с бюджетом потоков ffmpeg, convert_audio с тегами.
+    """
+    base_path = get_base_path()
+    ffmpeg_exe, ffprobe_exe = find_tool(base_path, 'ffmpeg'), find_tool(base_path, 'ffprobe')
+    if not os.path.isfile(ffmpeg_exe) or not os.path.isfile(ffprobe_exe):
+        return {'error': "ffmpeg/ffprobe не найден"}
+    root = tempfile.mkdtemp(prefix='bench_audio_')
+    try:
+        encoder, ext = {'aac': (['-c:a', 'aac', '-b:a', '128k'], '.m4a'), 'opus': (['-c:a', 'libopus', '-b:a', '128k'], '.webm')}[args.codec]
+        source = os.path.join(root, 'source' + ext)
+        run_ffmpeg([ffmpeg_exe, '-y', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={args.track_seconds}',
+                    '-ac', '2', *encoder, source])
+        tracks = []
+        for i in range(args.tracks):
+            path = os.path.join(root, f'track{i}{ext}')
+            shutil.copyfile(source, path)
+            tracks.append(path)
+        info = {'title': 'Bench track', 'uploader': 'bench', 'upload_date': '20240101', 'webpage_url': 'https://example.com'}
+        threads = get_ffmpeg_threads(POSTPROCESS_WORKERS)
+        result = {'tracks': args.tracks, 'track_seconds': args.track_seconds, 'codec': args.codec,
+                  'workers': POSTPROCESS_WORKERS, 'threads': threads}
+        for mode in ('passthrough', 'mp3'):
+            task = {'conv': mode == 'mp3', 'bitrate': 'auto'}
+            profile = get_encoding_profile('auto', 'auto', threads)
+            cpu_total = [0.0]
+            outputs = []
+            lock = threading.Lock()
+
+            def process(src):
+                with track_cpu() as cpu:
+                    out_ext, codec_args = plan_audio_cut(ffprobe_exe, src, wants_mp3(task, profile), 'auto', profile['audio_bitrate'])
+                    dst = os.path.splitext(src)[0] + f'.{mode}{out_ext}'
+                    convert_audio(ffmpeg_exe, src, dst, codec_args + get_audio_output_args(info, out_ext), threads)
+                with lock:
+                    cpu_total[0] += cpu[0]
+                    outputs.append(dst)
+
+            pool = StagePool('bench', POSTPROCESS_WORKERS)
+            started = time.perf_counter()
+            for src in tracks:
+                pool.submit(process, src)
+            pool.wait_idle()
+            seconds = time.perf_counter() - started
+            result[mode] = {
+                'seconds': round(seconds, 3),
+                'tracks_per_s': round(len(outputs) / seconds, 2) if seconds else None,
+                'cpu_seconds': round(cpu_total[0], 3),
+                'output_mb': round(sum(os.path.getsize(p) for p in outputs) / 1024 / 1024, 2),
+                'ext': os.path.splitext(outputs[0])[1] if outputs else None,
+            }
+        if result['passthrough']['seconds']:
+            result['speedup'] = round(result['mp3']['seconds'] / result['passthrough']['seconds'], 1)
+        return result
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+BENCHMARKS = {
+    'queue-view': bench_queue_view,
+    'fragments': bench_fragments,
+    'audio': bench_audio,
+}
+
+def run_bench(argv):
+    """python yt-dlp-ultimate.py --bench NAME [параметры]. Печатает результат одной строкой JSON"""
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]))
+    parser.add_argument('--bench', required=True, choices=sorted(BENCHMARKS))
+    parser.add_argument('--tasks', type=int, default=10000, help="размер очереди (queue-view)")
+    parser.add_argument('--fragments', type=int, default=40, help="число фрагментов HLS (fragments)")
+    parser.add_argument('--fragment-kb', type=int, default=256, help="размер фрагмента, КБ (fragments)")
+    parser.add_argument('--conn-kbps', type=int, default=2048, help="скорость одного соединения сервера, КБ/с (fragments)")
+    parser.add_argument('--latency-ms', type=int, default=50, help="задержка ответа сервера, мс (fragments)")
+    parser.add_argument('--server-limit', type=int, default=6, help="одновременных запросов до ответа 429, 0 - без лимита (fragments)")
+    parser.add_argument('--levels', type=int, nargs='+', default=list(FRAGMENT_CONCURRENCY_VALUES), help="числа потоков (fragments)")
+    parser.add_argument('--budget', type=int, default=16, help="бюджет соединений адаптивного режима (fragments)")
+    parser.add_argument('--rounds', type=int, default=8, help="скачиваний в адаптивном режиме (fragments)")
+    parser.add_argument('--tracks', type=int, default=20, help="треков в пакете (audio)")
+    parser.add_argument('--track-seconds', type=int, default=180, help="длина трека, сек (audio)")
+    parser.add_argument('--codec', choices=('aac', 'opus'), default='aac', help="кодек исходного трека (audio)")
+    args = parser.parse_args(argv)
+    print(json.dumps(BENCHMARKS[args.bench](args), ensure_ascii=False))
+    return EXIT_OK
 
 if __name__ == "__main__":
+    if '--bench' in sys.argv[1:]:
+        sys.exit(run_bench(sys.argv[1:]))
+    if HEADLESS:
+        sys.exit(run_cli(sys.argv[1:]))
     app = ModernYouTubeCutter()
     app.mainloop()